@@ -1,32 +1,57 @@
-from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QColorDialog, QCheckBox
-from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QColorDialog, QCheckBox, QProgressBar, QScrollArea
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, QTimer, Qt, Signal
+from PySide6.QtGui import QImage, QPixmap
 import os
+import re
 import sys
+import time
+import functools
 import psutil
+import threading
+import subprocess
 from pathlib import Path
 
+from chunk_scheduler import default_process_num
+from render_service import connect_service
+from video_to_char import CharRenderer, grab_frame, ffmpeg_binaries, probe_video, frame_memory_bytes
 
-def kill_python_processes():
-    # 获取系统中所有进程
-    for proc in psutil.process_iter():
+# video_to_char.py --PROGRESS yes 输出的进度行："12/345 frames | 6.7 fps | ..."
+PROGRESS_PATTERN = re.compile(r"(\d+)/(\d+) frames \| ([\d.]+) fps")
+
+
+def terminate_process_tree(pid: int, timeout: float = 5.0) -> None:
+    """
+    只结束这个任务自己的进程树（转换进程、它的 worker 和 ffmpeg），先 terminate，超时再 kill
+    """
+    try:
+        parent = psutil.Process(pid)
+        processes = parent.children(recursive=True) + [parent]
+    except psutil.NoSuchProcess:
+        return
+    for proc in processes:
+        try:
+            proc.terminate()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    _, alive = psutil.wait_procs(processes, timeout=timeout)
+    for proc in alive:
         try:
-            # 获取进程的名称
-            proc_name = proc.name()
-
-            # 如果进程名称包含"python"，则杀死该进程
-            if 'python' in proc_name.lower():
-                proc.kill()
-                print(f"Killed process: {proc_name}")
-        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            proc.kill()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
             pass
 
 
 class WorkerSignals(QObject):
+    started = Signal()
+    progress = Signal(int, int, float)
     finished = Signal(str)
+    finished_on_service = Signal(str)
+    cancelled = Signal()
     error = Signal(str)
 
 class LongPerformTask(QRunnable):
-    def __init__(self, VIDEO, TEXT_COLOR, BG_COLOR, MOSAIC, PROCESS_NUM, DELETE_FRAMES_AFTER_PROCESSED):
+    def __init__(self, VIDEO, TEXT_COLOR, BG_COLOR, MOSAIC, PROCESS_NUM, DELETE_FRAMES_AFTER_PROCESSED,
+                 COLUMNS="100", TEXT_SIZE=10, BLOCK_SIZE=20, TARGET_FPS=0, CONCURRENCY=1):
         super(LongPerformTask, self).__init__()
         self.signals = WorkerSignals()
         self.VIDEO = VIDEO
@@ -35,18 +60,202 @@ class LongPerformTask(QRunnable):
         self.MOSAIC = MOSAIC
         self.PROCESS_NUM = PROCESS_NUM
         self.DELETE_FRAMES_AFTER_PROCESSED = DELETE_FRAMES_AFTER_PROCESSED
+        self.COLUMNS = COLUMNS
+        self.TEXT_SIZE = TEXT_SIZE
+        self.BLOCK_SIZE = BLOCK_SIZE
+        self.TARGET_FPS = TARGET_FPS
+        # 同时运行的任务数，排队期间界面改了也会同步过来，启动时才按它分配进程数
+        self.CONCURRENCY = CONCURRENCY
+        self.process = None
+        self.is_cancelled = False
+        self.lock = threading.Lock()
+        # 任务对象在界面上还要用到，运行结束后不能被线程池删除
+        self.setAutoDelete(False)
+
+    def cancel(self):
+        # 排队中的任务直接标记；运行中的任务结束它自己的进程树
+        with self.lock:
+            self.is_cancelled = True
+            process = self.process
+        if process is not None:
+            terminate_process_tree(process.pid)
+
+    def process_num(self):
+        # 同时运行多个任务时平分 CPU 和内存，否则每个任务都按整机自动决定，N 个任务会起 N × 核数个 worker
+        concurrency = max(self.CONCURRENCY, 1)
+        if self.PROCESS_NUM > 0:
+            return max(self.PROCESS_NUM // concurrency, 1)
+        if concurrency == 1:
+            # 只有一个任务时仍交给转换进程按视频尺寸自动决定
+            return 0
+        # 与 video_to_char.py 的自动进程数相同的估算，再按任务数分摊
+        _, ffprobe_path = ffmpeg_binaries(Path(__file__).resolve().parent)
+        video_info = probe_video(ffprobe_path, self.VIDEO)
+        frame_bytes = frame_memory_bytes((int(video_info["width"]), int(video_info["height"])),
+                                         text_size=self.TEXT_SIZE, block_size=self.BLOCK_SIZE,
+                                         columns=int(self.COLUMNS) if self.COLUMNS.isdigit() else 0,
+                                         mosaic=self.MOSAIC == "yes") if "width" in video_info else 0
+        return max(default_process_num(frame_bytes) // concurrency, 1)
+
+    def command(self, process_num):
+        installed_path = Path(__file__).resolve().parent
+        python_path = f"{installed_path}/venv_win/Scripts/python.exe" if psutil.WINDOWS else f"{installed_path}/venv/bin/python"
+        if not os.path.exists(python_path):
+            python_path = sys.executable
+        return [python_path, f"{installed_path}/video_to_char.py", "--VIDEO", f"{self.VIDEO}",
+                "--TEXT_COLOR", f"{self.TEXT_COLOR}", "--BG_COLOR", f"{self.BG_COLOR}", "--MOSAIC", f"{self.MOSAIC}",
+                "--PROCESS_NUM", f"{process_num}", "--DELETE_FRAMES_AFTER_PROCESSED", f"{self.DELETE_FRAMES_AFTER_PROCESSED}",
+                "--COLUMNS", f"{self.COLUMNS}", "--TEXT_SIZE", f"{self.TEXT_SIZE}", "--BLOCK_SIZE", f"{self.BLOCK_SIZE}",
+                "--TARGET_FPS", f"{self.TARGET_FPS}", "--PROGRESS", "yes"]
 
     def run(self):
+        if self.is_cancelled:
+            self.signals.cancelled.emit()
+            return
+        self.signals.started.emit()
         try:
-            installed_path = Path(__file__).resolve().parent
-            command_win = f"{installed_path}/venv_win/Scripts/python.exe {installed_path}/video_to_char.py --VIDEO {self.VIDEO} --TEXT_COLOR {self.TEXT_COLOR} --BG_COLOR {self.BG_COLOR} --MOSAIC {self.MOSAIC} --PROCESS_NUM {self.PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {self.DELETE_FRAMES_AFTER_PROCESSED}"
-            command_mac = f"{installed_path}/venv/bin/python {installed_path}/video_to_char.py --VIDEO {self.VIDEO} --TEXT_COLOR '{self.TEXT_COLOR}' --BG_COLOR '{self.BG_COLOR}' --MOSAIC {self.MOSAIC} --PROCESS_NUM {self.PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {self.DELETE_FRAMES_AFTER_PROCESSED}"
-            command = command_win if psutil.WINDOWS else command_mac
-            result = os.system(command)
-            self.signals.finished.emit(f"{result}")
+            # 常驻渲染服务已启动时直接提交任务，省去启动解释器、worker 和加载字体的开销
+            # 渲染服务只支持默认的网格大小
+            default_grid = (self.COLUMNS, self.TEXT_SIZE, self.BLOCK_SIZE) == ("100", 10, 20)
+            service = connect_service() if default_grid else None
+            if service is not None:
+                job_id = service.submit(self.VIDEO, text_color=self.TEXT_COLOR, bg_color=self.BG_COLOR,
+                                        mosaic=self.MOSAIC == "yes",
+                                        delete_frames_after_processed=self.DELETE_FRAMES_AFTER_PROCESSED == "yes")
+                while not self.is_cancelled:
+                    job = service.status(job_id)
+                    self.signals.progress.emit(job["done"], job["total"], job["fps"])
+                    if job["state"] in ("finished", "failed"):
+                        self.signals.finished_on_service.emit(f"{job['state']} {job['output']}{job['error']}")
+                        return
+                    if job["state"] == "cancelled":
+                        break
+                    time.sleep(0.5)
+                # 让服务停掉这个任务，剩下的帧不再占用共享的 worker 池
+                service.cancel(job_id)
+                self.signals.cancelled.emit()
+                return
+
+            process_num = self.process_num()
+            with self.lock:
+                if self.is_cancelled:
+                    self.signals.cancelled.emit()
+                    return
+                self.process = subprocess.Popen(self.command(process_num), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            # 进度行以 \r 刷新，按块读取后取最后一个完整的进度
+            while True:
+                data = self.process.stdout.read1(4096)
+                if not data:
+                    break
+                matches = PROGRESS_PATTERN.findall(data.decode("utf-8", errors="replace"))
+                if matches:
+                    done, total, fps = matches[-1]
+                    self.signals.progress.emit(int(done), int(total), float(fps))
+            result = self.process.wait()
+            if self.is_cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(f"{result}")
         except Exception as e:
             self.signals.error.emit(f"{e}")
 
+
+# 预览用的源帧缩到这个宽度以内：不开马赛克时字符网格只取决于列数，缩小不影响预览效果；
+# 马赛克的 block_size 按源帧像素计算，缩小后块会变粗，这时取原尺寸的帧
+PREVIEW_FRAME_WIDTH = 640
+
+
+@functools.lru_cache(maxsize=8)
+def preview_frame(video: str, seconds: float, mosaic: bool = False):
+    # 拖动时间或改颜色时反复用到同一帧，ffmpeg 定位只做一次
+    ffmpeg_path, _ = ffmpeg_binaries(Path(__file__).resolve().parent)
+    return grab_frame(ffmpeg_path, video, seconds, max_width=0 if mosaic else PREVIEW_FRAME_WIDTH)
+
+
+@functools.lru_cache(maxsize=4)
+def preview_renderer(**render_options) -> CharRenderer:
+    return CharRenderer(**render_options)
+
+
+class PreviewSignals(QObject):
+    finished = Signal(int, QImage, float)
+    error = Signal(int, str)
+
+
+class PreviewTask(QRunnable):
+    """
+    在后台线程取帧并渲染预览，结果带上请求序号，界面只显示最新一次请求的结果
+    """
+
+    def __init__(self, serial: int, video: str, seconds: float, render_options: dict):
+        super().__init__()
+        self.signals = PreviewSignals()
+        self.serial = serial
+        self.video = video
+        self.seconds = seconds
+        self.render_options = render_options
+
+    def run(self):
+        try:
+            start = time.perf_counter()
+            frame = preview_frame(self.video, self.seconds, self.render_options.get("mosaic", False))
+            out = preview_renderer(**self.render_options).render_image(frame)
+            # QPixmap 只能在界面线程创建，这里先转成 QImage（copy 后不再引用 out 的内存）
+            image = QImage(out.tobytes(), out.width, out.height, out.width * 3, QImage.Format_RGB888).copy()
+            self.signals.finished.emit(self.serial, image, (time.perf_counter() - start) * 1000)
+        except Exception as e:
+            self.signals.error.emit(self.serial, f"{e}")
+
+
+class JobRow(QWidget):
+    """
+    任务列表中的一行：视频名、进度条、帧率和状态、取消按钮
+    """
+
+    def __init__(self, task: LongPerformTask):
+        super().__init__()
+        self.task = task
+        self.layout = QHBoxLayout()
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.layout)
+        self.name_label = QLabel(Path(task.VIDEO).name)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat('%v/%m')
+        self.progress_bar.setMaximum(0)
+        self.state_label = QLabel('排队中')
+        self.state_label.setFixedWidth(120)
+        self.cancel_button = QPushButton('取消')
+        self.cancel_button.clicked.connect(self.cancel)
+        self.layout.addWidget(self.name_label)
+        self.layout.addWidget(self.progress_bar)
+        self.layout.addWidget(self.state_label)
+        self.layout.addWidget(self.cancel_button)
+
+        task.signals.started.connect(lambda: self.state_label.setText('运行中'))
+        task.signals.progress.connect(self.update_progress)
+        task.signals.finished.connect(lambda s: self.done('完成' if s == '0' else f'失败({s})'))
+        task.signals.finished_on_service.connect(lambda s: self.done('完成' if s.startswith('finished') else '失败'))
+        task.signals.cancelled.connect(lambda: self.done('已取消'))
+        task.signals.error.connect(lambda s: self.done(f'错误：{s}'))
+
+    def update_progress(self, done: int, total: int, fps: float):
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        self.state_label.setText(f'{fps:.1f} fps')
+
+    def cancel(self):
+        self.cancel_button.setEnabled(False)
+        self.state_label.setText('取消中')
+        # 结束进程树可能要等几秒，不阻塞界面线程
+        threading.Thread(target=self.task.cancel, daemon=True).start()
+
+    def done(self, state: str):
+        if self.progress_bar.maximum() == 0:
+            self.progress_bar.setMaximum(1)
+        self.state_label.setText(state)
+        self.cancel_button.setEnabled(False)
+
+
 class VideoToASCIIConverter(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -55,6 +264,18 @@ class VideoToASCIIConverter(QMainWindow):
         self.setCentralWidget(self.central_widget)
         self.layout = QVBoxLayout()
         self.central_widget.setLayout(self.layout)
+        # 任务队列：超出并发上限的任务在线程池里排队
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.job_rows = []
+        # 预览：改动后等 debounce 结束再渲染，同时只渲染一帧，过时的结果直接丢弃
+        self.preview_pool = QThreadPool()
+        self.preview_pool.setMaxThreadCount(1)
+        self.preview_serial = 0
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(150)
+        self.preview_timer.timeout.connect(self.start_preview)
         self.init_ui()
 
     def init_ui(self):
@@ -89,12 +310,35 @@ class VideoToASCIIConverter(QMainWindow):
         self.bg_color_layout.addWidget(self.select_bg_color_button)
 
         self.process_num_layout = QHBoxLayout()
-        self.process_num_label = QLabel('进程数：')
-        self.process_num_input = QLineEdit('10')
+        self.process_num_label = QLabel('进程数(0为自动)：')
+        self.process_num_input = QLineEdit('0')
         self.process_num_input.setFixedWidth(100)
         self.process_num_layout.addWidget(self.process_num_label)
         self.process_num_layout.addWidget(self.process_num_input)
 
+        # 字符网格：列数可填 auto，按目标帧率自动选择
+        self.grid_layout = QHBoxLayout()
+        self.columns_label = QLabel('列数(auto为自动)：')
+        self.columns_input = QLineEdit('100')
+        self.columns_input.setFixedWidth(60)
+        self.text_size_label = QLabel('字号：')
+        self.text_size_input = QLineEdit('10')
+        self.text_size_input.setFixedWidth(40)
+        self.block_size_label = QLabel('马赛克块：')
+        self.block_size_input = QLineEdit('20')
+        self.block_size_input.setFixedWidth(40)
+        self.target_fps_label = QLabel('目标帧率：')
+        self.target_fps_input = QLineEdit('0')
+        self.target_fps_input.setFixedWidth(40)
+        self.grid_layout.addWidget(self.columns_label)
+        self.grid_layout.addWidget(self.columns_input)
+        self.grid_layout.addWidget(self.text_size_label)
+        self.grid_layout.addWidget(self.text_size_input)
+        self.grid_layout.addWidget(self.block_size_label)
+        self.grid_layout.addWidget(self.block_size_input)
+        self.grid_layout.addWidget(self.target_fps_label)
+        self.grid_layout.addWidget(self.target_fps_input)
+
         self.options_layout = QHBoxLayout()
         self.delete_frames_checkbox = QCheckBox('转换后删除帧')
         self.delete_frames_checkbox.setChecked(True)
@@ -102,15 +346,54 @@ class VideoToASCIIConverter(QMainWindow):
         self.options_layout.addWidget(self.delete_frames_checkbox)
         self.options_layout.addWidget(self.mosaic_checkbox)
 
-        self.start_button = QPushButton('开始')
+        self.concurrency_layout = QHBoxLayout()
+        self.concurrency_label = QLabel('同时运行的任务数：')
+        self.concurrency_input = QLineEdit('1')
+        self.concurrency_input.setFixedWidth(100)
+        self.concurrency_input.editingFinished.connect(self.update_concurrency)
+        self.concurrency_layout.addWidget(self.concurrency_label)
+        self.concurrency_layout.addWidget(self.concurrency_input)
+
+        self.start_button = QPushButton('加入队列')
         self.start_button.clicked.connect(self.start_conversion)
 
+        self.jobs_widget = QWidget()
+        self.jobs_layout = QVBoxLayout()
+        self.jobs_layout.addStretch()
+        self.jobs_widget.setLayout(self.jobs_layout)
+        self.jobs_area = QScrollArea()
+        self.jobs_area.setWidgetResizable(True)
+        self.jobs_area.setWidget(self.jobs_widget)
+        self.jobs_area.setMinimumHeight(160)
+
         self.layout.addLayout(self.video_input_layout)
         self.layout.addLayout(self.text_color_layout)
         self.layout.addLayout(self.bg_color_layout)
         self.layout.addLayout(self.process_num_layout)
+        self.layout.addLayout(self.grid_layout)
         self.layout.addLayout(self.options_layout)
+        self.layout.addLayout(self.concurrency_layout)
         self.layout.addWidget(self.start_button)
+        self.layout.addWidget(self.jobs_area)
+
+        self.preview_layout = QHBoxLayout()
+        self.preview_time_label = QLabel('预览时间(秒)：')
+        self.preview_time_input = QLineEdit('0')
+        self.preview_time_input.setFixedWidth(60)
+        self.preview_state_label = QLabel('')
+        self.preview_layout.addWidget(self.preview_time_label)
+        self.preview_layout.addWidget(self.preview_time_input)
+        self.preview_layout.addWidget(self.preview_state_label)
+        self.preview_label = QLabel('选择视频后显示预览')
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setMinimumSize(480, 270)
+        self.layout.addLayout(self.preview_layout)
+        self.layout.addWidget(self.preview_label, 1)
+
+        for line_edit in (self.video_input, self.text_color_input, self.bg_color_input, self.columns_input,
+                          self.text_size_input, self.block_size_input, self.preview_time_input):
+            line_edit.textChanged.connect(self.schedule_preview)
+        self.mosaic_checkbox.stateChanged.connect(self.schedule_preview)
 
     def select_video_file(self):
         file_dialog = QFileDialog()
@@ -135,25 +418,99 @@ class VideoToASCIIConverter(QMainWindow):
         text_color = self.text_color_input.text()
         bg_color = self.bg_color_input.text()
         mosaic = "yes" if self.mosaic_checkbox.isChecked() else "no"
-        process_num = int(self.process_num_input.text()) if self.process_num_input.text().isdigit() else 6
+        process_num = int(self.process_num_input.text()) if self.process_num_input.text().isdigit() else 0
         delete_frames_after_processed = "yes" if self.delete_frames_checkbox.isChecked() else "no"
+        columns = self.columns_input.text() if self.columns_input.text() == "auto" or self.columns_input.text().isdigit() else "100"
+        text_size = int(self.text_size_input.text()) if self.text_size_input.text().isdigit() else 10
+        block_size = int(self.block_size_input.text()) if self.block_size_input.text().isdigit() else 20
+        try:
+            target_fps = float(self.target_fps_input.text())
+        except ValueError:
+            target_fps = 0
         print("\n\n视频：{}\n"
               "字色：{}\n"
               "背景：{}\n"
               "马赛克：{}，{}\n"
               "进程：{}\n"
-              "后续：{}, {}\n".format(video_or_image, text_color, bg_color, mosaic, type(mosaic), process_num, delete_frames_after_processed, type(delete_frames_after_processed)))
+              "网格：{} 列，字号 {}，马赛克块 {}，目标帧率 {}\n"
+              "后续：{}, {}\n".format(video_or_image, text_color, bg_color, mosaic, type(mosaic), process_num, columns, text_size, block_size, target_fps, delete_frames_after_processed, type(delete_frames_after_processed)))
         # Create a QRunnable
-        long_perform_task = LongPerformTask(video_or_image, text_color, bg_color, mosaic, process_num, delete_frames_after_processed)
+        long_perform_task = LongPerformTask(video_or_image, text_color, bg_color, mosaic, process_num, delete_frames_after_processed,
+                                            columns, text_size, block_size, target_fps, self.pool.maxThreadCount())
         # Put the task into the thread pool to run
         long_perform_task.signals.finished.connect(self.result)
+        long_perform_task.signals.finished_on_service.connect(self.result_on_service)
         long_perform_task.signals.error.connect(self.error)
 
-        QThreadPool.globalInstance().start(long_perform_task)
+        job_row = JobRow(long_perform_task)
+        self.job_rows.append(job_row)
+        self.jobs_layout.insertWidget(self.jobs_layout.count() - 1, job_row)
+        self.pool.start(long_perform_task)
+
+    def schedule_preview(self, *_):
+        # 连续输入时不断重新计时，停下来才渲染
+        self.preview_timer.start()
+
+    def start_preview(self):
+        video = self.video_input.text()
+        if not os.path.isfile(video):
+            return
+        try:
+            seconds = float(self.preview_time_input.text())
+        except ValueError:
+            seconds = 0.0
+        columns = self.columns_input.text()
+        render_options = dict(
+            text_size=int(self.text_size_input.text()) if self.text_size_input.text().isdigit() else 10,
+            block_size=int(self.block_size_input.text()) if self.block_size_input.text().isdigit() else 20,
+            # 自动列数要在转换时标定，预览按默认的 100 列
+            width=int(columns) if columns.isdigit() else 100,
+            mosaic=self.mosaic_checkbox.isChecked(),
+            bg_color=self.bg_color_input.text(),
+            text_color=self.text_color_input.text())
+        self.preview_serial += 1
+        task = PreviewTask(self.preview_serial, video, seconds, render_options)
+        task.signals.finished.connect(self.show_preview)
+        task.signals.error.connect(self.preview_error)
+        # 还没开始的旧请求不再需要
+        self.preview_pool.clear()
+        self.preview_pool.start(task)
+        self.preview_state_label.setText('渲染中…')
+
+    def show_preview(self, serial: int, image: QImage, milliseconds: float):
+        if serial != self.preview_serial:
+            return
+        pixmap = QPixmap.fromImage(image).scaled(self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.preview_label.setPixmap(pixmap)
+        self.preview_state_label.setText(f'{image.width()}x{image.height()}，{milliseconds:.0f} ms')
+
+    def preview_error(self, serial: int, s: str):
+        if serial == self.preview_serial:
+            self.preview_state_label.setText(f'预览失败：{s}')
+
+    def update_concurrency(self):
+        text = self.concurrency_input.text()
+        self.pool.setMaxThreadCount(max(int(text), 1) if text.isdigit() else 1)
+        for job_row in self.job_rows:
+            job_row.task.CONCURRENCY = self.pool.maxThreadCount()
+
+    def closeEvent(self, event):
+        # 关闭窗口时结束所有未完成的任务，不留下孤儿进程
+        self.preview_timer.stop()
+        self.preview_pool.clear()
+        self.preview_pool.waitForDone()
+        self.pool.clear()
+        for job_row in self.job_rows:
+            job_row.task.cancel()
+        self.pool.waitForDone()
+        super().closeEvent(event)
 
     def result(self, s):
         print(f"运行结果退出码:{s}")
-        kill_python_processes()
+
+    def result_on_service(self, s):
+        # 服务里的 worker 需要常驻，不能清理进程
+        print(f"渲染服务运行结果:{s}")
 
     def error(self, s):
         print(f"发生错误:{s}")
@@ -20,7 +20,8 @@ def kill_python_processes():
             pass
 
 
-def long_perform(VIDEO, TEXT_COLOR, BG_COLOR, MOSAIC, PROCESS_NUM, DELETE_FRAMES_AFTER_PROCESSED):
+def long_perform(VIDEO, TEXT_COLOR, BG_COLOR, MOSAIC, PROCESS_NUM, DELETE_FRAMES_AFTER_PROCESSED,
+                 COLUMNS="100", TEXT_SIZE=10, BLOCK_SIZE=20, TARGET_FPS=0):
     '''
     VIDEO = args.VIDEO
     TEXT_COLOR = args.TEXT_COLOR  # 如果是auto，则自动计算颜色，提取自原视频
@@ -31,8 +32,8 @@ def long_perform(VIDEO, TEXT_COLOR, BG_COLOR, MOSAIC, PROCESS_NUM, DELETE_FRAMES
     :return:
     '''
     installed_path = Path(__file__).resolve().parent
-    command_win = f"{installed_path}/venv/Scripts/python.exe {installed_path}/video_to_char.py --VIDEO {VIDEO} --TEXT_COLOR {TEXT_COLOR} --BG_COLOR {BG_COLOR} --MOSAIC {MOSAIC} --PROCESS_NUM {PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {DELETE_FRAMES_AFTER_PROCESSED}"
-    command_mac = f"{installed_path}/venv/bin/python {installed_path}/video_to_char.py --VIDEO {VIDEO} --TEXT_COLOR '{TEXT_COLOR}' --BG_COLOR '{BG_COLOR}' --MOSAIC {MOSAIC} --PROCESS_NUM {PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {DELETE_FRAMES_AFTER_PROCESSED}"
+    command_win = f"{installed_path}/venv/Scripts/python.exe {installed_path}/video_to_char.py --VIDEO {VIDEO} --TEXT_COLOR {TEXT_COLOR} --BG_COLOR {BG_COLOR} --MOSAIC {MOSAIC} --PROCESS_NUM {PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {DELETE_FRAMES_AFTER_PROCESSED} --COLUMNS {COLUMNS} --TEXT_SIZE {TEXT_SIZE} --BLOCK_SIZE {BLOCK_SIZE} --TARGET_FPS {TARGET_FPS}"
+    command_mac = f"{installed_path}/venv/bin/python {installed_path}/video_to_char.py --VIDEO {VIDEO} --TEXT_COLOR '{TEXT_COLOR}' --BG_COLOR '{BG_COLOR}' --MOSAIC {MOSAIC} --PROCESS_NUM {PROCESS_NUM} --DELETE_FRAMES_AFTER_PROCESSED {DELETE_FRAMES_AFTER_PROCESSED} --COLUMNS {COLUMNS} --TEXT_SIZE {TEXT_SIZE} --BLOCK_SIZE {BLOCK_SIZE} --TARGET_FPS {TARGET_FPS}"
     command = command_win if psutil.WINDOWS else command_mac
     return os.system(command)
 
@@ -78,12 +79,35 @@ class VideoToASCIIConverter(QMainWindow):
         self.bg_color_layout.addWidget(self.select_bg_color_button)
 
         self.process_num_layout = QHBoxLayout()
-        self.process_num_label = QLabel('进程数：')
-        self.process_num_input = QLineEdit('10')
+        self.process_num_label = QLabel('进程数(0为自动)：')
+        self.process_num_input = QLineEdit('0')
         self.process_num_input.setFixedWidth(100)
         self.process_num_layout.addWidget(self.process_num_label)
         self.process_num_layout.addWidget(self.process_num_input)
 
+        # 字符网格：列数可填 auto，按目标帧率自动选择
+        self.grid_layout = QHBoxLayout()
+        self.columns_label = QLabel('列数(auto为自动)：')
+        self.columns_input = QLineEdit('100')
+        self.columns_input.setFixedWidth(60)
+        self.text_size_label = QLabel('字号：')
+        self.text_size_input = QLineEdit('10')
+        self.text_size_input.setFixedWidth(40)
+        self.block_size_label = QLabel('马赛克块：')
+        self.block_size_input = QLineEdit('20')
+        self.block_size_input.setFixedWidth(40)
+        self.target_fps_label = QLabel('目标帧率：')
+        self.target_fps_input = QLineEdit('0')
+        self.target_fps_input.setFixedWidth(40)
+        self.grid_layout.addWidget(self.columns_label)
+        self.grid_layout.addWidget(self.columns_input)
+        self.grid_layout.addWidget(self.text_size_label)
+        self.grid_layout.addWidget(self.text_size_input)
+        self.grid_layout.addWidget(self.block_size_label)
+        self.grid_layout.addWidget(self.block_size_input)
+        self.grid_layout.addWidget(self.target_fps_label)
+        self.grid_layout.addWidget(self.target_fps_input)
+
         self.options_layout = QHBoxLayout()
         self.delete_frames_checkbox = QCheckBox('转换后删除帧')
         self.delete_frames_checkbox.setChecked(True)
@@ -98,6 +122,7 @@ class VideoToASCIIConverter(QMainWindow):
         self.layout.addLayout(self.text_color_layout)
         self.layout.addLayout(self.bg_color_layout)
         self.layout.addLayout(self.process_num_layout)
+        self.layout.addLayout(self.grid_layout)
         self.layout.addLayout(self.options_layout)
         self.layout.addWidget(self.start_button)
 
@@ -124,18 +149,27 @@ class VideoToASCIIConverter(QMainWindow):
         text_color = self.text_color_input.text()
         bg_color = self.bg_color_input.text()
         mosaic = "yes" if self.mosaic_checkbox.isChecked() else "no"
-        process_num = int(self.process_num_input.text()) if self.process_num_input.text().isdigit() else 6
+        process_num = int(self.process_num_input.text()) if self.process_num_input.text().isdigit() else 0
         delete_frames_after_processed = "yes" if self.delete_frames_checkbox.isChecked() else "no"
+        columns = self.columns_input.text() if self.columns_input.text() == "auto" or self.columns_input.text().isdigit() else "100"
+        text_size = int(self.text_size_input.text()) if self.text_size_input.text().isdigit() else 10
+        block_size = int(self.block_size_input.text()) if self.block_size_input.text().isdigit() else 20
+        try:
+            target_fps = float(self.target_fps_input.text())
+        except ValueError:
+            target_fps = 0
         print("\n\n视频：{}\n"
               "字色：{}\n"
               "背景：{}\n"
               "马赛克：{}，{}\n"
               "进程：{}\n"
-              "后续：{}, {}\n".format(video_or_image, text_color, bg_color, mosaic, type(mosaic), process_num, delete_frames_after_processed, type(delete_frames_after_processed)))
+              "网格：{} 列，字号 {}，马赛克块 {}，目标帧率 {}\n"
+              "后续：{}, {}\n".format(video_or_image, text_color, bg_color, mosaic, type(mosaic), process_num, columns, text_size, block_size, target_fps, delete_frames_after_processed, type(delete_frames_after_processed)))
         # Perform the conversion here
         # Call your conversion function with the parameters
         long_perform(VIDEO=video_or_image, TEXT_COLOR=text_color, BG_COLOR=bg_color, MOSAIC=mosaic,
-                     PROCESS_NUM=process_num, DELETE_FRAMES_AFTER_PROCESSED=delete_frames_after_processed)
+                     PROCESS_NUM=process_num, DELETE_FRAMES_AFTER_PROCESSED=delete_frames_after_processed,
+                     COLUMNS=columns, TEXT_SIZE=text_size, BLOCK_SIZE=block_size, TARGET_FPS=target_fps)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,479 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Optional, Tuple
+
+import psutil
+
+from chunk_scheduler import OrderedProgress, default_process_num
+from job_manifest import JobManifest, JobLock, video_hash, options_key, already_encoded
+from pipeline_report import StageTimer
+from render_cache import RenderCache
+from frame_format import FRAME_FORMATS, frame_extension, frame_validator
+from segment_encoder import SegmentEncoder
+from video_to_char import (WorkerProcess, IncrementalRenderer, ffmpeg_binaries, get_video_rate, extract_frames,
+                           grab_frame, char_grid_size, out_video_path, clear_folder, video_palette, probe_video,
+                           frame_memory_bytes)
+from color_palette import PALETTE_MODES
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm", ".flv")
+SCHEDULES = ("fair", "priority")
+
+
+def collect_videos(paths: List[str]) -> List[str]:
+    """
+    展开目录（只取一层，按文件名排序），去掉内容相同的重复视频，保持给出的顺序
+    """
+    videos, hashes = list(), set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = sorted(f"{Path(path) / file}" for file in os.listdir(path)
+                                if file.lower().endswith(VIDEO_EXTENSIONS) and not file.startswith("out_"))
+        else:
+            candidates = [path]
+        for video in candidates:
+            video = f"{Path(video).resolve()}"
+            digest = video_hash(video)
+            if digest not in hashes:
+                hashes.add(digest)
+                videos.append(video)
+    return videos
+
+
+class BatchWorkerProcess(WorkerProcess):
+    """
+    批量模式的共享 worker：从自己的任务队列领取任意视频的一段连续帧，按任务里带的参数渲染，
+    渲染流程与 WorkerProcess 完全相同，字形图集和渲染缓存跨视频复用
+    """
+
+    def __init__(self, task_queue: multiprocessing.Queue, result_queue: multiprocessing.Queue, cache_options: dict = None):
+        super().__init__(None, [], result_queue, "", "", verbose=False, cache_options=cache_options)
+        self.task_queue = task_queue
+
+    def run(self):
+        self.cache = RenderCache(**self.cache_options) if self.cache_options is not None else None
+        timer = StageTimer()
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            job_index, span, frames, job_options = task
+            self.input_folder = job_options["input_folder"]
+            self.output_folder = job_options["output_folder"]
+            self.text_color = job_options["text_color"]
+            self.bg_color = job_options["bg_color"]
+            self.mosaic = job_options["mosaic"]
+            self.delta = job_options["delta"]
+            self.color_tolerance = job_options["color_tolerance"]
+            self.text_size = job_options["text_size"]
+            self.block_size = job_options["block_size"]
+            self.columns = job_options["columns"]
+            self.frame_format = job_options["frame_format"]
+            self.frame_size = job_options["frame_size"]
+            self.palette = job_options.get("palette_colors")
+            renderer = IncrementalRenderer(text_size=self.text_size,
+                                           bg_color=self.bg_color,
+                                           text_color=self.text_color,
+                                           color_tolerance=self.color_tolerance) if self.delta else None
+            try:
+                for frame in frames:
+                    self.transfer_frame(frame, timer, renderer)
+                self.result_queue.put(("done", job_index, span))
+            except Exception as e:
+                self.result_queue.put(("failed", job_index, (span, f"{e}")))
+
+
+class BatchJob:
+    """
+    批量任务中的一个视频：独立的任务目录 <jobs_folder>/<视频哈希>，与单视频命令行共用，可以互相断点续跑
+    """
+
+    def __init__(self, index: int, video: str, jobs_folder: str, render_options: dict):
+        self.index = index
+        self.video = video
+        self.render_options = render_options
+        self.job_folder = f"{jobs_folder}/{video_hash(video)}"
+        self.lock = JobLock(self.job_folder)
+        self.tmp_frames_folder = f"{self.job_folder}/tmp_frames"
+        self.out_frames_folder = f"{self.job_folder}/{options_key(render_options)}/out_frames"
+        self.out_video = out_video_path(Path(video), render_options["mosaic"])
+        self.state = "queued"
+        self.error = ""
+        self.rate = 0
+        self.frames, self.pending = list(), list()
+        self.frame_size = self.out_frame_size = None
+        self.palette = None
+        self.frames_manifest = self.render_manifest = None
+        self.segment_encoder: Optional[SegmentEncoder] = None
+        self.progress = OrderedProgress()
+        self.dispatched = 0
+        self.start_time = self.end_time = 0.0
+
+    @property
+    def name(self) -> str:
+        return Path(self.video).name
+
+    def remaining(self) -> int:
+        # 还没有派发出去的帧数
+        return len(self.pending) - self.dispatched if self.state == "rendering" else 0
+
+
+class BatchRenderer:
+    """
+    多视频批量转换：所有视频的帧块都派发到同一个 worker 池，抽帧和编码与其它视频的渲染重叠进行
+
+    - 抽帧在后台线程里提前进行，渲染中的视频快要派发完时就开始抽下一个，池子不会因为等抽帧而空转
+    - 每个视频边渲染边分段编码，最后一段和拼接也在后台完成，不阻塞派发
+    - 调度策略 fair：每次派发给已派发帧数最少的视频（公平分享）；priority：按给出的顺序，
+      排在前面的视频有帧可派发时总是优先，后面的视频只在前面的还在抽帧时补空
+    """
+
+    def __init__(self,
+                 videos: List[str],
+                 render_options: dict,
+                 process_num: int = 0,
+                 schedule: str = "fair",
+                 chunk_frames: int = 8,
+                 segment_frames: int = 240,
+                 cache_options: dict = None,
+                 delete_frames_after_processed: bool = False,
+                 jobs_folder: str = ""):
+        """
+        :param jobs_folder: 任务目录的存放位置，为空时与 video_to_char.py 相同，放在本项目根目录的 jobs 下
+        """
+        self.installed_at = Path(__file__).resolve().parent
+        self.ffmpeg_path, self.ffprobe_path = ffmpeg_binaries(self.installed_at)
+        self.render_options = render_options
+        self.process_num = process_num if process_num > 0 else default_process_num(self._max_frame_bytes(videos))
+        self.schedule = schedule
+        self.chunk_frames = max(chunk_frames, 1)
+        self.segment_frames = segment_frames
+        self.cache_options = cache_options
+        self.delete_frames_after_processed = delete_frames_after_processed
+        jobs_folder = jobs_folder or f"{self.installed_at}/jobs"
+        self.jobs = [BatchJob(index, video, jobs_folder, render_options) for index, video in enumerate(videos)]
+
+        self.result_queue = multiprocessing.Queue()
+        # 每个 worker 一个任务队列，记下各自手上还没交回的帧块，worker 意外退出时可以转给新的 worker
+        self._assigned: Dict[BatchWorkerProcess, List[Tuple[int, Tuple[int, int]]]] = dict()
+        self._requeued = set()
+        # 抽帧一次只跑一个（ffmpeg 自身多线程），编码收尾可以和下一个视频的收尾重叠
+        self._extractor = ThreadPoolExecutor(max_workers=1)
+        self._finisher = ThreadPoolExecutor(max_workers=2)
+        self._futures: List[Tuple[Future, BatchJob]] = list()
+        self._cpu_samples = list()
+
+    def _max_frame_bytes(self, videos: List[str]) -> int:
+        # worker 是所有视频共用的，按最大的那个视频估算每个 worker 的内存
+        frame_bytes = 0
+        for video in videos:
+            video_info = probe_video(self.ffprobe_path, video)
+            if "width" in video_info:
+                frame_bytes = max(frame_bytes, frame_memory_bytes(
+                    (int(video_info["width"]), int(video_info["height"])), text_size=self.render_options["text_size"],
+                    block_size=self.render_options["block_size"], columns=self.render_options["columns"],
+                    mosaic=self.render_options["mosaic"]))
+        return frame_bytes
+
+    def run(self) -> bool:
+        for _ in range(self.process_num):
+            self._start_worker()
+        start_time = time.perf_counter()
+        psutil.cpu_percent()
+        last_sample = start_time
+        try:
+            while any(job.state not in ("finished", "failed") for job in self.jobs):
+                self._start_extraction()
+                # 每个 worker 预留两块，worker 做完一块时下一块已经在队列里
+                while True:
+                    worker = min(self._assigned, key=lambda worker: len(self._assigned[worker]))
+                    if len(self._assigned[worker]) >= 2:
+                        break
+                    job = self._pick_job()
+                    if job is None:
+                        break
+                    self._dispatch(job, worker)
+                try:
+                    self._take_result(*self.result_queue.get(timeout=0.2))
+                except queue.Empty:
+                    self._check_workers()
+                self._collect_futures()
+                for job in self.jobs:
+                    if job.state in ("finished", "failed"):
+                        job.lock.release()
+                if time.perf_counter() - last_sample >= 1:
+                    self._cpu_samples.append(psutil.cpu_percent())
+                    last_sample = time.perf_counter()
+        finally:
+            for worker in self._assigned:
+                worker.task_queue.put(None)
+            for worker in self._assigned:
+                worker.join()
+            self._extractor.shutdown()
+            self._finisher.shutdown()
+            for job in self.jobs:
+                job.lock.release()
+
+        self._print_summary(time.perf_counter() - start_time)
+        return all(job.state == "finished" for job in self.jobs)
+
+    def _start_extraction(self) -> None:
+        # 已抽好但还没派发完的帧不足两轮时提前抽下一个视频，同时最多只有一个视频在等待渲染，限制磁盘占用
+        if any(job.state == "extracting" for job in self.jobs):
+            return
+        backlog = sum(job.remaining() for job in self.jobs)
+        waiting = [job for job in self.jobs if job.state == "queued"]
+        if waiting and backlog < 4 * self.process_num * self.chunk_frames:
+            job = waiting[0]
+            job.state = "extracting"
+            job.start_time = time.perf_counter()
+            print(f"[{job.name}] extracting")
+            self._futures.append((self._extractor.submit(self._prepare, job), job))
+
+    def _prepare(self, job: BatchJob) -> None:
+        # 与 video_to_char.py 单视频流程相同的抽帧、断点续跑和跳过已完成判断
+        frame_format = self.render_options["frame_format"]
+        # 同一视频在别处（命令行、GUI）转换时等它结束，不共用抽帧目录和清单
+        job.lock.acquire(on_wait=lambda: print(f"[{job.name}] waiting for another conversion of this video"))
+        # 渲染参数在抽帧前就已确定，已经转换过的视频不再抽帧
+        if already_encoded(os.path.dirname(job.out_frames_folder), job.out_video):
+            return
+        job.rate = get_video_rate(self.ffprobe_path, job.video)
+        job.frames_manifest = JobManifest(job.job_folder, video=job.video, extracted=False)
+        if not job.frames_manifest.get("extracted") or job.frames_manifest.get("frame_format", "jpg") != frame_format:
+            os.makedirs(job.tmp_frames_folder, exist_ok=True)
+            clear_folder(job.tmp_frames_folder)
+            if extract_frames(self.ffmpeg_path, job.video, job.tmp_frames_folder, frame_format) != 0:
+                raise RuntimeError(f"Failed to extract frames from {job.video}")
+            frame_size = grab_frame(self.ffmpeg_path, job.video).size if frame_format == "raw" else None
+            job.frames_manifest.update(extracted=True, frame_format=frame_format, frame_size=frame_size)
+        job.frames = sorted(file for file in os.listdir(job.tmp_frames_folder) if file.endswith(frame_extension(frame_format)))
+        if frame_format == "raw":
+            job.frame_size = tuple(job.frames_manifest.get("frame_size"))
+            columns, rows = char_grid_size(job.frame_size, block_size=self.render_options["block_size"],
+                                           width=self.render_options["columns"], mosaic=self.render_options["mosaic"])
+            job.out_frame_size = (columns * self.render_options["text_size"], rows * self.render_options["text_size"])
+        if "palette" in self.render_options and job.frames:
+            # 每个视频按自己的采样帧选色
+            job.palette = video_palette(job.tmp_frames_folder, job.frames, self.render_options["palette"],
+                                        self.render_options["palette_size"], block_size=self.render_options["block_size"],
+                                        columns=self.render_options["columns"], mosaic=self.render_options["mosaic"],
+                                        frame_format=frame_format, frame_size=job.frame_size)
+
+        os.makedirs(job.out_frames_folder, exist_ok=True)
+        job.render_manifest = JobManifest(os.path.dirname(job.out_frames_folder), options=self.render_options, encoded=None)
+        job.pending = job.render_manifest.pending_frames(job.frames, job.out_frames_folder,
+                                                         frame_validator(frame_format, job.out_frame_size))
+        segments_folder = f"{os.path.dirname(job.out_frames_folder)}/segments"
+        os.makedirs(segments_folder, exist_ok=True)
+        clear_folder(segments_folder)
+        job.segment_encoder = SegmentEncoder(self.ffmpeg_path, job.rate, job.frames, job.out_frames_folder, segments_folder,
+                                             segment_frames=self.segment_frames, max_running=1,
+                                             frame_format=frame_format, frame_size=job.out_frame_size)
+        self._on_watermark(job)
+
+    def _pick_job(self) -> Optional[BatchJob]:
+        candidates = [job for job in self.jobs if job.remaining() > 0]
+        if not candidates:
+            return None
+        if self.schedule == "priority":
+            return candidates[0]
+        return min(candidates, key=lambda job: (job.dispatched, job.index))
+
+    def _start_worker(self) -> None:
+        worker = BatchWorkerProcess(multiprocessing.Queue(), self.result_queue, cache_options=self.cache_options)
+        worker.start()
+        self._assigned[worker] = list()
+
+    def _check_workers(self) -> None:
+        # worker 被杀或崩溃时把它手上的帧块转给新起的 worker，否则这些帧永远等不到，批量任务一直挂着
+        dead = [worker for worker in self._assigned if not worker.is_alive()]
+        if not dead:
+            return
+        # 先收完它退出前已经交回的结果，剩下的才是真正丢掉的帧块
+        while True:
+            try:
+                self._take_result(*self.result_queue.get_nowait())
+            except queue.Empty:
+                break
+        for worker in dead:
+            chunks = self._assigned.pop(worker)
+            print(f"Worker {worker.pid} exited unexpectedly (exit code {worker.exitcode}), "
+                  f"requeueing {len(chunks)} chunks")
+            self._start_worker()
+            for job_index, span in chunks:
+                job = self.jobs[job_index]
+                if job.state != "rendering":
+                    continue
+                if (job_index, span) in self._requeued:
+                    # 同一块帧第二次把 worker 弄挂，不再重试
+                    job.state, job.error = "failed", f"worker exited twice while rendering frames {span[0]}-{span[1]}"
+                    print(f"[{job.name}] failed: {job.error}")
+                    continue
+                self._requeued.add((job_index, span))
+                self._send(min(self._assigned, key=lambda worker: len(self._assigned[worker])), job, span)
+
+    def _dispatch(self, job: BatchJob, worker: BatchWorkerProcess) -> None:
+        start = job.dispatched
+        end = min(start + self.chunk_frames, len(job.pending))
+        job.dispatched = end
+        self._send(worker, job, (start, end))
+
+    def _send(self, worker: BatchWorkerProcess, job: BatchJob, span: Tuple[int, int]) -> None:
+        job_options = dict(self.render_options, input_folder=job.tmp_frames_folder, output_folder=job.out_frames_folder,
+                           frame_size=job.frame_size,
+                           palette_colors=job.palette.tolist() if job.palette is not None else None)
+        worker.task_queue.put((job.index, span, job.pending[span[0]:span[1]], job_options))
+        self._assigned[worker].append((job.index, span))
+
+    def _take_result(self, kind: str, job_index: int, payload) -> None:
+        span = payload if kind == "done" else payload[0]
+        for chunks in self._assigned.values():
+            if (job_index, span) in chunks:
+                chunks.remove((job_index, span))
+                break
+        self._on_result(self.jobs[job_index], kind, payload)
+
+    def _on_result(self, job: BatchJob, kind: str, payload) -> None:
+        if job.state != "rendering":
+            # 已经失败的视频还在路上的帧块
+            return
+        if kind == "failed":
+            job.state, job.error = "failed", payload[1]
+            print(f"[{job.name}] failed: {job.error}")
+            return
+        job.render_manifest.mark_done(job.pending[payload[0]:payload[1]])
+        watermark = job.progress.watermark
+        if job.progress.add(payload) > watermark:
+            self._on_watermark(job)
+        if job.state == "rendering" and job.progress.done_num == len(job.pending):
+            self._finish_rendering(job)
+
+    def _on_watermark(self, job: BatchJob) -> None:
+        # 待渲染帧里按序完成的数量换算成全部帧里已就绪的前缀长度
+        watermark = job.progress.watermark
+        ready = job.frames.index(job.pending[watermark]) if watermark < len(job.pending) else len(job.frames)
+        job.segment_encoder.on_ready(ready)
+
+    def _finish_rendering(self, job: BatchJob) -> None:
+        job.render_manifest.save()
+        job.state = "encoding"
+        print(f"[{job.name}] rendered {len(job.pending)} frames, encoding")
+        self._futures.append((self._finisher.submit(self._encode, job), job))
+
+    def _encode(self, job: BatchJob) -> None:
+        if os.path.exists(job.out_video):
+            os.remove(job.out_video)
+        if job.segment_encoder.join(job.video, job.out_video) != 0 or not os.path.exists(job.out_video):
+            raise RuntimeError(f"Failed to encode {job.out_video}")
+        job.render_manifest.update(encoded=dict(output=job.out_video, size=os.path.getsize(job.out_video)))
+        if self.delete_frames_after_processed:
+            clear_folder(job.tmp_frames_folder)
+            clear_folder(job.out_frames_folder)
+            clear_folder(job.segment_encoder.segments_folder)
+            job.frames_manifest.update(extracted=False)
+            job.render_manifest.done.clear()
+            job.render_manifest.save()
+
+    def _collect_futures(self) -> None:
+        for future, job in [(future, job) for future, job in self._futures if future.done()]:
+            self._futures.remove((future, job))
+            if future.exception() is not None:
+                job.state, job.error = "failed", f"{future.exception()}"
+                print(f"[{job.name}] failed: {job.error}")
+            elif job.state == "extracting":
+                if job.segment_encoder is None:
+                    job.state, job.end_time = "finished", time.perf_counter()
+                    print(f"[{job.name}] already converted -----> {job.out_video}")
+                elif not job.pending:
+                    self._finish_rendering(job)
+                else:
+                    job.state = "rendering"
+                    print(f"[{job.name}] {len(job.frames) - len(job.pending)}/{len(job.frames)} frames already rendered, "
+                          f"{len(job.pending)} to go")
+            elif job.state == "encoding":
+                job.state, job.end_time = "finished", time.perf_counter()
+                print(f"[{job.name}] finished in {job.end_time - job.start_time:.1f}s -----> {job.out_video}")
+
+    def _print_summary(self, wall_seconds: float) -> None:
+        frames = sum(len(job.pending) for job in self.jobs)
+        print(f"Batch finished: {sum(job.state == 'finished' for job in self.jobs)}/{len(self.jobs)} videos, "
+              f"{frames} frames rendered in {wall_seconds:.1f}s ({frames / wall_seconds if wall_seconds else 0:.1f} fps), "
+              f"average CPU {sum(self._cpu_samples) / len(self._cpu_samples) if self._cpu_samples else 0:.0f}%")
+        for job in self.jobs:
+            print(f"  {job.state:<9} {job.name} {job.error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert several videos at once on one shared worker pool")
+    parser.add_argument("--VIDEOS", type=str, nargs="+", required=True,
+                        help="Video files and/or folders of videos, converted in the given order")
+    parser.add_argument("--SCHEDULE", type=str, default="fair", choices=SCHEDULES,
+                        help="'fair' shares the workers evenly between videos, "
+                             "'priority' always serves the earliest video that has frames ready")
+    parser.add_argument("--TEXT_COLOR", type=str, default="auto", help="Color of the text overlay")
+    parser.add_argument("--BG_COLOR", type=str, default="white", help="Background color")
+    parser.add_argument("--MOSAIC", type=str, default="no", help="Whether to apply mosaic effect")
+    parser.add_argument("--DELTA", type=str, default="no",
+                        help="Whether to only redraw the character cells that changed since the previous frame")
+    parser.add_argument("--COLOR_TOLERANCE", type=int, default=8,
+                        help="Max per-channel color change of a cell that is still treated as unchanged in DELTA mode")
+    parser.add_argument("--COLUMNS", type=int, default=100, help="Number of character columns")
+    parser.add_argument("--TEXT_SIZE", type=int, default=10, help="Width and height of one character cell in pixels")
+    parser.add_argument("--BLOCK_SIZE", type=int, default=20, help="Size of a mosaic block in source pixels")
+    parser.add_argument("--FRAME_FORMAT", type=str, default="jpg", choices=FRAME_FORMATS,
+                        help="Intermediate format of the extracted and rendered frames")
+    parser.add_argument("--PALETTE", type=str, default="none", choices=PALETTE_MODES,
+                        help="Limit the text colors to a palette, picked per video for 'median' / 'kmeans'. "
+                             "Only used when TEXT_COLOR is 'auto'")
+    parser.add_argument("--PALETTE_SIZE", type=int, default=16,
+                        help="Number of palette colors, at least 8 for 'fixed'")
+    parser.add_argument("--PROCESS_NUM", type=int, default=0,
+                        help="Number of shared worker processes. If 0, it is decided by CPU count and available memory")
+    parser.add_argument("--CHUNK_FRAMES", type=int, default=8,
+                        help="Frames handed to a worker at a time, smaller chunks switch between videos more evenly")
+    parser.add_argument("--SEGMENT_FRAMES", type=int, default=240,
+                        help="Number of frames in each independently encoded segment")
+    parser.add_argument("--CACHE", type=str, default="yes",
+                        help="Whether to reuse the rendered result of frames that are identical after downscaling")
+    parser.add_argument("--JOBS_DIR", type=str, default="",
+                        help="Folder of the resumable job state shared with video_to_char.py. If empty, 'jobs' next to this script")
+    parser.add_argument("--CACHE_DIR", type=str, default="", help="Folder of a persistent render cache shared between jobs")
+    parser.add_argument("--CACHE_SIZE_MB", type=int, default=1024, help="Size limit of the persistent render cache")
+    parser.add_argument("--DELETE_FRAMES_AFTER_PROCESSED", type=str, default="no",
+                        help="Whether to delete each video's frames after it is encoded")
+    args = parser.parse_args()
+    if args.PALETTE == "fixed" and args.TEXT_COLOR == "auto" and args.PALETTE_SIZE < 8:
+        print(f"PALETTE fixed needs PALETTE_SIZE of at least 8, got {args.PALETTE_SIZE}")
+        sys.exit(1)
+
+    DELTA = args.DELTA == "yes"
+    # 与 video_to_char.py 的渲染参数一致，同一视频同一参数的输出帧目录相同
+    render_options = dict(text_color=args.TEXT_COLOR, bg_color=args.BG_COLOR, mosaic=args.MOSAIC == "yes", delta=DELTA,
+                          color_tolerance=args.COLOR_TOLERANCE if DELTA else 0, text_size=args.TEXT_SIZE,
+                          block_size=args.BLOCK_SIZE, columns=args.COLUMNS, frame_format=args.FRAME_FORMAT)
+    if args.PALETTE != "none" and args.TEXT_COLOR == "auto":
+        # 调色板只在 TEXT_COLOR 为 auto 时生效
+        render_options.update(palette=args.PALETTE, palette_size=args.PALETTE_SIZE)
+    videos = collect_videos(args.VIDEOS)
+    if not videos:
+        print(f"No videos found in {args.VIDEOS}")
+        sys.exit(1)
+    print(f"{len(videos)} videos, schedule {args.SCHEDULE}")
+
+    batch = BatchRenderer(videos,
+                          render_options,
+                          process_num=args.PROCESS_NUM,
+                          schedule=args.SCHEDULE,
+                          chunk_frames=args.CHUNK_FRAMES,
+                          segment_frames=args.SEGMENT_FRAMES,
+                          cache_options=dict(disk_folder=args.CACHE_DIR, disk_limit=args.CACHE_SIZE_MB * 1024 * 1024)
+                          if args.CACHE == "yes" else None,
+                          delete_frames_after_processed=args.DELETE_FRAMES_AFTER_PROCESSED == "yes",
+                          jobs_folder=args.JOBS_DIR)
+    sys.exit(0 if batch.run() else 1)
@@ -0,0 +1,244 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from PIL import Image, ImageChops
+
+from video_to_char import (get_char, draw_text, transfer_to_text, pixelate_image_info, frame_to_grids,
+                           render_char_grid, IncrementalRenderer, ffmpeg_binaries, extract_frames, pixelate_frame)
+from frame_format import FRAME_FORMATS, frame_extension, read_frame, encode_frame
+
+installed_at = Path(__file__).resolve().parent
+# 同样是 100 列、text_size 10 的一帧，新旧实现的耗时之比就是字形图集的加速比
+LEGACY_FRAME = "legacy_transfer_to_text/size_10/width_100/plain"
+ATLAS_FRAME = "transfer_to_text/size_10/width_100/plain"
+
+
+def legacy_transfer_to_text(frame_src: str, out_picture: str, bg_color: str = "white",
+                            text_color: str = "auto", text_size: int = 5, font: str = "w6.ttf") -> None:
+    # 旧实现：逐格调用 draw_text，作为速度和输出一致性的参照
+    im = Image.open(frame_src)
+    resized_width = 100
+    resized_height = int(resized_width * im.height / im.width)
+    im = im.resize((resized_width, resized_height), Image.NEAREST)
+
+    new_image = Image.new("RGB", (resized_width * text_size, resized_height * text_size), color=bg_color)
+    for i in range(resized_height):
+        for j in range(resized_width):
+            pixel_color = im.getpixel((j, i))
+            _color = pixel_color if text_color == "auto" else text_color
+            draw_text(text=get_char(*pixel_color), text_color=_color, text_size=text_size,
+                      frame=new_image, location=(j * text_size, i * text_size), font=font)
+    new_image.save(out_picture)
+
+
+def timeit(func: Callable, repeat: int) -> float:
+    costs = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        costs.append(time.perf_counter() - start)
+    return min(costs)
+
+
+def identical(first: str, second: str) -> bool:
+    return ImageChops.difference(Image.open(first).convert("RGB"), Image.open(second).convert("RGB")).getbbox() is None
+
+
+def bench_frame(image: str, out_dir: str, repeat: int) -> Dict[str, float]:
+    """
+    单帧各函数耗时（秒，取 repeat 次中最快的一次）
+    """
+    results = dict()
+    im = Image.open(image)
+    im.load()
+
+    small = im.resize((100, int(100 * im.height / im.width)), Image.NEAREST)
+    pixels = [small.getpixel((j, i)) for i in range(small.height) for j in range(small.width)]
+    results["get_char/100_columns"] = timeit(lambda: [get_char(*pixel) for pixel in pixels], repeat)
+
+    for block_size in (10, 20):
+        results[f"pixelate_image_info/block_{block_size}"] = timeit(lambda: pixelate_image_info(im, block_size), repeat)
+
+    for text_size, width, height in ((5, 0, 0), (10, 0, 0), (10, 200, 366)):
+        for mosaic in (False, True):
+            name = f"transfer_to_text/size_{text_size}/width_{width or 100}/{'mosaic' if mosaic else 'plain'}"
+            out_picture = f"{Path(out_dir) / 'bench_frame.png'}"
+            results[name] = timeit(lambda: transfer_to_text(image, out_picture, block_size=20, text_size=text_size,
+                                                            width=width, height=height, mosaic=mosaic), repeat)
+
+    # 逐格 draw_text 的旧实现作为参照，单帧要十秒左右，只跑一次
+    results[LEGACY_FRAME] = timeit(lambda: legacy_transfer_to_text(image, f"{Path(out_dir) / 'bench_legacy.png'}",
+                                                                   text_size=10), 1)
+    return results
+
+
+def bench_video(video: str, out_dir: str, process_nums: List[int], clip_seconds: float) -> Dict[str, float]:
+    """
+    整段转换的耗时，按进程数分别计时；clip_seconds > 0 时只截取开头一段
+
+    视频先复制到 out_dir，输出视频也落在 out_dir；每次运行使用独立的任务目录，
+    否则进程数不参与任务参数，第一次之后的运行都会直接判定为已转换
+    """
+    results = dict()
+    ffmpeg_path, _ = ffmpeg_binaries(installed_at)
+    clip = f"{Path(out_dir) / 'bench_clip.mp4'}"
+    duration = ["-t", f"{clip_seconds}"] if clip_seconds > 0 else []
+    subprocess.run([ffmpeg_path, "-y", "-v", "error", "-i", video, *duration, "-c", "copy", clip], check=True)
+
+    for process_num in process_nums:
+        report = f"{Path(out_dir) / f'bench_report_{process_num}.json'}"
+        command = [sys.executable, f"{installed_at / 'video_to_char.py'}", "--VIDEO", clip,
+                   "--PROCESS_NUM", f"{process_num}", "--DELETE_FRAMES_AFTER_PROCESSED", "yes",
+                   "--JOBS_DIR", f"{Path(out_dir) / f'bench_jobs_{process_num}'}",
+                   "--PROGRESS", "yes", "--REPORT", report]
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        results[f"video/process_{process_num or 'auto'}"] = time.perf_counter() - start
+    return results
+
+
+def bench_formats(image: str, video: str, out_dir: str, repeat: int, frame_count: int = 30) -> Dict[str, float]:
+    """
+    各中间格式的 CPU 与磁盘开销：ffmpeg 抽 frame_count 帧的耗时和每帧字节数，
+    worker 读取一帧源帧、编码并写出一帧输出帧的耗时和每帧字节数
+    """
+    results = dict()
+    ffmpeg_path, _ = ffmpeg_binaries(installed_at)
+    out_image = render_char_grid(*frame_to_grids(Image.open(image), block_size=20), text_size=10)
+    clip = f"{Path(out_dir) / 'format_clip.mp4'}"
+    subprocess.run([ffmpeg_path, "-y", "-v", "error", "-i", video, "-frames:v", f"{frame_count}", "-c", "copy", clip], check=True)
+    for frame_format in FRAME_FORMATS:
+        frames_folder = Path(out_dir) / f"format_{frame_format}"
+        frames_folder.mkdir(exist_ok=True)
+        start = time.perf_counter()
+        extract_frames(ffmpeg_path, clip, f"{frames_folder}", frame_format)
+        frames = sorted(frames_folder.iterdir())
+        results[f"format/{frame_format}/extract_per_frame"] = (time.perf_counter() - start) / len(frames)
+        results[f"format/{frame_format}/extract_bytes_per_frame"] = sum(frame.stat().st_size for frame in frames) / len(frames)
+
+        frame_size = Image.open(image).size if frame_format == "raw" else None
+        source = f"{Path(out_dir) / f'format_source.{frame_extension(frame_format)}'}"
+        with open(source, "wb") as f:
+            f.write(encode_frame(Image.open(image).convert("RGB"), frame_format))
+        # 和 worker 一样读入后缩成字符网格；raw 帧按需映射，只有被取样的像素才会读到
+        results[f"format/{frame_format}/read"] = timeit(lambda: pixelate_frame(read_frame(source, frame_format, frame_size),
+                                                                               block_size=20), repeat)
+
+        out_picture = f"{Path(out_dir) / f'format_out.{frame_extension(frame_format)}'}"
+
+        def write():
+            with open(out_picture, "wb") as f:
+                f.write(encode_frame(out_image, frame_format))
+        results[f"format/{frame_format}/write"] = timeit(write, repeat)
+        results[f"format/{frame_format}/write_bytes_per_frame"] = os.path.getsize(out_picture)
+        for frame in frames:
+            os.remove(frame)
+    return results
+
+
+def check_outputs(image: str, video: str, out_dir: str) -> Dict[str, bool]:
+    """
+    优化后的路径与参照实现逐像素比较
+    """
+    checks = dict()
+    legacy_out = f"{Path(out_dir) / 'check_legacy.png'}"
+    atlas_out = f"{Path(out_dir) / 'check_atlas.png'}"
+    for text_color in ("auto", "#ff0000"):
+        legacy_transfer_to_text(image, legacy_out, text_color=text_color, text_size=10)
+        transfer_to_text(image, atlas_out, text_color=text_color, text_size=10)
+        checks[f"transfer_to_text == draw_text/{text_color}"] = identical(legacy_out, atlas_out)
+
+    # 增量渲染（容差为 0）与整帧渲染一致
+    ffmpeg_path, _ = ffmpeg_binaries(installed_at)
+    frames_folder = Path(out_dir) / "check_frames"
+    frames_folder.mkdir(exist_ok=True)
+    subprocess.run([ffmpeg_path, "-y", "-v", "error", "-i", video, "-frames:v", "10", f"{frames_folder}/frame%08d.jpg"], check=True)
+    renderer = IncrementalRenderer(text_size=10)
+    same = True
+    for frame in sorted(frames_folder.iterdir()):
+        char_grid, color_grid = frame_to_grids(Image.open(frame), block_size=20)
+        full = render_char_grid(char_grid, color_grid, text_size=10)
+        same &= ImageChops.difference(renderer.render(char_grid, color_grid), full).getbbox() is None
+        os.remove(frame)
+    checks["IncrementalRenderer == render_char_grid"] = same
+    return checks
+
+
+def compare_baseline(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    regressions = list()
+    for name, seconds in results.items():
+        # 每帧字节数不随机器变化，不参与耗时回归比较
+        if name.endswith("bytes_per_frame"):
+            continue
+        if name in baseline and seconds > baseline[name] * (1 + tolerance):
+            regressions.append(f"{name}: {baseline[name] * 1000:.1f} ms -> {seconds * 1000:.1f} ms "
+                               f"(+{(seconds / baseline[name] - 1):.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rendering functions and the full video conversion")
+    parser.add_argument("--IMAGE", type=str, default=f"{installed_at / 'original.png'}", help="Frame used for benchmarking")
+    parser.add_argument("--VIDEO", type=str, default=f"{installed_at / 'test.MP4'}", help="Video used for benchmarking")
+    parser.add_argument("--REPEAT", type=int, default=3, help="Number of runs, the fastest one is recorded")
+    parser.add_argument("--PROCESS_NUMS", type=str, default="1,2,4,0",
+                        help="Comma separated process numbers for the full conversion, 0 means auto")
+    parser.add_argument("--CLIP_SECONDS", type=float, default=0,
+                        help="Only convert the first seconds of the video. If 0, the whole video is converted")
+    parser.add_argument("--SKIP_VIDEO", type=str, default="no", help="Whether to skip the full conversion")
+    parser.add_argument("--SKIP_FORMATS", type=str, default="no",
+                        help="Whether to skip the intermediate frame format comparison")
+    parser.add_argument("--SKIP_CHECK", type=str, default="no", help="Whether to skip the output checks")
+    parser.add_argument("--OUT", type=str, default="benchmark_results.json", help="Where to write the results")
+    parser.add_argument("--BASELINE", type=str, default="benchmark_baseline.json",
+                        help="Saved results to compare with, missing entries are ignored")
+    parser.add_argument("--SAVE_BASELINE", type=str, default="no", help="Whether to save the results as the new baseline")
+    parser.add_argument("--TOLERANCE", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before failing, 0.25 means 25%%")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        results = bench_frame(args.IMAGE, out_dir, args.REPEAT)
+        if args.SKIP_VIDEO != "yes":
+            process_nums = [int(process_num) for process_num in args.PROCESS_NUMS.split(",")]
+            results.update(bench_video(args.VIDEO, out_dir, process_nums, args.CLIP_SECONDS))
+        if args.SKIP_FORMATS != "yes":
+            results.update(bench_formats(args.IMAGE, args.VIDEO, out_dir, args.REPEAT))
+        checks = dict() if args.SKIP_CHECK == "yes" else check_outputs(args.IMAGE, args.VIDEO, out_dir)
+
+    for name, value in results.items():
+        # 字节数不是耗时，单独显示
+        if name.endswith("bytes_per_frame"):
+            print(f"{name:<45} {value / 1024:>10.1f} KB")
+        else:
+            print(f"{name:<45} {value * 1000:>10.1f} ms")
+    if LEGACY_FRAME in results and results[ATLAS_FRAME] > 0:
+        print(f"{'speedup over per-cell draw_text':<45} {results[LEGACY_FRAME] / results[ATLAS_FRAME]:>10.1f} x")
+    for name, passed in checks.items():
+        print(f"{name:<45} {'ok' if passed else 'MISMATCH'}")
+
+    with open(args.OUT, "w", encoding="utf-8") as f:
+        json.dump(dict(machine=dict(platform=platform.platform(), python=platform.python_version(), cpu_count=os.cpu_count()),
+                       results=results, checks=checks), f, indent=2)
+
+    regressions = list()
+    if args.SAVE_BASELINE == "yes":
+        with open(args.BASELINE, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved -----> {args.BASELINE}")
+    elif os.path.exists(args.BASELINE):
+        with open(args.BASELINE, encoding="utf-8") as f:
+            regressions = compare_baseline(results, json.load(f), args.TOLERANCE)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+    failed = regressions or not all(checks.values())
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,117 @@
+import os
+import math
+import multiprocessing
+from typing import Optional, Tuple
+
+import psutil
+
+
+def default_process_num(frame_bytes: int = 0, worker_overhead: int = 80 * 1024 * 1024) -> int:
+    """
+    按 CPU 核数和可用内存决定进程数：每个 worker 大约占用 解释器开销 + 一帧的内存
+
+    :param frame_bytes: worker 渲染一帧时同时驻留的字节数（解码后的输入帧 + 输出画布），
+                        见 video_to_char.frame_memory_bytes；0 表示只按解释器开销估算
+    """
+    cpu_num = psutil.cpu_count(logical=True) or os.cpu_count() or 1
+    memory_limit = psutil.virtual_memory().available // (worker_overhead + frame_bytes)
+    return max(min(cpu_num, memory_limit), 1)
+
+
+def default_chunk_size(frame_count: int, process_num: int, chunks_per_process: int = 4) -> int:
+    """
+    每个进程分到几块，块越小负载越均衡，块越大缓存局部性越好、调度开销越小
+
+    块里只是帧的序号，worker 在块内逐帧读取、渲染、写出，任何时刻只驻留一帧，所以块大小不增加内存占用；
+    可用内存限制的是同时运行的进程数（default_process_num），块大小再由进程数决定
+    """
+    return max(math.ceil(frame_count / (process_num * chunks_per_process)), 1)
+
+
+class ChunkScheduler:
+    """
+    把时间线切成连续的帧块，worker 领取一整块后在块内逐帧前进；
+    没有未领取的块时，空闲 worker 从剩余最多的块尾部偷走一半
+
+    所有状态都在共享内存里，fork/spawn 出的 worker 都可以直接使用。
+    每段区间用 (next, end) 表示，区间数最多不超过帧数（每段至少一帧且互不重叠）。
+    """
+
+    def __init__(self, frame_count: int, chunk_size: int):
+        self.frame_count = frame_count
+        self.chunk_size = max(chunk_size, 1)
+        self.chunk_num = math.ceil(frame_count / self.chunk_size)
+        capacity = max(frame_count, 1)
+
+        self._lock = multiprocessing.Lock()
+        self._ranges = multiprocessing.Array("q", 2 * capacity, lock=False)
+        self._range_num = multiprocessing.Value("q", self.chunk_num, lock=False)
+        self._claimed_num = multiprocessing.Value("q", 0, lock=False)
+        for chunk in range(self.chunk_num):
+            self._ranges[2 * chunk] = chunk * self.chunk_size
+            self._ranges[2 * chunk + 1] = min((chunk + 1) * self.chunk_size, frame_count)
+
+    def claim(self) -> Optional[int]:
+        """
+        领取一段区间，返回区间号；没有可领取或可偷取的帧时返回 None
+        """
+        with self._lock:
+            if self._claimed_num.value < self.chunk_num:
+                self._claimed_num.value += 1
+                return self._claimed_num.value - 1
+            return self._steal()
+
+    def _steal(self) -> Optional[int]:
+        victim, remaining = None, 1
+        for index in range(self._range_num.value):
+            left = self._ranges[2 * index + 1] - self._ranges[2 * index]
+            if left > remaining:
+                victim, remaining = index, left
+        if victim is None:
+            return None
+
+        # 原 worker 保留前半段，偷来的后半段作为新区间
+        middle = self._ranges[2 * victim] + (remaining + 1) // 2
+        stolen = self._range_num.value
+        self._ranges[2 * stolen] = middle
+        self._ranges[2 * stolen + 1] = self._ranges[2 * victim + 1]
+        self._ranges[2 * victim + 1] = middle
+        self._range_num.value += 1
+        return stolen
+
+    def next_frame(self, index: int) -> Optional[int]:
+        """
+        在区间内前进一帧，区间已经处理完（或尾部已被偷走）时返回 None
+        """
+        with self._lock:
+            frame = self._ranges[2 * index]
+            if frame >= self._ranges[2 * index + 1]:
+                return None
+            self._ranges[2 * index] = frame + 1
+            return frame
+
+    def remaining(self) -> int:
+        """
+        尚未被任何 worker 领走的帧数（待处理队列深度）
+        """
+        with self._lock:
+            return sum(self._ranges[2 * index + 1] - self._ranges[2 * index] for index in range(self._range_num.value))
+
+
+class OrderedProgress:
+    """
+    汇总 worker 报告的已完成区间 [start, end)，维护 "之前的帧已全部完成" 的水位线
+    """
+
+    def __init__(self):
+        self.watermark = 0
+        self.done_num = 0
+        self._spans = dict()
+
+    def add(self, span: Tuple[int, int]) -> int:
+        start, end = span
+        self._spans[start] = end
+        self.done_num += end - start
+        while self.watermark in self._spans:
+            self.watermark = self._spans.pop(self.watermark)
+        return self.watermark
@@ -0,0 +1,160 @@
+import hashlib
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageColor
+
+# none: 每格保留原色；fixed: 均匀的 RGB 立方体调色板；median / kmeans: 按视频内容用中位切分（再做 k-means 迭代）选色
+PALETTE_MODES = ("none", "fixed", "median", "kmeans")
+# 查找表每个通道取高 5 位，32 * 32 * 32 个格子
+LUT_BITS = 5
+
+
+def fixed_palette(size: int) -> np.ndarray:
+    # 不超过 size 的最大均匀立方体：8、27、64、125、216 色；查找表的下标是 uint8，最多 216 色
+    if size < 8:
+        raise ValueError(f"A fixed palette needs at least 8 colors, got {size}")
+    levels = int(min(size, 256) ** (1 / 3) + 1e-9)
+    steps = np.round(np.linspace(0, 255, levels)).astype(np.uint8)
+    return np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+def adaptive_palette(grids: List[Image.Image], size: int, kmeans: bool = False) -> np.ndarray:
+    """
+    :param grids: 采样帧缩小后的字符网格（每个像素是一格的颜色），按这些颜色选色
+    """
+    # 所有网格竖着拼成一张图，一次量化
+    width = max(grid.width for grid in grids)
+    sheet = Image.new("RGB", (width, sum(grid.height for grid in grids)))
+    top = 0
+    for grid in grids:
+        sheet.paste(grid.convert("RGB"), (0, top))
+        top += grid.height
+    quantized = sheet.quantize(colors=min(size, 256), method=Image.Quantize.MEDIANCUT, kmeans=16 if kmeans else 0)
+    used = sorted(set(np.asarray(quantized).ravel().tolist()))
+    return np.array(quantized.getpalette()[:3 * 256], dtype=np.uint8).reshape(-1, 3)[used]
+
+
+def palette_key(palette: np.ndarray) -> str:
+    # 调色板参与渲染缓存的键
+    return hashlib.blake2b(np.ascontiguousarray(palette, dtype=np.uint8).tobytes(), digest_size=8).hexdigest()
+
+
+def palette_lut(palette: np.ndarray, bits: int = LUT_BITS) -> np.ndarray:
+    """
+    三维查找表：RGB 各取高 bits 位 -> 最近（欧氏距离）的调色板下标，按格子中心计算
+    """
+    side = 1 << bits
+    centers = (np.arange(side, dtype=np.int32) << (8 - bits)) + (1 << (7 - bits))
+    grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 1, 3)
+    distances = ((grid - palette.astype(np.int32)[None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1).astype(np.uint8).reshape(side, side, side)
+
+
+def quantize_colors(color_grid: np.ndarray, lut: np.ndarray, bits: int = LUT_BITS) -> np.ndarray:
+    """
+    :param color_grid: (h, w, 3) 的 uint8 颜色
+    :return: (h, w) 的调色板下标
+    """
+    shift = 8 - bits
+    return lut[color_grid[..., 0] >> shift, color_grid[..., 1] >> shift, color_grid[..., 2] >> shift]
+
+
+def _div255(values: np.ndarray) -> np.ndarray:
+    # 与 PIL 贴图混合相同的取整方式
+    values = values + 128
+    return (values + (values >> 8)) >> 8
+
+
+class PaletteRenderer:
+    """
+    调色板模式的渲染：每个 (字符, 调色板颜色) 的字形预先着色并混合到背景上，整帧按下标直接拼出，不再逐格贴图
+
+    越出自身格子的字形部分按 GlyphAtlas.overflow 拆成相邻格子的图层，按逐格绘制的先后顺序叠加，
+    输出与 render_char_grid 用同样颜色逐格绘制的结果逐像素一致。
+    """
+
+    def __init__(self, atlas, palette: Sequence, text_size: int = 10, bg_color: str = "white"):
+        self.text_size = text_size
+        self.palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3)
+        self.background = np.array(ImageColor.getcolor(bg_color, "RGB"), dtype=np.uint16)
+        left, top, right, bottom = atlas.overflow
+        rows, columns = top + 1 + bottom, left + 1 + right
+        # 每个字符的字形放在 (rows, columns) 个格子大的画布上，自身格子位于 (top, left)
+        masks = np.zeros((len(atlas.glyphs), rows * text_size, columns * text_size), dtype=np.uint8)
+        for index, glyph in enumerate(atlas.glyphs):
+            if glyph is None:
+                continue
+            mask, (offset_x, offset_y) = glyph
+            canvas = Image.new("L", (columns * text_size, rows * text_size), 0)
+            canvas.paste(mask, (left * text_size + offset_x, top * text_size + offset_y))
+            masks[index] = np.asarray(canvas)
+        # 图层 (dy, dx)：字形落在 源格子 + (dy, dx) 处的部分
+        blocks = masks.reshape(len(atlas.glyphs), rows, text_size, columns, text_size).transpose(1, 3, 0, 2, 4)
+        self.layers = dict()
+        for row in range(rows):
+            for column in range(columns):
+                alpha = blocks[row, column]
+                if alpha.any():
+                    self.layers[(row - top, column - left)] = (alpha.astype(np.uint16), alpha.reshape(len(alpha), -1).any(axis=1))
+        # 逐格绘制按行优先，落到同一格子的各图层按源格子的先后排序
+        ordered = sorted(self.layers, reverse=True)
+        self.before = [layer for layer in ordered if layer > (0, 0)]
+        self.after = [layer for layer in ordered if layer < (0, 0)]
+        self.own_alpha = self.layers[(0, 0)][0] if (0, 0) in self.layers \
+            else np.zeros((len(atlas.glyphs), text_size, text_size), np.uint16)
+        # 预着色：(字符, 颜色) -> 贴到背景上的格子
+        colors = self.palette.astype(np.uint16)[None, :, None, None, :]
+        alpha = self.own_alpha[:, None, :, :, None]
+        self.tinted = _div255(self.background * (255 - alpha) + colors * alpha).astype(np.uint8)
+
+    def render(self, char_grid: np.ndarray, index_grid: np.ndarray) -> Image.Image:
+        height, width = char_grid.shape
+        text_size = self.text_size
+        cells = self.tinted[char_grid, index_grid]
+
+        # 被前面的格子越界画到的格子：从背景开始按绘制顺序重新叠加，最后叠上自身的字形
+        targets = [(layer, self._targets(layer, char_grid)) for layer in self.before]
+        touched = np.zeros((height, width), dtype=bool)
+        for _, layer_targets in targets:
+            touched |= layer_targets
+        if touched.any():
+            rows, columns = np.nonzero(touched)
+            slots = np.full((height, width), -1, dtype=np.int64)
+            slots[rows, columns] = np.arange(len(rows))
+            work = np.broadcast_to(self.background, (len(rows), text_size, text_size, 3)).copy()
+            for layer, layer_targets in targets:
+                layer_rows, layer_columns = np.nonzero(layer_targets)
+                work_slots = slots[layer_rows, layer_columns]
+                work[work_slots] = self._blend(work[work_slots], layer, layer_rows, layer_columns, char_grid, index_grid)
+            cells[rows, columns] = self._blend(work, (0, 0), rows, columns, char_grid, index_grid, self.own_alpha)
+
+        for layer in self.after:
+            rows, columns = np.nonzero(self._targets(layer, char_grid))
+            if len(rows):
+                cells[rows, columns] = self._blend(cells[rows, columns], layer, rows, columns, char_grid, index_grid)
+
+        frame = cells.transpose(0, 2, 1, 3, 4).reshape(height * text_size, width * text_size, 3)
+        return Image.fromarray(frame)
+
+    def _targets(self, layer: Tuple[int, int], char_grid: np.ndarray) -> np.ndarray:
+        # 图层在哪些格子上有字形：源格子的字形在该图层非空，结果按 (dy, dx) 平移到目标格子
+        dy, dx = layer
+        height, width = char_grid.shape
+        source = self.layers[layer][1][char_grid]
+        targets = np.zeros_like(source)
+        targets[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+            source[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+        return targets
+
+    def _blend(self, work: np.ndarray, layer: Tuple[int, int], rows: np.ndarray, columns: np.ndarray,
+               char_grid: np.ndarray, index_grid: np.ndarray, alpha: np.ndarray = None) -> np.ndarray:
+        """
+        把源格子 (rows - dy, columns - dx) 的字形在该图层的部分叠加到目标格子 work 上（目标格子都有对应的源格子）
+        """
+        dy, dx = layer
+        source_rows, source_columns = rows - dy, columns - dx
+        alpha = (self.layers[layer][0] if alpha is None else alpha)[char_grid[source_rows, source_columns]][..., None]
+        colors = self.palette[index_grid[source_rows, source_columns]].astype(np.uint16)[:, None, None, :]
+        # 混合结果不超过 255 * 255，uint16 足够
+        return _div255(work.astype(np.uint16) * (255 - alpha) + colors * alpha)
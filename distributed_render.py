@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import collections
+import multiprocessing
+from pathlib import Path
+from multiprocessing.managers import BaseManager
+from typing import Optional, Union, Tuple
+
+from chunk_scheduler import default_process_num
+from job_manifest import video_hash
+from render_cache import RenderCache
+from render_service import parse_address, env_authkey, is_loopback, AUTHKEY_ENV, ESTIMATE_FRAME_SIZE
+from video_to_char import (transfer_to_text, ffmpeg_binaries, probe_video, extract_frames, encode_segment,
+                           concat_segments, out_video_path, clear_folder, frame_memory_bytes)
+
+DEFAULT_ADDRESS = ("127.0.0.1", 50772)
+
+
+class Coordinator:
+    """
+    协调端：把抽好的帧按连续区间切成段，worker 领取一段（连同源帧 jpg 的字节）渲染并编码后交回 mp4 分段
+
+    worker 领取后定期发心跳；持有任务的 worker 超过 lease_timeout 秒没有心跳，视为掉线，任务重新排队，
+    同一段最多尝试 max_attempts 次。掉线 worker 之后交回的重复分段直接丢弃。
+    """
+
+    def __init__(self,
+                 frames_folder: str,
+                 segments_folder: str,
+                 rate: str,
+                 options: dict,
+                 segment_frames: int = 120,
+                 lease_timeout: float = 15.0,
+                 max_attempts: int = 3):
+        self.frames_folder = frames_folder
+        self.segments_folder = segments_folder
+        self.rate = rate
+        self.options = options
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+
+        self.frames = sorted([file for file in os.listdir(frames_folder) if file.endswith("jpg")])
+        self.segments = [(start, min(start + segment_frames, len(self.frames)))
+                         for start in range(0, len(self.frames), segment_frames)]
+        self.pending = collections.deque(range(len(self.segments)))
+        self.leases = dict()
+        self.attempts = collections.Counter()
+        self.last_seen = dict()
+        self.done = set()
+        self.error = ""
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.segments:
+            self.finished.set()
+
+    def segment_path(self, segment: int) -> str:
+        return f"{self.segments_folder}/segment_{segment:05d}.mp4"
+
+    def get_task(self, worker_id: str) -> Optional[dict]:
+        """
+        :return: None 表示全部完成，worker 可以退出；{"segment": None, "wait": 秒} 表示暂时没有任务但还有段在处理
+        """
+        with self.lock:
+            self.last_seen[worker_id] = time.time()
+            self._requeue_expired()
+            if self.finished.is_set():
+                return None
+            if not self.pending:
+                return dict(segment=None, wait=1.0)
+            segment = self.pending.popleft()
+            self.leases[segment] = worker_id
+            self.attempts[segment] += 1
+
+        start, end = self.segments[segment]
+        frames = list()
+        for frame in self.frames[start:end]:
+            with open(f"{self.frames_folder}/{frame}", "rb") as f:
+                frames.append((frame, f.read()))
+        print(f"segment {segment} [{start}, {end}) -----> {worker_id} (attempt {self.attempts[segment]})")
+        return dict(segment=segment, frames=frames, rate=self.rate, options=self.options)
+
+    def heartbeat(self, worker_id: str) -> None:
+        with self.lock:
+            self.last_seen[worker_id] = time.time()
+
+    def submit(self, worker_id: str, segment: int, data: bytes) -> None:
+        with self.lock:
+            self.last_seen[worker_id] = time.time()
+            if segment in self.done:
+                return
+            tmp_path = f"{self.segment_path(segment)}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.segment_path(segment))
+            self.done.add(segment)
+            self.leases.pop(segment, None)
+            if segment in self.pending:
+                self.pending.remove(segment)
+            print(f"segment {segment} done by {worker_id} ({len(self.done)}/{len(self.segments)})")
+            if len(self.done) == len(self.segments):
+                self.finished.set()
+
+    def fail(self, worker_id: str, segment: int, error: str) -> None:
+        with self.lock:
+            print(f"segment {segment} failed on {worker_id}: {error}")
+            if self.leases.get(segment) == worker_id:
+                self._release(segment)
+
+    def check(self) -> None:
+        # 协调端主线程定期调用，所有 worker 都掉线、没有人再来领任务时也能把任务收回
+        with self.lock:
+            self._requeue_expired()
+
+    def status(self) -> dict:
+        with self.lock:
+            return dict(done=len(self.done), total=len(self.segments), pending=len(self.pending),
+                        leased=len(self.leases), error=self.error)
+
+    def _release(self, segment: int) -> None:
+        del self.leases[segment]
+        if self.attempts[segment] >= self.max_attempts:
+            self.error = f"segment {segment} failed {self.attempts[segment]} times"
+            self.finished.set()
+        else:
+            # 重试的段排在最前，尽快补上拼接顺序里的空缺
+            self.pending.appendleft(segment)
+
+    def _requeue_expired(self) -> None:
+        now = time.time()
+        for segment, worker_id in list(self.leases.items()):
+            if now - self.last_seen.get(worker_id, 0) > self.lease_timeout:
+                print(f"worker {worker_id} lost, requeue segment {segment}")
+                self._release(segment)
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+def connect_coordinator(address: Union[str, Tuple[str, int]], authkey: bytes, timeout: float = 30.0):
+    """
+    :return: 协调端代理；timeout 秒内连不上返回 None（worker 可以先于协调端启动）
+    """
+    CoordinatorManager.register("get_coordinator")
+    deadline = time.time() + timeout
+    while True:
+        manager = CoordinatorManager(address=address, authkey=authkey)
+        try:
+            manager.connect()
+            return manager.get_coordinator()
+        except multiprocessing.AuthenticationError:
+            print(f"The coordinator at {address} rejected the authkey")
+            return None
+        except (ConnectionError, FileNotFoundError, OSError):
+            if time.time() > deadline:
+                return None
+            time.sleep(1.0)
+
+
+def render_segment(task: dict, ffmpeg_path: str, cache: RenderCache = None) -> bytes:
+    # 与本地转换相同的 transfer_to_text 路径，渲染完直接编码成一段 mp4，只把编码后的分段传回去
+    with tempfile.TemporaryDirectory() as folder:
+        for number, (_, data) in enumerate(task["frames"], 1):
+            frame_src = f"{folder}/frame{number:08d}.jpg"
+            with open(frame_src, "wb") as f:
+                f.write(data)
+            transfer_to_text(frame_src=frame_src,
+                             out_picture=f"{folder}/out_frame{number:08d}.jpg",
+                             text_size=10,
+                             block_size=20,
+                             text_color=task["options"]["text_color"],
+                             bg_color=task["options"]["bg_color"],
+                             mosaic=task["options"]["mosaic"],
+                             cache=cache)
+        out_segment = f"{folder}/segment.mp4"
+        if encode_segment(ffmpeg_path, task["rate"], f"{folder}/out_frame%08d.jpg", 1, len(task["frames"]), out_segment) != 0:
+            raise RuntimeError("failed to encode the segment")
+        with open(out_segment, "rb") as f:
+            return f.read()
+
+
+class RemoteWorkerProcess(multiprocessing.Process):
+    """
+    渲染节点上的 worker：连接协调端，循环领取分段、渲染编码、交回，协调端通知全部完成或断开时退出
+    """
+
+    def __init__(self,
+                 address: Union[str, Tuple[str, int]],
+                 authkey: bytes,
+                 connect_timeout: float = 30.0,
+                 heartbeat_interval: float = 3.0):
+
+        super().__init__()
+        self.address = address
+        self.authkey = authkey
+        self.connect_timeout = connect_timeout
+        self.heartbeat_interval = heartbeat_interval
+
+    def run(self):
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        coordinator = connect_coordinator(self.address, self.authkey, self.connect_timeout)
+        if coordinator is None:
+            print(f"{worker_id}: coordinator is not reachable at {self.address}")
+            return
+        ffmpeg_path, _ = ffmpeg_binaries(Path(__file__).resolve().parent)
+        cache = RenderCache()
+
+        # 代理对象按线程各用一条连接，心跳线程和渲染互不阻塞
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(self.heartbeat_interval):
+                try:
+                    coordinator.heartbeat(worker_id)
+                except (EOFError, ConnectionError, OSError):
+                    break
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        segment_num = 0
+        try:
+            while True:
+                try:
+                    task = coordinator.get_task(worker_id)
+                except (EOFError, ConnectionError, OSError):
+                    break
+                if task is None:
+                    break
+                if task["segment"] is None:
+                    time.sleep(task["wait"])
+                    continue
+                try:
+                    data = render_segment(task, ffmpeg_path, cache)
+                except Exception as e:
+                    coordinator.fail(worker_id, task["segment"], f"{e}")
+                    continue
+                coordinator.submit(worker_id, task["segment"], data)
+                segment_num += 1
+        except (EOFError, ConnectionError, OSError):
+            pass
+        finally:
+            stopped.set()
+        print(f"{worker_id}: {segment_num} segments rendered, render cache {cache.hits} hits / {cache.misses} misses")
+
+
+def coordinate(video: str,
+               address: Union[str, Tuple[str, int]] = DEFAULT_ADDRESS,
+               authkey: bytes = b"",
+               text_color: str = "auto",
+               bg_color: str = "white",
+               mosaic: bool = False,
+               segment_frames: int = 120,
+               local_workers: int = 0,
+               delete_frames_after_processed: bool = False) -> Optional[str]:
+    """
+    抽帧 -> 对外提供分段任务 -> 等待所有分段交回 -> 按顺序拼接并带上原音轨
+
+    :param authkey: 协调端与 worker 共用的口令，为空时取环境变量 AUTHKEY_ENV；
+                    都为空时只允许监听本机地址，并生成一个随机口令给本机启动的 worker
+    :param local_workers: 同时在本机启动的 worker 进程数，单机验证时使用
+    :return: 输出视频路径，抽帧失败、有分段超过重试次数或拼接失败时返回 None
+    """
+    authkey = authkey or env_authkey()
+    if not authkey:
+        # manager 两端互相传 pickle，对外监听时没有口令等于允许任何人在协调端和渲染节点上执行代码
+        if not is_loopback(address):
+            print(f"Refusing to listen on {address} without an authkey, set --AUTHKEY or {AUTHKEY_ENV}")
+            return None
+        authkey = os.urandom(16)
+        print("No authkey given, only the workers started by this coordinator can connect")
+    installed_at = Path(__file__).resolve().parent
+    ffmpeg_path, ffprobe_path = ffmpeg_binaries(installed_at)
+    video_path = Path(video).resolve()
+    job_folder = f"{installed_at}/distributed_jobs/{video_hash(f'{video_path}')}"
+    frames_folder = f"{job_folder}/tmp_frames"
+    segments_folder = f"{job_folder}/segments"
+    for folder in (frames_folder, segments_folder):
+        os.makedirs(folder, exist_ok=True)
+        clear_folder(folder)
+
+    if extract_frames(ffmpeg_path, f"{video_path}", frames_folder) != 0:
+        print(f"Failed to extract frames from {video_path}")
+        return None
+    rate = probe_video(ffprobe_path, f"{video_path}")["r_frame_rate"]
+    coordinator = Coordinator(frames_folder, segments_folder, rate,
+                              options=dict(text_color=text_color, bg_color=bg_color, mosaic=mosaic),
+                              segment_frames=segment_frames)
+
+    CoordinatorManager.register("get_coordinator", callable=lambda: coordinator)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    server = CoordinatorManager(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Coordinator is serving {len(coordinator.segments)} segments ({len(coordinator.frames)} frames) on {address}")
+
+    # 监听 0.0.0.0 时本机 worker 通过回环地址连接
+    local_address = ("127.0.0.1", address[1]) if isinstance(address, tuple) and address[0] in ("", "0.0.0.0") else address
+    workers = [RemoteWorkerProcess(local_address, authkey) for _ in range(local_workers)]
+    for worker in workers:
+        worker.start()
+
+    while not coordinator.finished.wait(1.0):
+        coordinator.check()
+    for worker in workers:
+        worker.join()
+
+    if coordinator.error:
+        print(f"Distributed rendering failed: {coordinator.error}")
+        return None
+    out_video = out_video_path(video_path, mosaic)
+    segments = [coordinator.segment_path(segment) for segment in range(len(coordinator.segments))]
+    if concat_segments(ffmpeg_path, segments, f"{video_path}", out_video) != 0:
+        print(f"Failed to join the segments into {out_video}")
+        return None
+    if delete_frames_after_processed:
+        shutil.rmtree(job_folder, ignore_errors=True)
+    print(f"All {len(segments)} segments have been joined. -----> {out_video}")
+    return out_video
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a video across several machines: "
+                                                 "one coordinator serves frame ranges, workers render and encode segments")
+    parser.add_argument("--ROLE", type=str, default="coordinator", help="'coordinator' or 'worker'")
+    parser.add_argument("--ADDRESS", type=str, default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}",
+                        help="host:port the coordinator listens on / workers connect to. Use 0.0.0.0:port together with --AUTHKEY to accept remote workers")
+    parser.add_argument("--AUTHKEY", type=str, default="",
+                        help=f"Shared secret of the coordinator and its workers, required for workers and for a coordinator "
+                             f"listening on a non-local address. Can also be given by the {AUTHKEY_ENV} environment variable")
+    parser.add_argument("--VIDEO", type=str, help="Path to the video file (coordinator only)")
+    parser.add_argument("--TEXT_COLOR", type=str, default="auto", help="Color of the text overlay")
+    parser.add_argument("--BG_COLOR", type=str, default="white", help="Background color")
+    parser.add_argument("--MOSAIC", type=str, default="no", help="Whether to apply mosaic effect")
+    parser.add_argument("--SEGMENT_FRAMES", type=int, default=120, help="Number of frames in each segment")
+    parser.add_argument("--PROCESS_NUM", type=int, default=0,
+                        help="Worker processes to start on this machine. For a worker, 0 means decided by CPU count "
+                             "and available memory; for the coordinator, 0 means no local workers")
+    parser.add_argument("--DELETE_FRAMES_AFTER_PROCESSED", type=str, default="no",
+                        help="Whether to delete frames and segments after joining")
+    args = parser.parse_args()
+
+    ADDRESS = parse_address(args.ADDRESS)
+    AUTHKEY = args.AUTHKEY.encode("utf-8") or env_authkey()
+    if args.ROLE == "worker":
+        if not AUTHKEY:
+            print(f"Workers need the coordinator's authkey, set --AUTHKEY or {AUTHKEY_ENV}")
+            sys.exit(1)
+        # 渲染节点启动时还不知道视频尺寸，按 1080p 估算
+        process_num = args.PROCESS_NUM if args.PROCESS_NUM > 0 else default_process_num(frame_memory_bytes(ESTIMATE_FRAME_SIZE))
+        workers = [RemoteWorkerProcess(ADDRESS, AUTHKEY) for _ in range(process_num)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        sys.exit(0)
+
+    result = coordinate(args.VIDEO,
+                        address=ADDRESS,
+                        authkey=AUTHKEY,
+                        text_color=args.TEXT_COLOR,
+                        bg_color=args.BG_COLOR,
+                        mosaic=args.MOSAIC == "yes",
+                        segment_frames=args.SEGMENT_FRAMES,
+                        local_workers=args.PROCESS_NUM,
+                        delete_frames_after_processed=args.DELETE_FRAMES_AFTER_PROCESSED == "yes")
+    sys.exit(0 if result else 1)
@@ -0,0 +1,74 @@
+import io
+import os
+from typing import Callable, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from job_manifest import frame_is_valid
+
+# 抽帧和输出帧的中间格式
+# jpg: 最高质量 jpg，体积小但编解码最耗 CPU，字形边缘会被模糊
+# png: 低压缩级别的无损 png
+# bmp / ppm: 不压缩，写入只是拷贝像素
+# raw: 不带文件头的 RGB 字节，读取时内存映射，不经过任何解码
+FRAME_FORMATS = ("jpg", "png", "bmp", "ppm", "raw")
+
+# 快速压缩：1 级 zlib 比默认级别快数倍，体积只大一成左右
+PNG_COMPRESS_LEVEL = 1
+
+
+def frame_extension(frame_format: str) -> str:
+    return "rgb" if frame_format == "raw" else frame_format
+
+
+def extract_options(frame_format: str) -> List[str]:
+    """
+    :return: ffmpeg 抽帧时放在输出文件之前的参数
+    """
+    if frame_format == "jpg":
+        return ["-qscale:v", "1", "-qmin", "1", "-qmax", "1"]
+    if frame_format == "png":
+        return ["-compression_level", f"{PNG_COMPRESS_LEVEL}"]
+    if frame_format == "raw":
+        return ["-f", "image2", "-c:v", "rawvideo", "-pix_fmt", "rgb24"]
+    return ["-pix_fmt", "rgb24"] if frame_format == "ppm" else []
+
+
+def input_options(frame_format: str, size: Tuple[int, int] = None) -> List[str]:
+    """
+    :return: ffmpeg 读取帧序列时放在 -i 之前的参数；raw 帧没有文件头，需要给出尺寸
+    """
+    if frame_format == "raw":
+        return ["-f", "image2", "-c:v", "rawvideo", "-pixel_format", "rgb24", "-video_size", f"{size[0]}x{size[1]}"]
+    return []
+
+
+def read_frame(path: str, frame_format: str, size: Tuple[int, int] = None) -> Image.Image:
+    if frame_format == "raw":
+        # 直接映射文件，图片与映射共享内存，不复制也不解码
+        pixels = np.memmap(path, dtype=np.uint8, mode="r", shape=(size[1], size[0], 3))
+        return Image.frombuffer("RGB", size, pixels, "raw", "RGB", 0, 1)
+    im = Image.open(path)
+    im.load()
+    return im
+
+
+def encode_frame(image: Image.Image, frame_format: str) -> bytes:
+    if frame_format == "raw":
+        return (image if image.mode == "RGB" else image.convert("RGB")).tobytes()
+    buffer = io.BytesIO()
+    if frame_format == "png":
+        image.save(buffer, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    else:
+        image.save(buffer, format=Image.registered_extensions()[f".{frame_format}"])
+    return buffer.getvalue()
+
+
+def frame_validator(frame_format: str, size: Tuple[int, int] = None) -> Callable[[str], bool]:
+    """
+    :return: 判断输出帧是否完整的函数，raw 帧按文件大小判断，其它格式完整解码一次
+    """
+    if frame_format == "raw":
+        return lambda path: os.path.getsize(path) == size[0] * size[1] * 3
+    return frame_is_valid
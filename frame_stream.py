@@ -0,0 +1,194 @@
+import os
+import queue
+import subprocess
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+from PIL import Image
+
+from video_to_char import render_frame, char_grid_size
+
+# 每个 worker 对应的槽位数：一帧在渲染、一帧排队、一帧等待重排，再多只会占用共享内存
+SLOTS_PER_PROCESS = 3
+
+
+class SharedFrameRing:
+    """
+    一组预分配在共享内存里的帧槽位，解码端直接写入槽位，worker 原地读写，
+    进程间只传递槽位下标，帧数据不会被 pickle 或跨进程复制
+
+    fork 出的 worker 直接继承映射；spawn 时 SharedMemory 按名字重新挂载
+    """
+
+    def __init__(self, slot_count: int, frame_shape: Tuple[int, int, int]):
+        self.slot_count = slot_count
+        self.frame_shape = tuple(frame_shape)
+        self.slot_bytes = int(np.prod(self.frame_shape))
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_count * self.slot_bytes)
+
+    def array(self, slot: int) -> np.ndarray:
+        # 槽位的 (h, w, 3) 视图，不复制数据；用完需释放引用，否则 close 时会报 BufferError
+        return np.ndarray(self.frame_shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def close(self) -> None:
+        self.shm.close()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+
+class StreamWorkerProcess(multiprocessing.Process):
+    """
+    流式模式的 worker：从队列取槽位下标，原地读取输入槽位的帧，渲染结果写入输出环的同号槽位
+    """
+
+    def __init__(self,
+                 slot_queue: multiprocessing.Queue,
+                 done_queue: multiprocessing.Queue,
+                 frame_ring: SharedFrameRing,
+                 out_ring: SharedFrameRing,
+                 render_options: dict):
+
+        super().__init__()
+        self.slot_queue = slot_queue
+        self.done_queue = done_queue
+        self.frame_ring = frame_ring
+        self.out_ring = out_ring
+        self.render_options = render_options
+
+    def run(self):
+        try:
+            while True:
+                task = self.slot_queue.get()
+                if task is None:
+                    break
+                index, slot = task
+                frame = Image.fromarray(self.frame_ring.array(slot))
+                out_frame = render_frame(frame, **self.render_options)
+                self.out_ring.array(slot)[...] = np.asarray(out_frame)
+                del frame
+                self.done_queue.put((index, slot))
+        finally:
+            self.frame_ring.close()
+            self.out_ring.close()
+
+
+def output_frame_size(frame_size: Tuple[int, int], render_options: dict) -> Tuple[int, int]:
+    columns, rows = char_grid_size(frame_size,
+                                   block_size=render_options.get("block_size", 10),
+                                   width=render_options.get("width", 0),
+                                   height=render_options.get("height", 0),
+                                   mosaic=render_options.get("mosaic", False))
+    text_size = render_options.get("text_size", 5)
+    return columns * text_size, rows * text_size
+
+
+def decoder_command(ffmpeg_path: str, video: str, size: Tuple[int, int] = None) -> list:
+    # size 不为空时由 ffmpeg 直接按最近邻缩放，管道里只传缩小后的帧
+    scale = ["-vf", f"scale={size[0]}:{size[1]}:flags=neighbor"] if size else []
+    return [ffmpeg_path, "-v", "error", "-i", video, "-vsync", "0", *scale,
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+
+def encoder_command(ffmpeg_path: str, video: str, output: str, out_size: Tuple[int, int], rate: str) -> list:
+    # libx264 + yuv420p 要求宽高为偶数
+    return [ffmpeg_path, "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{out_size[0]}x{out_size[1]}", "-r", f"{rate}", "-i", "-",
+            "-i", video, "-map", "0:v:0", "-map", "1:a:0?", "-c:a", "copy",
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p", output]
+
+
+def stream_transfer(video: str,
+                    output: str,
+                    ffmpeg_path: str,
+                    frame_size: Tuple[int, int],
+                    rate: str,
+                    process_num: int = 10,
+                    reorder_buffer: int = 0,
+                    **render_options) -> int:
+    """
+    ffmpeg 解码 stdout -> 共享内存槽位 -> worker 渲染 -> 共享内存槽位 -> ffmpeg 编码 stdin，全程不落盘
+
+    槽位数即 reorder_buffer，同时在途的帧数不超过它，乱序完成的帧在这个窗口内按序号重排后写入编码器。
+    两个环都放在 /dev/shm，4K 输入每个槽位约 25 MB，默认按 worker 数的 SLOTS_PER_PROCESS 倍分配，
+    避免在 Docker 默认 64 MB 的 shm 上分配失败
+
+    :param reorder_buffer: 槽位数，0 表示按 process_num 决定
+    :return: 处理的帧数
+    """
+    reorder_buffer = reorder_buffer if reorder_buffer > 0 else max(process_num * SLOTS_PER_PROCESS, 2)
+    out_size = output_frame_size(frame_size, render_options)
+    frame_ring = SharedFrameRing(reorder_buffer, (frame_size[1], frame_size[0], 3))
+    out_ring = SharedFrameRing(reorder_buffer, (out_size[1], out_size[0], 3))
+    free_slots = list(range(reorder_buffer))
+
+    decoder = subprocess.Popen(decoder_command(ffmpeg_path, video), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    encoder = subprocess.Popen(encoder_command(ffmpeg_path, video, output, out_size, rate),
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    slot_queue = multiprocessing.Queue()
+    done_queue = multiprocessing.Queue()
+    workers = [StreamWorkerProcess(slot_queue, done_queue, frame_ring, out_ring, render_options)
+               for _ in range(process_num)]
+    for worker in workers:
+        worker.start()
+
+    next_read, next_write = 0, 0
+    pending = dict()
+    decoded_all, failed = False, False
+    try:
+        while True:
+            # 有空闲槽位时继续解码，直接读进共享内存
+            while not decoded_all and free_slots:
+                slot = free_slots[-1]
+                with memoryview(frame_ring.array(slot)).cast("B") as slot_view:
+                    received = decoder.stdout.readinto(slot_view)
+                if received < frame_ring.slot_bytes:
+                    decoded_all = True
+                    break
+                free_slots.pop()
+                slot_queue.put((next_read, slot))
+                next_read += 1
+
+            if decoded_all and next_write == next_read:
+                break
+
+            try:
+                index, slot = done_queue.get(timeout=1)
+            except queue.Empty:
+                # worker 异常退出时它手上的帧不会再完成，不再等待
+                if not all(worker.is_alive() for worker in workers):
+                    failed = True
+                    break
+                continue
+            pending[index] = slot
+            while next_write in pending:
+                slot = pending.pop(next_write)
+                with memoryview(out_ring.array(slot)).cast("B") as slot_view:
+                    encoder.stdin.write(slot_view)
+                free_slots.append(slot)
+                next_write += 1
+    finally:
+        for _ in workers:
+            slot_queue.put(None)
+        for worker in workers:
+            worker.join()
+        if failed:
+            decoder.kill()
+        decoder.stdout.close()
+        decoder.wait()
+        encoder.stdin.close()
+        encoder.wait()
+        for ring in (frame_ring, out_ring):
+            ring.close()
+            ring.unlink()
+
+    if failed:
+        # 编码器已收到的只是前面一部分帧，不保留不完整的输出
+        if os.path.exists(output):
+            os.remove(output)
+        raise RuntimeError(f"A stream worker exited unexpectedly after {next_write}/{next_read} frames")
+    print(f"All {next_write} frames have been streamed. -----> {output}")
+    return next_write
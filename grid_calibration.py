@@ -0,0 +1,74 @@
+import time
+from typing import List, Tuple
+
+from PIL import Image
+
+from video_to_char import CharRenderer, char_grid_size
+from frame_format import read_frame, encode_frame
+
+
+def sample_frames(frames_folder: str, frames: List[str], sample_num: int = 3, frame_format: str = "jpg",
+                  frame_size: Tuple[int, int] = None) -> List[Image.Image]:
+    # 在整段视频里均匀取几帧，避免只测到片头的纯色画面
+    step = max(len(frames) // sample_num, 1)
+    # raw 帧是内存映射，复制一份，标定时不占着文件
+    return [read_frame(f"{frames_folder}/{frame}", frame_format, frame_size).copy()
+            for frame in frames[step // 2::step][:sample_num]]
+
+
+def measure_frame_seconds(images: List[Image.Image], columns: int, text_size: int = 10, block_size: int = 20,
+                          mosaic: bool = False, frame_format: str = "jpg") -> float:
+    """
+    单进程渲染并编码一帧的平均耗时，和 worker 的流程一致（缩放 -> 映射 -> 绘制 -> 编码输出帧）
+    """
+    renderer = CharRenderer(text_size=text_size, block_size=block_size, width=columns, mosaic=mosaic)
+    # 预热字形图集，不计入耗时
+    renderer.render_image(images[0])
+    start = time.perf_counter()
+    for im in images:
+        encode_frame(renderer.render_image(im), frame_format)
+    return (time.perf_counter() - start) / len(images)
+
+
+def calibrate_columns(images: List[Image.Image],
+                      target_fps: float,
+                      parallelism: int,
+                      text_size: int = 10,
+                      block_size: int = 20,
+                      mosaic: bool = False,
+                      min_columns: int = 20,
+                      probe_columns: Tuple[int, int] = (40, 120),
+                      frame_format: str = "jpg") -> int:
+    """
+    在满足目标帧率的前提下选最大的字符网格列数
+
+    单帧耗时近似为 固定开销 + 每格开销 * 格数（格数 = 列数 * 行数），用两种列数各渲染一遍样本帧拟合两个系数，
+    parallelism 个进程并行时每帧可用 parallelism / target_fps 秒，据此反推格数上限
+    """
+    frame_size = images[0].size
+
+    def cells(columns: int) -> int:
+        width, height = char_grid_size(frame_size, block_size=block_size, width=columns, mosaic=mosaic)
+        return width * height
+
+    small, large = probe_columns
+    small_seconds = measure_frame_seconds(images, small, text_size, block_size, mosaic, frame_format)
+    large_seconds = measure_frame_seconds(images, large, text_size, block_size, mosaic, frame_format)
+    per_cell = max((large_seconds - small_seconds) / (cells(large) - cells(small)), 1e-9)
+    fixed = max(small_seconds - per_cell * cells(small), 0.0)
+
+    budget = parallelism / target_fps
+    print(f"Calibration: {small} columns {small_seconds * 1000:.0f} ms/frame, {large} columns {large_seconds * 1000:.0f} ms/frame, "
+          f"budget {budget * 1000:.0f} ms/frame per process")
+    if budget <= fixed + per_cell * cells(min_columns):
+        return min_columns
+
+    # 一个像素一个字符已是上限
+    low, high = min_columns, max(frame_size[0], min_columns)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fixed + per_cell * cells(middle) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return low
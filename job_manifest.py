@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import hashlib
+from typing import Callable, Iterable, List
+
+import psutil
+from PIL import Image
+
+
+def video_hash(video: str, block_size: int = 1024 * 1024) -> str:
+    # 按内容计算，视频被移动或改名后仍能找回之前的任务
+    sha1 = hashlib.sha1()
+    with open(video, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha1.update(block)
+    return sha1.hexdigest()[:16]
+
+
+def options_key(options: dict) -> str:
+    # 影响渲染结果的参数决定输出帧目录，参数相同的任务共享同一批输出帧
+    return hashlib.sha1(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def already_encoded(folder: str, out_video: str) -> bool:
+    """
+    :param folder: 输出帧目录的上一级（渲染清单所在目录）
+    :return: 清单记录的编码结果就是 out_video 且文件仍在、大小没变，说明同样参数已经转换完成
+    """
+    path = f"{folder}/manifest.json"
+    if not os.path.exists(path):
+        return False
+    with open(path, encoding="utf-8") as f:
+        encoded = json.load(f).get("encoded")
+    return bool(encoded) and encoded["output"] == out_video and os.path.exists(out_video) \
+        and os.path.getsize(out_video) == encoded["size"]
+
+
+def frame_is_valid(path: str) -> bool:
+    # 完整解码一次，进程被杀时写了一半的 jpg 会在这里报错
+    try:
+        with Image.open(path) as im:
+            im.load()
+        return True
+    except (OSError, SyntaxError):
+        return False
+
+
+class JobLock:
+    """
+    任务目录 jobs/<视频哈希> 的独占锁：同一视频的转换（命令行和批量同时跑、GUI 并发跑不同参数）共用抽帧目录和清单，
+    同时只允许一个在跑，后来的等前一个结束
+
+    用 O_CREAT | O_EXCL 创建锁文件，写入持有进程的 pid 和启动时间，各平台行为一致；
+    持有进程已经不在（被杀、断电）时视为残留的锁，直接接管
+    """
+
+    def __init__(self, folder: str, poll_interval: float = 1.0):
+        os.makedirs(folder, exist_ok=True)
+        self.path = f"{folder}/job.lock"
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()} {psutil.Process().create_time()}"
+        self.locked = False
+
+    def acquire(self, on_wait: Callable[[], None] = None) -> None:
+        """
+        :param on_wait: 锁被别的进程持有、开始等待时调用一次
+        """
+        waiting = False
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._stale():
+                    try:
+                        os.remove(self.path)
+                    except FileNotFoundError:
+                        pass
+                    continue
+                if not waiting and on_wait is not None:
+                    on_wait()
+                waiting = True
+                time.sleep(self.poll_interval)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.owner)
+            self.locked = True
+            return
+
+    def release(self) -> None:
+        if not self.locked:
+            return
+        self.locked = False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                owner = f.read()
+            if owner == self.owner:
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _stale(self) -> bool:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                owner = f.read().split()
+        except FileNotFoundError:
+            return False
+        if len(owner) != 2:
+            # 对方刚创建、还没写入内容
+            return False
+        try:
+            return psutil.Process(int(owner[0])).create_time() != float(owner[1])
+        except psutil.NoSuchProcess:
+            return True
+
+
+class JobManifest:
+    """
+    记录在 folder/manifest.json 里的任务状态，原子写入（先写临时文件再替换），进程随时被杀也不会留下损坏的清单
+
+    抽帧目录的清单记录视频和是否已抽完；输出帧目录的清单记录渲染参数、已完成的帧和编码结果。
+    已完成的帧按 checkpoint_interval 秒批量落盘，两次落盘之间完成的帧在恢复时通过校验输出文件找回。
+    """
+
+    def __init__(self, folder: str, checkpoint_interval: float = 2.0, **fields):
+        os.makedirs(folder, exist_ok=True)
+        self.path = f"{folder}/manifest.json"
+        self.checkpoint_interval = checkpoint_interval
+        self.data = dict(fields, done=[])
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        self.done = set(self.data["done"])
+        self._last_checkpoint = time.perf_counter()
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def update(self, **fields) -> None:
+        self.data.update(fields)
+        self.save()
+
+    def save(self) -> None:
+        self.data["done"] = sorted(self.done)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._last_checkpoint = time.perf_counter()
+
+    def mark_done(self, frames: Iterable[str], force: bool = False) -> None:
+        self.done.update(frames)
+        if force or time.perf_counter() - self._last_checkpoint >= self.checkpoint_interval:
+            self.save()
+
+    def pending_frames(self, frames: List[str], output_folder: str,
+                       validate: Callable[[str], bool] = frame_is_valid) -> List[str]:
+        """
+        :param validate: 判断输出帧是否完整，默认完整解码一次
+        :return: 还需要渲染的帧；清单外但已存在的输出帧校验完整后补记为已完成，损坏的删除
+        """
+        pending = list()
+        for frame in frames:
+            out_picture = f"{output_folder}/out_{frame}"
+            if frame in self.done and os.path.exists(out_picture):
+                continue
+            self.done.discard(frame)
+            if os.path.exists(out_picture):
+                if validate(out_picture):
+                    self.done.add(frame)
+                    continue
+                os.remove(out_picture)
+            pending.append(frame)
+        self.save()
+        return pending
@@ -0,0 +1,122 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from collections import defaultdict
+
+import psutil
+
+# 转换流程的各个阶段，按执行顺序排列
+STAGES = ("extract", "decode", "pixelate", "cache", "mapping", "drawing", "save", "encode")
+
+
+class StageTimer:
+    """
+    按阶段累计耗时和次数，worker 内部使用后以 dict 形式汇报给主进程
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+            self.counts[name] += 1
+
+    def merge(self, stages: dict) -> None:
+        for name, (seconds, count) in stages.items():
+            self.seconds[name] += seconds
+            self.counts[name] += count
+
+    def as_dict(self) -> dict:
+        return {name: (self.seconds[name], self.counts[name]) for name in self.seconds}
+
+
+class PipelineReport:
+    """
+    汇总一次转换的分阶段耗时、每个 worker 的帧率、待处理帧数和峰值内存，写成 JSON 报告，可选打印实时进度
+    """
+
+    def __init__(self, video: str = "", options: dict = None, live: bool = False, sample_interval: float = 1.0):
+        self.video = video
+        self.options = options or dict()
+        self.live = live
+        self.sample_interval = sample_interval
+        self.timer = StageTimer()
+        self.workers = list()
+        self.queue_depths = list()
+        self.peak_rss = 0
+        self.frames = 0
+        self.reused_cells = 0
+        self.total_cells = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.start_time = time.perf_counter()
+        self._last_sample = 0.0
+
+    def add_worker(self, stats: dict) -> None:
+        self.workers.append(dict(pid=stats["pid"],
+                                 frames=stats["frames"],
+                                 busy_seconds=stats["busy_seconds"],
+                                 fps=stats["frames"] / stats["busy_seconds"] if stats["busy_seconds"] else 0.0))
+        self.timer.merge(stats["stages"])
+        self.frames += stats["frames"]
+        self.reused_cells += stats["reused_cells"]
+        self.total_cells += stats["total_cells"]
+        if stats.get("cache") is not None:
+            self.cache_hits += stats["cache"]["hits"]
+            self.cache_misses += stats["cache"]["misses"]
+
+    def sample(self, done: int, total: int, queue_depth: int, processes: list = (), force: bool = False) -> None:
+        """
+        主进程定期调用：记录待处理帧数、主进程加所有 worker 的 RSS 之和，按需刷新进度行
+        """
+        now = time.perf_counter()
+        if not force and now - self._last_sample < self.sample_interval:
+            return
+        self._last_sample = now
+
+        rss = psutil.Process(os.getpid()).memory_info().rss
+        for process in processes:
+            try:
+                rss += psutil.Process(process.pid).memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess, ValueError):
+                pass
+        self.peak_rss = max(self.peak_rss, rss)
+        self.queue_depths.append(queue_depth)
+
+        if self.live:
+            elapsed = now - self.start_time
+            print(f"\r{done}/{total} frames | {done / elapsed if elapsed else 0:.1f} fps | "
+                  f"queue {queue_depth} | rss {rss / 1024 / 1024:.0f} MB", end="", flush=True)
+
+    def as_dict(self) -> dict:
+        wall_seconds = time.perf_counter() - self.start_time
+        stages = {name: dict(seconds=self.timer.seconds[name],
+                             count=self.timer.counts[name],
+                             ms_per_call=self.timer.seconds[name] / self.timer.counts[name] * 1000 if self.timer.counts[name] else 0.0)
+                  for name in STAGES if name in self.timer.seconds}
+        return dict(video=self.video,
+                    options=self.options,
+                    wall_seconds=wall_seconds,
+                    frames=self.frames,
+                    fps=self.frames / wall_seconds if wall_seconds else 0.0,
+                    stages=stages,
+                    workers=self.workers,
+                    queue_depth=dict(max=max(self.queue_depths, default=0),
+                                     mean=sum(self.queue_depths) / len(self.queue_depths) if self.queue_depths else 0.0),
+                    peak_rss_mb=self.peak_rss / 1024 / 1024,
+                    cell_reuse_ratio=self.reused_cells / self.total_cells if self.total_cells else None,
+                    render_cache=dict(hits=self.cache_hits,
+                                      misses=self.cache_misses,
+                                      hit_ratio=self.cache_hits / (self.cache_hits + self.cache_misses)
+                                      if self.cache_hits + self.cache_misses else None))
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,129 @@
+import io
+import os
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from PIL import Image
+
+
+def render_key(grid: Image.Image, **render_options) -> str:
+    """
+    缩小后的字符网格（每个像素对应一个字符格）加上所有渲染参数，决定唯一的输出画面
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(sorted(render_options.items())).encode("utf-8"))
+    digest.update(f"{grid.mode}{grid.size}".encode("utf-8"))
+    digest.update(grid.tobytes())
+    return digest.hexdigest()
+
+
+def encode_image(image: Image.Image, out_picture: str) -> bytes:
+    # 按输出文件的扩展名编码，命中时直接把这些字节写成输出文件
+    image_format = Image.registered_extensions()[os.path.splitext(out_picture)[1].lower()]
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+class RenderCache:
+    """
+    按内容寻址的渲染结果缓存：内存里按 LRU 淘汰，可选落盘到 disk_folder 并限制总大小
+
+    缓存的是编码后的输出文件字节，命中时渲染和编码都可以跳过。
+    磁盘缓存可被多个进程和多次任务共享，写入先写临时文件再替换；超出上限时按修改时间淘汰最旧的。
+    """
+
+    def __init__(self, memory_limit: int = 64 * 1024 * 1024, disk_folder: str = "", disk_limit: int = 1024 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self.disk_folder = disk_folder
+        self.disk_limit = disk_limit
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        if disk_folder:
+            os.makedirs(disk_folder, exist_ok=True)
+            self._disk_size = sum(entry.stat().st_size for entry in os.scandir(disk_folder) if entry.is_file())
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        elif self.disk_folder:
+            data = self._read_disk(key)
+            if data is not None:
+                self._put_memory(key, data)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._put_memory(key, data)
+        if self.disk_folder:
+            self._write_disk(key, data)
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses)
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if key in self._entries or len(data) > self.memory_limit:
+            return
+        self._entries[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _disk_path(self, key: str) -> str:
+        return f"{self.disk_folder}/{key}"
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                data = f.read()
+            # 更新修改时间，淘汰时按最近使用排序
+            os.utime(self._disk_path(key))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._disk_size += len(data)
+        if self._disk_size > self.disk_limit:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        # 其它进程也在写同一个目录，淘汰前重新统计实际大小；删到上限的九成，避免每次写入都扫描目录
+        # 每个文件只 stat 一次；别的 worker 同时淘汰掉的文件直接跳过
+        entries = list()
+        for entry in os.scandir(self.disk_folder):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        self._disk_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._disk_size <= self.disk_limit * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            # 已经被别人删掉的也不再占空间
+            self._disk_size -= size
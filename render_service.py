@@ -0,0 +1,371 @@
+import os
+import sys
+import time
+import uuid
+import queue
+import ipaddress
+import shutil
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from multiprocessing.managers import BaseManager
+from typing import Optional, Union, Tuple
+
+import psutil
+from PIL import Image
+
+from chunk_scheduler import default_process_num, default_chunk_size
+from render_cache import RenderCache
+from video_to_char import (get_glyph_atlas, transfer_to_text, frame_to_grids, IncrementalRenderer,
+                           ffmpeg_binaries, get_video_rate, extract_frames, rebuild_video,
+                           out_video_path, frame_memory_bytes)
+
+DEFAULT_ADDRESS = ("127.0.0.1", 50771) if psutil.WINDOWS else f"{Path(__file__).resolve().parent}/render_service.sock"
+# 只用于本机（Unix socket 或回环地址）：仓库公开，这个值谁都知道，不能当作口令
+DEFAULT_AUTHKEY = b"character_video"
+# 对外监听时的口令从这个环境变量或 --AUTHKEY 读取；manager 两端互相传 pickle，能连上端口就能执行任意代码
+AUTHKEY_ENV = "CHARACTER_VIDEO_AUTHKEY"
+# 常驻 worker 在看到任何视频之前就要创建，按 1080p 输入估算每个 worker 的内存
+ESTIMATE_FRAME_SIZE = (1920, 1080)
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    # "host:port" 为 TCP，其它视为 Unix socket 路径
+    host, _, port = address.rpartition(":")
+    return (host, int(port)) if host and port.isdigit() else address
+
+
+def env_authkey() -> bytes:
+    return os.environ.get(AUTHKEY_ENV, "").encode("utf-8")
+
+
+def is_loopback(address: Union[str, Tuple[str, int]]) -> bool:
+    # Unix socket 只在本机可见；主机名除 localhost 外一律按对外处理
+    if isinstance(address, str):
+        return True
+    if address[0] == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(address[0]).is_loopback
+    except ValueError:
+        return False
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class PoolWorkerProcess(multiprocessing.Process):
+    """
+    常驻 worker：启动时预加载字体和字形图集，之后持续从任务队列领取连续帧块，跨任务复用
+
+    渲染缓存同样常驻，同一段视频的重复任务直接命中。帧块出错时交回失败结果而不是退出，
+    不属于当前任务（active_job）的帧块直接跳过，失败任务剩下的帧块不再渲染
+    """
+
+    def __init__(self,
+                 task_queue: multiprocessing.Queue,
+                 result_queue: multiprocessing.Queue,
+                 active_job: multiprocessing.Value,
+                 font: str = "w6.ttf",
+                 text_size: int = 10,
+                 cache_options: dict = None):
+
+        super().__init__(daemon=True)
+        self.task_queue = task_queue
+        self.result_queue = result_queue
+        self.active_job = active_job
+        self.font = font
+        self.text_size = text_size
+        self.cache_options = cache_options
+
+    def run(self):
+        # 预热：字体、字形 mask 在进程生命周期内只加载一次
+        get_glyph_atlas(self.font, self.text_size)
+        cache = RenderCache(**self.cache_options) if self.cache_options is not None else None
+        while True:
+            task = self.task_queue.get()
+            if task is None:
+                break
+            serial, input_folder, output_folder, frames, options = task
+            if serial != self.active_job.value:
+                continue
+            hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+            try:
+                self._render_chunk(cache, input_folder, output_folder, frames, options)
+            except Exception as e:
+                self.result_queue.put((serial, 0, 0, 0, f"{frames[0]}: {e}"))
+                continue
+            if cache is not None:
+                hits, misses = cache.hits - hits, cache.misses - misses
+            self.result_queue.put((serial, len(frames), hits, misses, ""))
+
+    def _render_chunk(self, cache: Optional[RenderCache], input_folder: str, output_folder: str, frames: list,
+                      options: dict) -> None:
+        renderer = IncrementalRenderer(text_size=self.text_size,
+                                       bg_color=options["bg_color"],
+                                       text_color=options["text_color"],
+                                       font=self.font,
+                                       color_tolerance=options["color_tolerance"]) if options["delta"] else None
+        for image_path in frames:
+            if renderer is None:
+                transfer_to_text(frame_src=f"{input_folder}/{image_path}",
+                                 out_picture=f"{output_folder}/out_{image_path}",
+                                 text_size=self.text_size,
+                                 block_size=20,
+                                 text_color=options["text_color"],
+                                 bg_color=options["bg_color"],
+                                 mosaic=options["mosaic"],
+                                 font=self.font,
+                                 cache=cache)
+            else:
+                char_grid, color_grid = frame_to_grids(Image.open(f"{input_folder}/{image_path}"),
+                                                       block_size=20,
+                                                       mosaic=options["mosaic"])
+                renderer.render(char_grid, color_grid).save(f"{output_folder}/out_{image_path}")
+
+
+class RenderService:
+    """
+    常驻渲染服务：worker 池只创建一次，依次执行提交的任务（抽帧 -> 渲染 -> 编码），并记录每个任务的进度
+    """
+
+    def __init__(self, process_num: int = 0, work_folder: str = None, cache_options: dict = None):
+        self.installed_at = Path(__file__).resolve().parent
+        self.work_folder = work_folder or f"{self.installed_at}/service_jobs"
+        self.ffmpeg_path, self.ffprobe_path = ffmpeg_binaries(self.installed_at)
+        self.process_num = process_num if process_num > 0 else default_process_num(frame_memory_bytes(ESTIMATE_FRAME_SIZE))
+
+        self.cache_options = cache_options
+
+        self.task_queue = multiprocessing.Queue()
+        self.result_queue = multiprocessing.Queue()
+        # 正在渲染的任务序号，0 表示没有；worker 跳过其它序号的帧块
+        self.active_job = multiprocessing.Value("q", 0)
+        self.job_serial = 0
+        self.workers = [self._start_worker() for _ in range(self.process_num)]
+
+        self.jobs = dict()
+        self.cancelled = set()
+        self.job_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.job_thread = threading.Thread(target=self._run_jobs, daemon=True)
+        self.job_thread.start()
+
+    def _start_worker(self) -> PoolWorkerProcess:
+        worker = PoolWorkerProcess(self.task_queue, self.result_queue, self.active_job, cache_options=self.cache_options)
+        worker.start()
+        return worker
+
+    def submit(self, video: str, text_color: str = "auto", bg_color: str = "white", mosaic: bool = False,
+               delta: bool = False, color_tolerance: int = 8, delete_frames_after_processed: bool = False) -> str:
+        job_id = uuid.uuid4().hex[:12]
+        options = dict(text_color=text_color, bg_color=bg_color, mosaic=mosaic, delta=delta,
+                       color_tolerance=color_tolerance, delete_frames_after_processed=delete_frames_after_processed)
+        with self.lock:
+            self.jobs[job_id] = dict(video=video, state="queued", done=0, total=0, fps=0.0, output="", error="",
+                                     cache_hits=0, cache_misses=0)
+        self.job_queue.put((job_id, video, options))
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务：排队中的不再执行；运行中的在下一个检查点停下（抽帧中的等 ffmpeg 结束，编码已开始的不再取消），
+        剩下的帧块 worker 直接跳过
+
+        :return: 任务存在且还能取消（没有结束，也还没开始编码）
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["state"] in ("encoding", "finished", "failed", "cancelled"):
+                return False
+            if job["state"] == "queued":
+                job["state"] = "cancelled"
+            else:
+                self.cancelled.add(job_id)
+            return True
+
+    def _check_cancelled(self, job_id: str, next_state: str = "") -> None:
+        """
+        :param next_state: 没有被取消时把任务切换到这个状态
+        """
+        with self.lock:
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+                raise JobCancelled()
+            if next_state:
+                self.jobs[job_id]["state"] = next_state
+
+    def status(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _run_jobs(self) -> None:
+        while True:
+            job_id, video, options = self.job_queue.get()
+            if self.status(job_id)["state"] == "cancelled":
+                continue
+            try:
+                self._run_job(job_id, video, options)
+            except JobCancelled:
+                shutil.rmtree(f"{self.work_folder}/{job_id}", ignore_errors=True)
+                self._update(job_id, state="cancelled")
+            except Exception as e:
+                self._update(job_id, state="failed", error=f"{e}")
+            finally:
+                self.active_job.value = 0
+                # 失败前刚好收到的取消请求不再有用
+                with self.lock:
+                    self.cancelled.discard(job_id)
+
+    def _run_job(self, job_id: str, video: str, options: dict) -> None:
+        video_path = Path(video).resolve()
+        tmp_frames_folder = f"{self.work_folder}/{job_id}/tmp_frames"
+        out_frames_folder = f"{self.work_folder}/{job_id}/out_frames"
+        os.makedirs(tmp_frames_folder, exist_ok=True)
+        os.makedirs(out_frames_folder, exist_ok=True)
+
+        self._update(job_id, state="extracting")
+        video_rate = get_video_rate(self.ffprobe_path, f"{video_path}")
+        if extract_frames(self.ffmpeg_path, f"{video_path}", tmp_frames_folder) != 0:
+            raise RuntimeError(f"Failed to extract frames from {video_path}")
+        frames = sorted([file for file in os.listdir(tmp_frames_folder) if file.endswith("jpg")])
+        self._check_cancelled(job_id)
+
+        # 连续帧块分给常驻 worker
+        self._update(job_id, state="rendering", total=len(frames))
+        chunk_size = default_chunk_size(len(frames), self.process_num, chunks_per_process=1 if options["delta"] else 4)
+        chunks = [frames[start:start + chunk_size] for start in range(0, len(frames), chunk_size)]
+        self.job_serial += 1
+        serial = self.active_job.value = self.job_serial
+        for chunk in chunks:
+            self.task_queue.put((serial, tmp_frames_folder, out_frames_folder, chunk, options))
+
+        done, hits, misses, start_time = 0, 0, 0, time.perf_counter()
+        finished = 0
+        while finished < len(chunks):
+            self._check_cancelled(job_id)
+            try:
+                result_serial, frame_num, chunk_hits, chunk_misses, error = self.result_queue.get(timeout=1)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if result_serial != serial:
+                # 之前失败的任务交回的结果
+                continue
+            if error:
+                raise RuntimeError(f"Failed to render {error}")
+            finished += 1
+            done, hits, misses = done + frame_num, hits + chunk_hits, misses + chunk_misses
+            self._update(job_id, done=done, fps=done / (time.perf_counter() - start_time),
+                         cache_hits=hits, cache_misses=misses)
+        self.active_job.value = 0
+        # 最后一个检查点和进入编码在同一把锁里，之后 cancel 看到 encoding 就不再接受取消
+        self._check_cancelled(job_id, next_state="encoding")
+
+        out_video = out_video_path(video_path, options["mosaic"])
+        # 先删掉旧的输出，编码后文件存在即说明编码成功
+        if os.path.exists(out_video):
+            os.remove(out_video)
+        rebuild_video(self.ffmpeg_path, video_rate, out_frames_folder, f"{video_path}", out_video)
+        if not os.path.exists(out_video):
+            raise RuntimeError(f"Failed to encode {out_video}")
+        if options["delete_frames_after_processed"]:
+            shutil.rmtree(f"{self.work_folder}/{job_id}", ignore_errors=True)
+        self._update(job_id, state="finished", output=out_video)
+
+    def _check_workers(self) -> None:
+        """
+        worker 被杀（例如内存不足）时它手上的帧块不会再交回：补上新的 worker，当前任务按失败处理
+        """
+        dead = [index for index, worker in enumerate(self.workers) if not worker.is_alive()]
+        for index in dead:
+            self.workers[index] = self._start_worker()
+        if dead:
+            raise RuntimeError(f"{len(dead)} render workers exited unexpectedly")
+
+
+class RenderServiceManager(BaseManager):
+    pass
+
+
+def serve(address: Union[str, Tuple[str, int]] = DEFAULT_ADDRESS, authkey: bytes = b"",
+          process_num: int = 0, cache_options: dict = None) -> None:
+    """
+    :param authkey: 为空时取环境变量 AUTHKEY_ENV；都为空时只允许监听本机地址
+    """
+    authkey = authkey or env_authkey()
+    if not authkey:
+        if not is_loopback(address):
+            raise ValueError(f"Refusing to listen on {address} without an authkey, set --AUTHKEY or {AUTHKEY_ENV}")
+        authkey = DEFAULT_AUTHKEY
+    service = RenderService(process_num=process_num, cache_options=cache_options)
+    RenderServiceManager.register("get_service", callable=lambda: service)
+    if isinstance(address, str) and os.path.exists(address):
+        os.remove(address)
+    manager = RenderServiceManager(address=address, authkey=authkey)
+    print(f"Render service with {service.process_num} workers is listening on {address}")
+    manager.get_server().serve_forever()
+
+
+def connect_service(address: Union[str, Tuple[str, int]] = DEFAULT_ADDRESS, authkey: bytes = b""):
+    """
+    :param authkey: 为空时取环境变量 AUTHKEY_ENV，再为空时使用本机默认值
+    :return: 服务代理，可调用 submit/status；服务未启动时返回 None
+    """
+    RenderServiceManager.register("get_service")
+    manager = RenderServiceManager(address=address, authkey=authkey or env_authkey() or DEFAULT_AUTHKEY)
+    try:
+        manager.connect()
+    except multiprocessing.AuthenticationError:
+        print(f"The render service at {address} rejected the authkey")
+        return None
+    except (ConnectionError, FileNotFoundError, OSError):
+        return None
+    return manager.get_service()
+
+
+def wait_job(service, job_id: str, interval: float = 0.5) -> dict:
+    # 轮询任务进度并打印，直到任务结束
+    while True:
+        job = service.status(job_id)
+        print(f"\r[{job_id}] {job['state']} {job['done']}/{job['total']} {job['fps']:.1f} fps", end="", flush=True)
+        if job["state"] in ("finished", "failed", "cancelled"):
+            print()
+            print(f"Render cache: {job['cache_hits']} hits, {job['cache_misses']} misses")
+            return job
+        time.sleep(interval)
+
+
+if __name__ in "__main__":
+    parser = argparse.ArgumentParser(description="Long-lived render worker pool serving successive conversion jobs")
+    parser.add_argument("--ADDRESS", type=str, default=None,
+                        help="Unix socket path or host:port to listen on")
+    parser.add_argument("--AUTHKEY", type=str, default="",
+                        help=f"Shared secret of the service, required unless listening on a local address. "
+                             f"Can also be given by the {AUTHKEY_ENV} environment variable")
+    parser.add_argument("--PROCESS_NUM", type=int, default=0,
+                        help="Number of worker processes. If 0, it is decided by CPU count and available memory")
+    parser.add_argument("--CACHE", type=str, default="yes",
+                        help="Whether to keep a render cache in every worker across jobs")
+    parser.add_argument("--CACHE_DIR", type=str, default="",
+                        help="Folder of a persistent render cache. If empty, the cache lives in memory only")
+    parser.add_argument("--CACHE_SIZE_MB", type=int, default=1024,
+                        help="Size limit of the persistent render cache")
+    args = parser.parse_args()
+
+    try:
+        serve(address=parse_address(args.ADDRESS) if args.ADDRESS else DEFAULT_ADDRESS,
+              authkey=args.AUTHKEY.encode("utf-8"), process_num=args.PROCESS_NUM,
+              cache_options=dict(disk_folder=args.CACHE_DIR, disk_limit=args.CACHE_SIZE_MB * 1024 * 1024)
+              if args.CACHE == "yes" else None)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    sys.exit(0)
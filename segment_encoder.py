@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+from video_to_char import encode_segment, concat_segments
+from frame_format import frame_extension, input_options
+
+
+class SegmentEncoder:
+    """
+    边渲染边编码：按序完成的帧每凑满一段，就在后台用一个 ffmpeg 独立编码这一段，最多同时运行 max_running 个；
+    渲染结束后只需编码最后不满一段的帧，再用 concat demuxer 无损拼接并带上原音轨
+
+    每段单独编码、以关键帧开头，段边界即 GOP 边界，拼接时不需要重新编码。
+    """
+
+    def __init__(self,
+                 ffmpeg_path: str,
+                 rate: Union[int, str],
+                 frames: List[str],
+                 output_folder: str,
+                 segments_folder: str,
+                 segment_frames: int = 240,
+                 max_running: int = 2,
+                 frame_format: str = "jpg",
+                 frame_size: Tuple[int, int] = None):
+        """
+        :param frame_size: 输出帧的尺寸，raw 格式必须给出
+        """
+        self.ffmpeg_path = ffmpeg_path
+        self.rate = rate
+        self.frames = frames
+        self.output_folder = output_folder
+        self.segments_folder = segments_folder
+        self.segment_frames = max(segment_frames, 1)
+        self.frame_pattern = f"{output_folder}/out_frame%08d.{frame_extension(frame_format)}"
+        self.frame_input_options = input_options(frame_format, frame_size)
+        self.segments = list()
+        self._futures = list()
+        self._executor = ThreadPoolExecutor(max_workers=max_running)
+        os.makedirs(segments_folder, exist_ok=True)
+
+    def on_ready(self, ready: int) -> None:
+        """
+        :param ready: 前 ready 帧都已经渲染完成
+        """
+        while ready - len(self.segments) * self.segment_frames >= self.segment_frames:
+            self._submit(len(self.segments) * self.segment_frames, (len(self.segments) + 1) * self.segment_frames)
+
+    def finish(self) -> Optional[List[str]]:
+        """
+        编码剩余的帧并等待所有分段完成
+
+        :return: 按顺序排列的分段路径，有分段编码失败时返回 None
+        """
+        if len(self.segments) * self.segment_frames < len(self.frames):
+            self._submit(len(self.segments) * self.segment_frames, len(self.frames))
+        returncodes = [future.result() for future in self._futures]
+        self._executor.shutdown()
+        return self.segments if not any(returncodes) else None
+
+    def join(self, video: str, out_video: str) -> int:
+        segments = self.finish()
+        if not segments:
+            return 1
+        return concat_segments(self.ffmpeg_path, segments, video, out_video)
+
+    def _submit(self, start: int, end: int) -> None:
+        out_segment = f"{self.segments_folder}/segment_{len(self.segments):05d}.mp4"
+        # 输出帧沿用源帧的编号：frame00000001.jpg -> out_frame00000001.jpg
+        start_number = int(os.path.splitext(self.frames[start])[0][len("frame"):])
+        self.segments.append(out_segment)
+        self._futures.append(self._executor.submit(encode_segment, self.ffmpeg_path, self.rate, self.frame_pattern,
+                                                   start_number, end - start, out_segment, self.frame_input_options))
@@ -0,0 +1,201 @@
+import sys
+import time
+import shutil
+import subprocess
+from fractions import Fraction
+from typing import Tuple, List
+
+import numpy as np
+from PIL import Image, ImageColor
+
+from video_to_char import ascii_char, frame_to_grids, char_grid_size
+from frame_stream import decoder_command
+
+# 终端字符格的高约为宽的两倍，行数减半才能保持画面比例
+CELL_ASPECT = 0.5
+
+RESET = "\x1b[0m"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+ALT_SCREEN = "\x1b[?1049h"
+MAIN_SCREEN = "\x1b[?1049l"
+
+
+def terminal_grid_size(frame_size: Tuple[int, int], columns: int = 0) -> Tuple[int, int]:
+    """
+    终端里的字符网格 (列数, 行数)：默认铺满终端宽度，高度不超过终端行数（留一行给状态栏）
+    """
+    terminal_columns, terminal_rows = shutil.get_terminal_size()
+    columns = columns or terminal_columns
+    width, height = frame_size
+    rows = max(int(columns * height / width * CELL_ASPECT), 1)
+    if rows > terminal_rows - 1:
+        rows = max(terminal_rows - 1, 1)
+        columns = max(int(rows * width / height / CELL_ASPECT), 1)
+    return columns, rows
+
+
+class TerminalScreen:
+    """
+    把字符/颜色网格以 ANSI 真彩色写到终端，和上一帧逐格比较，只输出变化的格子
+
+    颜色各通道差都不超过 color_tolerance 且字符相同的格子不重写；
+    同一行两段变化之间的间隔不超过 gap_merge 格时直接连着写，比移动光标更省字节。
+    """
+
+    def __init__(self,
+                 bg_color: str = "black",
+                 text_color: str = "auto",
+                 color_tolerance: int = 0,
+                 gap_merge: int = 4,
+                 stream=None):
+        self.background = ImageColor.getcolor(bg_color, "RGB")
+        self.fixed_color = None if text_color == "auto" else ImageColor.getcolor(text_color, "RGB")
+        self.color_tolerance = color_tolerance
+        self.gap_merge = gap_merge
+        self.stream = stream or sys.stdout.buffer
+        self.chars = np.array(ascii_char)
+        self.bytes_written = 0
+        self._color_codes = dict()
+        self.reset()
+
+    def reset(self) -> None:
+        self.char_grid = None
+        self.color_grid = None
+
+    def open(self) -> None:
+        self._write(f"{ALT_SCREEN}{HIDE_CURSOR}{self._background_code()}\x1b[2J")
+
+    def close(self) -> None:
+        self._write(f"{RESET}{SHOW_CURSOR}{MAIN_SCREEN}")
+
+    def _background_code(self) -> str:
+        return "\x1b[48;2;{};{};{}m".format(*self.background)
+
+    def _write(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.stream.write(data)
+        self.stream.flush()
+        self.bytes_written += len(data)
+
+    def draw(self, char_grid: np.ndarray, color_grid: np.ndarray, status: str = "") -> None:
+        if self.fixed_color is not None:
+            color_grid = np.broadcast_to(np.array(self.fixed_color, dtype=np.uint8), color_grid.shape)
+
+        if self.char_grid is None or self.char_grid.shape != char_grid.shape:
+            changed = np.ones(char_grid.shape, dtype=bool)
+            self.char_grid = char_grid.copy()
+            self.color_grid = np.array(color_grid)
+            prefix = f"{self._background_code()}\x1b[2J"
+        else:
+            changed = char_grid != self.char_grid
+            changed |= np.abs(color_grid.astype(np.int16) - self.color_grid.astype(np.int16)).max(axis=2) > self.color_tolerance
+            # 未变化的格子保留屏幕上实际显示的颜色，容差才不会随帧累积
+            self.char_grid[changed] = char_grid[changed]
+            self.color_grid[changed] = color_grid[changed]
+            prefix = ""
+
+        # 颜色打包成一个整数，转义序列按打包值缓存
+        packed = self.color_grid.astype(np.uint32)
+        packed = ((packed[..., 0] << 16) | (packed[..., 1] << 8) | packed[..., 2]).tolist()
+        chars = self.chars[self.char_grid].tolist()
+        parts = [prefix]
+        last_color = None
+        for i, start, end in self._changed_spans(changed):
+            parts.append(f"\x1b[{i + 1};{start + 1}H")
+            row_chars, row_colors = chars[i], packed[i]
+            for j in range(start, end):
+                color = row_colors[j]
+                if color != last_color:
+                    parts.append(self._color_code(color))
+                    last_color = color
+                parts.append(row_chars[j])
+        if status:
+            parts.append(f"\x1b[{self.char_grid.shape[0] + 1};1H{RESET}{status}\x1b[K{self._background_code()}")
+        self._write("".join(parts))
+
+    def _color_code(self, color: int) -> str:
+        code = self._color_codes.get(color)
+        if code is None:
+            if len(self._color_codes) >= 65536:
+                self._color_codes.clear()
+            code = self._color_codes[color] = f"\x1b[38;2;{color >> 16};{(color >> 8) & 255};{color & 255}m"
+        return code
+
+    def _changed_spans(self, changed: np.ndarray) -> List[Tuple[int, int, int]]:
+        # 每行连续的变化格子合成 (row, start, end)，间隔很短的相邻段合并
+        rows, columns = changed.shape
+        padded = np.zeros((rows, columns + 2), dtype=bool)
+        padded[:, 1:-1] = changed
+        edges = np.flatnonzero(padded[:, 1:] != padded[:, :-1])
+        starts, ends = edges[::2], edges[1::2]
+        spans = list()
+        for row, start, end in zip((starts // (columns + 1)).tolist(), (starts % (columns + 1)).tolist(),
+                                   (ends % (columns + 1)).tolist()):
+            if spans and spans[-1][0] == row and start - spans[-1][2] <= self.gap_merge:
+                spans[-1][2] = end
+            else:
+                spans.append([row, start, end])
+        return spans
+
+
+def play(video: str,
+         ffmpeg_path: str,
+         frame_size: Tuple[int, int],
+         rate: str,
+         columns: int = 0,
+         bg_color: str = "black",
+         text_color: str = "auto",
+         mosaic: bool = False,
+         block_size: int = 20,
+         color_tolerance: int = 8,
+         show_status: bool = True) -> dict:
+    """
+    ffmpeg 解码 stdout -> 字符网格 -> ANSI 真彩色直接写到终端，按源帧率播放
+
+    落后于播放时钟超过一帧时，直接丢弃这一帧（仍需从管道读出），追上后恢复逐帧绘制。
+
+    :return: {"frames": 总帧数, "shown": 显示的帧数, "dropped": 丢弃的帧数, "bytes": 写到终端的字节数}
+    """
+    frame_interval = 1 / Fraction(rate)
+    grid_columns, grid_rows = terminal_grid_size(frame_size, columns)
+    # 马赛克按块取样，换算到终端网格后仍保持块状
+    width, height = char_grid_size(frame_size, block_size=block_size, width=grid_columns, height=grid_rows, mosaic=mosaic)
+    # 不做马赛克时直接让 ffmpeg 缩到网格大小，之后的最近邻缩放就是原样返回
+    decode_size = frame_size if mosaic else (width, height)
+    frame_bytes = decode_size[0] * decode_size[1] * 3
+
+    screen = TerminalScreen(bg_color=bg_color, text_color=text_color, color_tolerance=color_tolerance)
+    decoder = subprocess.Popen(decoder_command(ffmpeg_path, video, None if mosaic else decode_size),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    buffer = bytearray(frame_bytes)
+    frames, shown, dropped = 0, 0, 0
+    screen.open()
+    start_time = time.perf_counter()
+    try:
+        while decoder.stdout.readinto(buffer) == frame_bytes:
+            due = start_time + float(frames * frame_interval)
+            frames += 1
+            # 下一帧的时刻都已经过了，这一帧来不及显示
+            if time.perf_counter() > due + float(frame_interval):
+                dropped += 1
+                continue
+
+            frame = Image.frombuffer("RGB", decode_size, buffer, "raw", "RGB", 0, 1)
+            char_grid, color_grid = frame_to_grids(frame, block_size=block_size, width=width, height=height, mosaic=mosaic)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            status = f"{frames} frames | dropped {dropped} | {float(1 / frame_interval):.0f} fps" if show_status else ""
+            screen.draw(char_grid, color_grid, status)
+            shown += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        screen.close()
+        decoder.stdout.close()
+        decoder.kill()
+        decoder.wait()
+
+    print(f"Played {shown}/{frames} frames, dropped {dropped}, wrote {screen.bytes_written / 1024 / 1024:.1f} MB to the terminal")
+    return dict(frames=frames, shown=shown, dropped=dropped, bytes=screen.bytes_written)
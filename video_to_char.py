@@ -1,13 +1,29 @@
+import io
 import os
+import sys
+import time
+import queue
+import atexit
 import argparse
+import functools
 import subprocess
 import multiprocessing
 from pathlib import Path
 
 import psutil
+import numpy as np
 from PIL import Image
-from PIL import ImageFont, ImageDraw
-from typing import NewType, Union, Tuple, List
+from PIL import ImageFont, ImageDraw, ImageColor
+from typing import NewType, Optional, Union, Tuple, List, Callable, Iterator
+
+from chunk_scheduler import ChunkScheduler, OrderedProgress, default_process_num, default_chunk_size
+from pipeline_report import StageTimer, PipelineReport
+from job_manifest import JobManifest, JobLock, video_hash, options_key, already_encoded
+from render_cache import RenderCache, render_key, encode_image
+from color_palette import PALETTE_MODES, PaletteRenderer, adaptive_palette, fixed_palette, palette_key, palette_lut, \
+    quantize_colors
+from frame_format import (FRAME_FORMATS, frame_extension, extract_options, input_options, read_frame, encode_frame,
+                          frame_validator)
 
 FRAME = NewType("FRAME", Image)
 
@@ -29,6 +45,37 @@ def get_char(r, g, b, alpha=256) -> str:
     return ascii_char[int(gray/unit)]
 
 
+def gray_to_char_index(ramp_length: int) -> np.ndarray:
+    # 灰度值 -> 字符表下标的查找表，与 get_char 的计算方式一致
+    return np.array([int(gray / ((256.0 + 1) / ramp_length)) for gray in range(256)], dtype=np.uint8)
+
+
+GRAY_TO_CHAR_INDEX = gray_to_char_index(len(ascii_char))
+BLANK_CHAR_INDEX = ascii_char.index(' ')
+
+
+def frame_to_char_grid(frame: FRAME,
+                       lookup: np.ndarray = GRAY_TO_CHAR_INDEX,
+                       blank_index: int = BLANK_CHAR_INDEX) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    整帧一次性计算 BT.709 灰度并查表得到字符下标，取代逐像素 getpixel + get_char
+
+    :param lookup: 灰度值 -> 字符下标，默认对应 ascii_char
+    :param blank_index: 透明像素使用的字符下标
+    :return: (char_grid, color_grid)，分别为 (h, w) 的 uint8 字符下标和 (h, w, 3) 的 uint8 颜色
+    """
+    if frame.mode != "RGBA":
+        frame = frame.convert("RGB")
+    pixels = np.asarray(frame)
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    # 与 get_char 相同的运算顺序，保证截断取整后结果一致
+    gray = (0.2126 * r + 0.7152 * g + 0.0722 * b).astype(np.uint8)
+    char_grid = lookup[gray]
+    if frame.mode == "RGBA":
+        char_grid[pixels[..., 3] == 0] = blank_index
+    return char_grid, np.ascontiguousarray(pixels[..., :3])
+
+
 def draw_text(text: str,
               text_color: Union[str, tuple],
               text_size: int,
@@ -39,7 +86,64 @@ def draw_text(text: str,
     draw.text(location, text, fill=text_color, font=font)
 
 
-def pixelate_image_info(frame: FRAME, block_size: int) -> Tuple[FRAME, list]:
+class GlyphAtlas:
+    """
+    字形图集：每个 (font, text_size) 只把 ascii_char 中的字符栅格化一次，缓存灰度 mask，
+    绘制时用 mask 直接贴色，取代逐格调用 draw_text（每次都要重新加载字体）
+
+    贴色走的是和 ImageDraw.text 相同的 mask 混合，输出与逐格 draw_text 逐像素一致
+    """
+
+    def __init__(self, font: str = "w6.ttf", text_size: int = 5, chars: List[str] = ascii_char):
+        self.font = font
+        self.text_size = text_size
+        self.chars = list(chars)
+        _font = ImageFont.truetype(font, text_size)
+        # 每个字符: (mask, (offset_x, offset_y))，空白字符为 None
+        self.glyphs = [self._rasterize(char, _font) for char in self.chars]
+        self.char_index = {char: index for index, char in enumerate(self.chars)}
+        # 字形向 (左, 上, 右, 下) 最多越出自身格子几格（如 '|' 向下越界），增量重绘时要把这些邻格一起考虑
+        overflows = [self._overflow_cells(glyph, text_size) for glyph in self.glyphs if glyph is not None]
+        self.overflow = tuple(max([overflow[k] for overflow in overflows] + [0]) for k in range(4))
+
+    @staticmethod
+    def _overflow_cells(glyph, text_size: int) -> Tuple[int, int, int, int]:
+        mask, (offset_x, offset_y) = glyph
+        overflow = (-offset_x, -offset_y, offset_x + mask.width - text_size, offset_y + mask.height - text_size)
+        return tuple(-(-max(pixels, 0) // text_size) for pixels in overflow)
+
+    @staticmethod
+    def _rasterize(char: str, font: ImageFont.FreeTypeFont):
+        left, top, right, bottom = font.getbbox(char)
+        if right <= left or bottom <= top:
+            return None
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=font)
+        return mask, (left, top)
+
+    def draw(self, frame: FRAME, char_index: int, location: tuple, color: Union[str, tuple]) -> None:
+        glyph = self.glyphs[char_index]
+        if glyph is None:
+            return
+        mask, (offset_x, offset_y) = glyph
+        frame.paste(color, (location[0] + offset_x, location[1] + offset_y), mask)
+
+    def draw_text(self, frame: FRAME, text: str, location: tuple, color: Union[str, tuple]) -> None:
+        self.draw(frame, self.char_index[text], location, color)
+
+
+@functools.lru_cache(maxsize=None)
+def get_glyph_atlas(font: str = "w6.ttf", text_size: int = 5) -> GlyphAtlas:
+    # 进程内缓存，同一 worker 处理后续帧时不再重复加载字体
+    return GlyphAtlas(font=font, text_size=text_size)
+
+
+def mosaic_grid(frame: FRAME, block_size: int) -> FRAME:
+    """
+    计算马赛克块均值网格：每个块缩成一个像素（box 均值），一次完成，不逐块 crop
+
+    :return: 宽高为块数的图片，(x, y) 处像素即第 (x, y) 块的平均颜色
+    """
     # 确保块大小是整数且大于0
     block_size = int(block_size)
     if block_size <= 0:
@@ -51,26 +155,283 @@ def pixelate_image_info(frame: FRAME, block_size: int) -> Tuple[FRAME, list]:
     new_height = int(height / block_size) * block_size
     frame = frame.resize((new_width, new_height))
 
-    # 将图片分割成块
-    coordinate_colors = list()
-    pixels = frame.load()
-    for i in range(0, new_width, block_size):
-        for j in range(0, new_height, block_size):
-            block = frame.crop((i, j, i + block_size, j + block_size))
+    return frame.reduce(block_size)
+
+
+def _nearest_indices(src_length: int, dst_length: int) -> np.ndarray:
+    # 取 Image.NEAREST 缩放时每个输出位置采样的源坐标，与 resize 的取整规则完全一致
+    index_line = Image.fromarray(np.arange(src_length, dtype=np.int32)[None, :])
+    return np.asarray(index_line.resize((dst_length, 1), Image.NEAREST))[0]
+
+
+def sample_mosaic_grid(block_grid: FRAME, block_size: int, size: Tuple[int, int]) -> FRAME:
+    """
+    等价于把马赛克整幅回写后再 resize(size, Image.NEAREST)，但直接从块均值网格取样
+    """
+    columns = _nearest_indices(block_grid.width * block_size, size[0]) // block_size
+    rows = _nearest_indices(block_grid.height * block_size, size[1]) // block_size
+    return Image.fromarray(np.asarray(block_grid)[rows[:, None], columns[None, :]], mode=block_grid.mode)
+
+
+def pixelate_image_info(frame: FRAME, block_size: int) -> Tuple[FRAME, list]:
+    block_size = int(block_size)
+    block_grid = mosaic_grid(frame, block_size)
 
-            # 计算块的平均颜色
-            avg_color = block.resize((1, 1)).getpixel((0, 0))
-            # # (color, x, y)
-            coordinate_colors.append((avg_color, i, j))
+    # 用平均颜色填充整个块：最近邻放大回原尺寸
+    frame = block_grid.resize((block_grid.width * block_size, block_grid.height * block_size), Image.NEAREST)
 
-            # # 用平均颜色填充整个块
-            for x in range(i, i + block_size):
-                for y in range(j, j + block_size):
-                    pixels[x, y] = avg_color
+    # # (color, x, y)
+    pixels = block_grid.load()
+    coordinate_colors = [(pixels[x, y], x * block_size, y * block_size)
+                         for x in range(block_grid.width)
+                         for y in range(block_grid.height)]
 
     return frame, coordinate_colors
 
 
+def render_char_grid(char_grid: np.ndarray,
+                     color_grid: np.ndarray,
+                     text_size: int = 5,
+                     bg_color: str = "white",
+                     text_color: str = "auto",
+                     font: str = "w6.ttf",
+                     atlas: GlyphAtlas = None) -> FRAME:
+    height, width = char_grid.shape
+    new_image = Image.new("RGB", (width * text_size, height * text_size), color=bg_color)
+    atlas = atlas or get_glyph_atlas(font, text_size)
+    fixed_color = None if text_color == "auto" else ImageColor.getcolor(text_color, "RGB")
+    # tolist 一次性转成 python 对象，避免逐格索引 numpy 数组
+    chars, colors = char_grid.tolist(), color_grid.tolist()
+    for i in range(height):
+        row_chars, row_colors = chars[i], colors[i]
+        for j in range(width):
+            _color = tuple(row_colors[j]) if fixed_color is None else fixed_color
+            atlas.draw(new_image, row_chars[j], (j * text_size, i * text_size), _color)
+    return new_image
+
+
+class IncrementalRenderer:
+    """
+    增量渲染：和上一帧的字符/颜色网格比较，只在复用的画布上重画变化的格子
+
+    各通道颜色差都不超过 color_tolerance 的格子视为未变化；color_tolerance=0 时输出与 render_char_grid 逐像素一致。
+    返回的画布会在下一帧被原地修改，调用方需要在此之前保存或复制。
+    """
+
+    def __init__(self,
+                 text_size: int = 5,
+                 bg_color: str = "white",
+                 text_color: str = "auto",
+                 font: str = "w6.ttf",
+                 color_tolerance: int = 0,
+                 full_redraw_ratio: float = 0.8,
+                 atlas: GlyphAtlas = None):
+        self.text_size = text_size
+        self.bg_color = bg_color
+        self.text_color = text_color
+        self.font = font
+        self.color_tolerance = color_tolerance
+        # 估算的重画量（按字形绘制次数计）超过整帧的这个比例时，直接整帧重画
+        self.full_redraw_ratio = full_redraw_ratio
+        # 每段临时画布的开销，折算成字形绘制次数
+        self.span_overhead = 4
+        self.atlas = atlas or get_glyph_atlas(font, text_size)
+        self.background = ImageColor.getcolor(bg_color, "RGB")
+        self.fixed_color = None if text_color == "auto" else ImageColor.getcolor(text_color, "RGB")
+        self.total_cells = 0
+        self.reused_cells = 0
+        self.reset()
+
+    def reset(self) -> None:
+        # 开始一段不连续的帧之前调用
+        self.canvas = None
+        self.char_grid = None
+        self.color_grid = None
+
+    @property
+    def reuse_ratio(self) -> float:
+        return self.reused_cells / self.total_cells if self.total_cells else 0.0
+
+    def render(self, char_grid: np.ndarray, color_grid: np.ndarray) -> FRAME:
+        self.total_cells += char_grid.size
+        if self.canvas is None or self.char_grid.shape != char_grid.shape:
+            return self._render_full(char_grid, color_grid)
+
+        # 字符由颜色决定，颜色在容差内的格子连同字符一起沿用，避免噪声让字符在相邻灰阶间来回跳
+        changed = np.abs(color_grid.astype(np.int16) - self.color_grid.astype(np.int16)).max(axis=2) > self.color_tolerance
+        if self.fixed_color is not None:
+            # 固定颜色时只有字符变化才需要重画
+            changed &= char_grid != self.char_grid
+
+        # 变化格子的新旧字形都可能越界到邻格，邻格也要重画
+        left, top, right, bottom = self.atlas.overflow
+        dirty = changed.copy()
+        for di in range(-top, bottom + 1):
+            for dj in range(-left, right + 1):
+                dirty |= self._shift(changed, di, dj)
+        spans = self._dirty_spans(dirty)
+
+        # 每段要画 (top + bottom + 1) 行、(长度 + left + right) 列字形，外加一张临时画布的开销
+        redraw_cost = sum((end - start + left + right) * (top + bottom + 1) + self.span_overhead for _, start, end in spans)
+        if redraw_cost > self.full_redraw_ratio * char_grid.size:
+            return self._render_full(char_grid, color_grid)
+
+        self.reused_cells += char_grid.size - int(np.count_nonzero(dirty))
+        # 只更新变化的格子，未变化格子保留画布上实际使用的颜色
+        self.char_grid[changed] = char_grid[changed]
+        self.color_grid[changed] = color_grid[changed]
+        chars, colors = self.char_grid.tolist(), self.color_grid.tolist()
+        for i, start, end in spans:
+            self._redraw_span(chars, colors, i, start, end)
+        return self.canvas
+
+    @staticmethod
+    def _dirty_spans(dirty: np.ndarray) -> List[Tuple[int, int, int]]:
+        # 每行中连续的脏格子合成一段 (row, start, end)
+        spans = list()
+        for i in np.flatnonzero(dirty.any(axis=1)):
+            row = np.concatenate(([False], dirty[i], [False]))
+            edges = np.flatnonzero(row[1:] != row[:-1])
+            spans.extend((int(i), int(start), int(end)) for start, end in zip(edges[::2], edges[1::2]))
+        return spans
+
+    @staticmethod
+    def _shift(mask: np.ndarray, di: int, dj: int) -> np.ndarray:
+        # shifted[i + di, j + dj] = mask[i, j]，越界部分补 False
+        height, width = mask.shape
+        shifted = np.zeros_like(mask)
+        shifted[max(di, 0):height + min(di, 0), max(dj, 0):width + min(dj, 0)] = \
+            mask[max(-di, 0):height + min(-di, 0), max(-dj, 0):width + min(-dj, 0)]
+        return shifted
+
+    def _render_full(self, char_grid: np.ndarray, color_grid: np.ndarray) -> FRAME:
+        self.canvas = render_char_grid(char_grid, color_grid,
+                                       text_size=self.text_size,
+                                       bg_color=self.bg_color,
+                                       text_color=self.text_color,
+                                       font=self.font,
+                                       atlas=self.atlas)
+        self.char_grid = char_grid.copy()
+        self.color_grid = color_grid.copy()
+        return self.canvas
+
+    def _redraw_span(self, chars: list, colors: list, i: int, start: int, end: int) -> None:
+        # 在一张临时画布上按原绘制顺序（行优先）重画所有可能落进 [start, end) 这段格子的字形，
+        # 临时画布的边界即裁剪范围，再整段贴回
+        text_size = self.text_size
+        left, top, right, bottom = self.atlas.overflow
+        height, width = self.char_grid.shape
+        span = Image.new("RGB", ((end - start) * text_size, text_size), self.background)
+        for row in range(max(i - bottom, 0), min(i + top + 1, height)):
+            row_chars, row_colors = chars[row], colors[row]
+            for column in range(max(start - right, 0), min(end + left, width)):
+                color = tuple(row_colors[column]) if self.fixed_color is None else self.fixed_color
+                self.atlas.draw(span, row_chars[column], ((column - start) * text_size, (row - i) * text_size), color)
+        self.canvas.paste(span, (start * text_size, i * text_size))
+
+
+def char_grid_size(frame_size: Tuple[int, int],
+                   block_size: int = 10,
+                   width: int = 0,
+                   height: int = 0,
+                   mosaic: bool = False) -> Tuple[int, int]:
+    """
+    字符网格的列数、行数；输出画面尺寸为 (列数 * text_size, 行数 * text_size)
+
+    width、height 都为 0 时默认 100 列；只给 width 时按原画面比例计算行数
+    """
+    original_width, original_height = frame_size
+    if mosaic:
+        # 马赛克会先把画面缩放到块的整数倍
+        block_size = int(block_size)
+        original_width = int(original_width / block_size) * block_size
+        original_height = int(original_height / block_size) * block_size
+    default_resized_width = 100
+
+    actual_resized_width = width if width > 0 else default_resized_width
+    if width > 0 and height > 0:
+        actual_resized_height = height
+    else:
+        actual_resized_height = max(int(actual_resized_width * original_height / original_width), 1)
+    return actual_resized_width, actual_resized_height
+
+
+def frame_memory_bytes(frame_size: Tuple[int, int],
+                       text_size: int = 10,
+                       block_size: int = 20,
+                       columns: int = 0,
+                       mosaic: bool = False) -> int:
+    """
+    worker 渲染一帧时同时驻留的像素字节：解码后的 RGB 输入帧 + 输出画布，用于按可用内存决定进程数
+    """
+    grid_columns, grid_rows = char_grid_size(frame_size, block_size=block_size, width=columns, mosaic=mosaic)
+    return (frame_size[0] * frame_size[1] + grid_columns * grid_rows * text_size * text_size) * 3
+
+
+def pixelate_frame(im: FRAME,
+                   block_size: int = 10,
+                   width: int = 0,
+                   height: int = 0,
+                   mosaic: bool = False) -> FRAME:
+    """
+    把帧缩成字符网格大小，每个像素对应一个字符格
+    """
+    grid_size = char_grid_size(im.size, block_size=block_size, width=width, height=height, mosaic=mosaic)
+
+    if mosaic:
+        # 下游只需要块均值，直接从网格采样，跳过整幅回写
+        return sample_mosaic_grid(mosaic_grid(im, block_size), block_size, grid_size)
+    return im.resize(grid_size, Image.NEAREST)
+
+
+def frame_to_grids(im: FRAME,
+                   block_size: int = 10,
+                   width: int = 0,
+                   height: int = 0,
+                   mosaic: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    return frame_to_char_grid(pixelate_frame(im, block_size=block_size, width=width, height=height, mosaic=mosaic))
+
+
+def render_frame(im: FRAME,
+                 block_size: int = 10,
+                 bg_color: str = "white",
+                 text_color: str = "auto",
+                 width: int = 0,
+                 height: int = 0,
+                 mosaic: bool = False,
+                 text_size: int = 5,
+                 font: str = "w6.ttf") -> FRAME:
+    char_grid, color_grid = frame_to_grids(im, block_size=block_size, width=width, height=height, mosaic=mosaic)
+    return render_char_grid(char_grid, color_grid,
+                            text_size=text_size,
+                            bg_color=bg_color,
+                            text_color=text_color,
+                            font=font)
+
+
+def video_palette(frames_folder: str,
+                  frames: List[str],
+                  mode: str,
+                  size: int = 16,
+                  block_size: int = 10,
+                  columns: int = 100,
+                  mosaic: bool = False,
+                  frame_format: str = "jpg",
+                  frame_size: Tuple[int, int] = None) -> np.ndarray:
+    """
+    整段视频共用的调色板；median / kmeans 按采样帧缩小后的字符网格选色
+
+    不按场景分别选色：各 worker 处理的是连续的一段帧，调色板不同会让相邻片段的颜色跳变
+    """
+    if mode == "fixed":
+        return fixed_palette(size)
+    from grid_calibration import sample_frames
+
+    grids = [pixelate_frame(im, block_size=block_size, width=columns, mosaic=mosaic)
+             for im in sample_frames(frames_folder, frames, sample_num=8, frame_format=frame_format, frame_size=frame_size)]
+    return adaptive_palette(grids, size, kmeans=mode == "kmeans")
+
+
 def transfer_to_text(frame_src: str,
                      out_picture: str,
                      block_size: int = 10,
@@ -79,104 +440,522 @@ def transfer_to_text(frame_src: str,
                      width: int = 0,
                      height: int = 0,
                      mosaic: bool = False,
-                     text_size: int = 5) -> None:
+                     text_size: int = 5,
+                     font: str = "w6.ttf",
+                     cache: RenderCache = None) -> None:
 
     im = Image.open(frame_src)
+    if cache is not None:
+        # 相同的字符网格和渲染参数必然得到相同的画面，命中时直接写出缓存的文件
+        grid = pixelate_frame(im, block_size=block_size, width=width, height=height, mosaic=mosaic)
+        key = render_key(grid, block_size=block_size, bg_color=bg_color, text_color=text_color, width=width,
+                         height=height, mosaic=mosaic, text_size=text_size, font=font)
+        data = cache.get(key)
+        if data is None:
+            char_grid, color_grid = frame_to_char_grid(grid)
+            data = encode_image(render_char_grid(char_grid, color_grid, text_size=text_size, bg_color=bg_color,
+                                                 text_color=text_color, font=font), out_picture)
+            cache.put(key, data)
+        with open(out_picture, "wb") as f:
+            f.write(data)
+        return
 
-    pixelate_image = pixelate_image_info(im, block_size)[0] if mosaic else im
+    new_image = render_frame(im,
+                             block_size=block_size,
+                             bg_color=bg_color,
+                             text_color=text_color,
+                             width=width,
+                             height=height,
+                             mosaic=mosaic,
+                             text_size=text_size,
+                             font=font)
+    new_image.save(f"{out_picture}")
 
-    original_width = pixelate_image.width
-    original_height = pixelate_image.height
-    default_resized_width = 100
 
-    actual_resized_width = default_resized_width if 0 in (width, height) else width
-    actual_resized_height = int(default_resized_width * original_height / original_width) if 0 in (width, height) else height
-
-    pixelate_image = pixelate_image.resize((actual_resized_width, actual_resized_height), Image.NEAREST)
-    new_width, new_height = pixelate_image.width, pixelate_image.height
-
-    # pixelate_image = np.array(pixelate_image)
-    infos = list()
-    for i in range(actual_resized_height):
-        for j in range(actual_resized_width):
-            pixel_color = pixelate_image.getpixel((j, i))
-            text = get_char(*pixel_color)
-            # text = get_char(*pixelate_image[j, i])
-            infos.append(((i, j), text, pixel_color))
-
-    new_image = Image.new("RGB", (new_width * text_size, new_height * text_size), color=bg_color)
-    for info in infos:
-        coordinate, text, color = info
-        _color = color if text_color == "auto" else text_color
-        draw_text(text=text, text_color=_color, text_size=text_size, frame=new_image, location=(coordinate[1] * text_size, coordinate[0] * text_size))
-    new_image.save(f"{out_picture}")
+class CharRenderer:
+    """
+    可复用的字符画渲染器：字体、字符表、尺寸、颜色只配置一次，之后直接在内存里逐帧渲染，不经过文件
+
+    >>> renderer = CharRenderer(text_size=10, block_size=20, bg_color="black")
+    >>> out = renderer.render(frame)  # (h, w, 3) uint8 数组 -> 渲染后的 (h', w', 3) uint8 数组
+
+    delta=True 时按连续帧增量重画（见 IncrementalRenderer），跳帧或换一段视频前调用 reset()。
+    """
+
+    def __init__(self,
+                 font: str = "w6.ttf",
+                 ramp: str = "",
+                 text_size: int = 10,
+                 block_size: int = 20,
+                 width: int = 0,
+                 height: int = 0,
+                 mosaic: bool = False,
+                 bg_color: str = "white",
+                 text_color: str = "auto",
+                 delta: bool = False,
+                 color_tolerance: int = 0,
+                 palette: list = None):
+        self.font = font
+        self.text_size = text_size
+        self.block_size = block_size
+        self.width = width
+        self.height = height
+        self.mosaic = mosaic
+        self.bg_color = bg_color
+        self.text_color = text_color
+        if ramp:
+            # 自定义字符表从深到浅排列；透明像素总是画成空格
+            chars = list(ramp) if ' ' in ramp else list(ramp) + [' ']
+            self.atlas = GlyphAtlas(font=font, text_size=text_size, chars=chars)
+            self.lookup = gray_to_char_index(len(ramp))
+            self.blank_index = chars.index(' ')
+        else:
+            self.atlas = get_glyph_atlas(font, text_size)
+            self.lookup = GRAY_TO_CHAR_INDEX
+            self.blank_index = BLANK_CHAR_INDEX
+        # 调色板模式（只在 text_color 为 auto 时生效）：查表量化颜色，用预着色的字形拼出整帧
+        self.palette = np.asarray(palette, dtype=np.uint8).reshape(-1, 3) if palette is not None and text_color == "auto" else None
+        if self.palette is not None:
+            self.palette_lut = palette_lut(self.palette)
+            self.palette_renderer = PaletteRenderer(self.atlas, self.palette, text_size=text_size, bg_color=bg_color)
+        self.incremental = IncrementalRenderer(text_size=text_size,
+                                               bg_color=bg_color,
+                                               text_color=text_color,
+                                               font=font,
+                                               color_tolerance=color_tolerance,
+                                               atlas=self.atlas) if delta else None
+
+    def reset(self) -> None:
+        if self.incremental is not None:
+            self.incremental.reset()
+
+    def output_size(self, frame_size: Tuple[int, int]) -> Tuple[int, int]:
+        columns, rows = char_grid_size(frame_size, block_size=self.block_size, width=self.width, height=self.height,
+                                       mosaic=self.mosaic)
+        return columns * self.text_size, rows * self.text_size
+
+    def render_image(self, frame: Union[np.ndarray, FRAME]) -> FRAME:
+        im = Image.fromarray(frame) if isinstance(frame, np.ndarray) else frame
+        grid = pixelate_frame(im, block_size=self.block_size, width=self.width, height=self.height, mosaic=self.mosaic)
+        char_grid, color_grid = frame_to_char_grid(grid, self.lookup, self.blank_index)
+        if self.palette is not None:
+            index_grid = quantize_colors(color_grid, self.palette_lut)
+            if self.incremental is None:
+                return self.palette_renderer.render(char_grid, index_grid)
+            color_grid = self.palette[index_grid]
+        if self.incremental is not None:
+            # 增量模式的画布会被下一帧原地修改，交给调用方的是副本
+            return self.incremental.render(char_grid, color_grid).copy()
+        return render_char_grid(char_grid, color_grid,
+                                text_size=self.text_size,
+                                bg_color=self.bg_color,
+                                text_color=self.text_color,
+                                atlas=self.atlas)
+
+    def render(self, frame: Union[np.ndarray, FRAME]) -> np.ndarray:
+        """
+        :param frame: (h, w, 3) 的 RGB uint8 数组（或 (h, w, 4) RGBA），也接受 PIL 图片
+        :return: (h', w', 3) 的 RGB uint8 数组，尺寸见 output_size
+        """
+        return np.asarray(self.render_image(frame))
+
+
+def convert_video(video: str, renderer: CharRenderer = None, ffmpeg_path: str = "",
+                  **render_options) -> Iterator[np.ndarray]:
+    """
+    逐帧惰性解码并渲染：ffmpeg 通过管道输出原始 RGB 帧，每次迭代渲染一帧，不产生中间文件
+
+    >>> for out in convert_video("test.MP4", text_size=10, block_size=20):
+    ...     encoder.write(out)
+
+    :param renderer: 不传时用 render_options 创建一个 CharRenderer
+    :param ffmpeg_path: 默认使用本项目根目录下的 ffmpeg
+    """
+    from frame_stream import decoder_command
+
+    ffmpeg_path = ffmpeg_path or ffmpeg_binaries(Path(__file__).resolve().parent)[0]
+    renderer = renderer or CharRenderer(**render_options)
+    # 按解码出的帧取尺寸：旋转过的视频 ffmpeg 会自动转正，ffprobe 报的宽高是反的
+    width, height = grab_frame(ffmpeg_path, video).size
+
+    decoder = subprocess.Popen(decoder_command(ffmpeg_path, video), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            data = decoder.stdout.read(width * height * 3)
+            if len(data) < width * height * 3:
+                break
+            yield renderer.render(np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3))
+    finally:
+        # 调用方提前停止迭代时结束解码进程
+        decoder.stdout.close()
+        decoder.kill()
+        decoder.wait()
 
 
 class WorkerProcess(multiprocessing.Process):
 
     def __init__(self,
-                 image_queue: multiprocessing.Queue,
+                 scheduler: ChunkScheduler,
+                 frames: List[str],
+                 result_queue: multiprocessing.Queue,
                  input_folder: str,
                  output_folder: str,
                  text_color: str = "auto",
                  bg_color: str="white",
-                 mosaic: bool = False):
+                 mosaic: bool = False,
+                 delta: bool = False,
+                 color_tolerance: int = 0,
+                 verbose: bool = True,
+                 cache_options: dict = None,
+                 text_size: int = 10,
+                 block_size: int = 20,
+                 columns: int = 0,
+                 frame_format: str = "jpg",
+                 frame_size: Tuple[int, int] = None,
+                 palette: list = None):
 
         super().__init__()
-        self.image_queue = image_queue
+        self.scheduler = scheduler
+        self.frames = frames
+        self.result_queue = result_queue
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.text_color = text_color
         self.mosaic = mosaic
         self.bg_color = bg_color
+        self.delta = delta
+        self.color_tolerance = color_tolerance
+        self.verbose = verbose
+        self.text_size = text_size
+        self.block_size = block_size
+        self.columns = columns
+        # 输入帧和输出帧使用同一种中间格式，raw 格式需要输入帧的尺寸
+        self.frame_format = frame_format
+        self.frame_size = frame_size
+        # 调色板模式：每格颜色映射到调色板中最近的一种，None 表示保留原色
+        self.palette = palette
+        self._palettes = dict()
+        # 缓存在各 worker 进程内创建；磁盘缓存目录由所有 worker 共享
+        self.cache_options = cache_options
+        self.cache = None
 
     def run(self):
+        self.cache = RenderCache(**self.cache_options) if self.cache_options is not None else None
+        renderer = IncrementalRenderer(text_size=self.text_size,
+                                       bg_color=self.bg_color,
+                                       text_color=self.text_color,
+                                       color_tolerance=self.color_tolerance) if self.delta else None
+        timer = StageTimer()
+        frame_num, busy_seconds = 0, 0.0
         while True:
-            # 从队列中获取图片路径
-            image_path = self.image_queue.get()
-            # 如果队列为空，则结束循环
-            if image_path is None:
+            # 领取一段连续帧，没有可领取的帧时结束
+            chunk = self.scheduler.claim()
+            if chunk is None:
                 break
-            # 处理图片
-            transfer_to_text(frame_src=f"{self.input_folder}/{image_path}",
-                             out_picture=f"{self.output_folder}/out_{image_path}",
-                             text_size=10,
-                             block_size=20,
-                             text_color=self.text_color,
-                             bg_color=self.bg_color,
-                             mosaic=self.mosaic)
+            if renderer is not None:
+                # 块与块之间不连续，需要重置
+                renderer.reset()
+
+            start = frame_index = self.scheduler.next_frame(chunk)
+            while frame_index is not None:
+                frame_start = time.perf_counter()
+                self.transfer_frame(self.frames[frame_index], timer, renderer)
+                busy_seconds += time.perf_counter() - frame_start
+                frame_num += 1
+                end = frame_index + 1
+                frame_index = self.scheduler.next_frame(chunk)
+            if start is not None:
+                self.result_queue.put(("done", (start, end)))
+
+        self.result_queue.put(("exit", dict(pid=self.pid,
+                                            frames=frame_num,
+                                            busy_seconds=busy_seconds,
+                                            stages=timer.as_dict(),
+                                            reused_cells=renderer.reused_cells if renderer is not None else 0,
+                                            total_cells=renderer.total_cells if renderer is not None else 0,
+                                            cache=self.cache.stats() if self.cache is not None else None)))
+
+    def palette_state(self) -> Optional[tuple]:
+        """
+        :return: 当前调色板的 (键, 颜色数组, 查找表, 渲染器)，查找表和预着色字形按调色板和渲染参数缓存，只建一次
+        """
+        if self.palette is None or self.text_color != "auto":
+            return None
+        colors = np.asarray(self.palette, dtype=np.uint8).reshape(-1, 3)
+        key = (palette_key(colors), self.text_size, self.bg_color)
+        if key not in self._palettes:
+            self._palettes[key] = (key[0], colors, palette_lut(colors),
+                                   PaletteRenderer(get_glyph_atlas("w6.ttf", self.text_size), colors,
+                                                   text_size=self.text_size, bg_color=self.bg_color))
+        return self._palettes[key]
+
+    def transfer_frame(self, image_path: str, timer: StageTimer, renderer: IncrementalRenderer = None) -> None:
+        # 处理图片，逐阶段计时
+        with timer.stage("decode"):
+            im = read_frame(f"{self.input_folder}/{image_path}", self.frame_format, self.frame_size)
+        with timer.stage("pixelate"):
+            pixelate_image = pixelate_frame(im, block_size=self.block_size, width=self.columns, mosaic=self.mosaic)
+        out_picture = f"{self.output_folder}/out_{image_path}"
+        palette = self.palette_state()
+        if self.cache is not None:
+            with timer.stage("cache"):
+                key = render_key(pixelate_image, block_size=self.block_size, bg_color=self.bg_color,
+                                 text_color=self.text_color, width=self.columns, height=0, mosaic=self.mosaic,
+                                 text_size=self.text_size, font="w6.ttf", frame_format=self.frame_format,
+                                 palette=palette[0] if palette is not None else None)
+                data = self.cache.get(key)
+            if data is not None:
+                with timer.stage("save"):
+                    with open(out_picture, "wb") as f:
+                        f.write(data)
+                if renderer is not None:
+                    # 跳过了这一帧的绘制，画布不再对应上一帧
+                    renderer.reset()
+                if self.verbose:
+                    print(f"{self.input_folder}/{image_path} 命中缓存！ -----> {out_picture}")
+                return
+        with timer.stage("mapping"):
+            char_grid, color_grid = frame_to_char_grid(pixelate_image)
+            if palette is not None:
+                index_grid = quantize_colors(color_grid, palette[2])
+                color_grid = palette[1][index_grid]
+        with timer.stage("drawing"):
+            if renderer is None and palette is not None:
+                # 预着色的字形按下标直接拼出整帧
+                new_image = palette[3].render(char_grid, index_grid)
+            elif renderer is None:
+                new_image = render_char_grid(char_grid, color_grid,
+                                             text_size=self.text_size,
+                                             bg_color=self.bg_color,
+                                             text_color=self.text_color)
+            else:
+                # 连续帧之间只重画变化的格子
+                new_image = renderer.render(char_grid, color_grid)
+        with timer.stage("save"):
+            data = encode_frame(new_image, self.frame_format)
+            with open(out_picture, "wb") as f:
+                f.write(data)
+            # 有容差的增量渲染结果依赖之前的帧，只有精确的结果才能放进缓存
+            if self.cache is not None and (renderer is None or self.color_tolerance == 0):
+                self.cache.put(key, data)
+        if self.verbose:
             print(f"{self.input_folder}/{image_path} 处理完成！ -----> {self.output_folder}/out_{image_path}")
 
 
 def frame_transfer_multiprocessor(input_folder: str,
                                   output_folder: str,
-                                  process_num: int = 10,
+                                  process_num: int = 0,
                                   text_color: str = "auto",
                                   bg_color="white",
-                                  mosaic: bool = False) -> List[multiprocessing.Process]:
-    # 创建一个队列
-    image_queue = multiprocessing.Queue()
-    for frame in sorted([file for file in os.listdir(input_folder) if file.endswith("jpg")]):
-        image_queue.put(frame)
+                                  mosaic: bool = False,
+                                  delta: bool = False,
+                                  color_tolerance: int = 0,
+                                  chunk_size: int = 0,
+                                  on_progress: Callable[[int], None] = None,
+                                  report: PipelineReport = None,
+                                  frames: List[str] = None,
+                                  manifest: JobManifest = None,
+                                  cache_options: dict = None,
+                                  text_size: int = 10,
+                                  block_size: int = 20,
+                                  columns: int = 0,
+                                  frame_format: str = "jpg",
+                                  frame_size: Tuple[int, int] = None,
+                                  palette: list = None) -> List[multiprocessing.Process]:
+    """
+    :param process_num: 0 表示按 CPU 核数和可用内存自动决定
+    :param chunk_size: 每块连续帧的帧数，0 表示按帧数和进程数自动决定
+    :param on_progress: 每当按序完成的帧数推进时回调，参数为已按序完成的帧数，可据此提前开始编码
+    :param report: 传入时汇总各 worker 的分阶段耗时、帧率、待处理帧数和峰值内存
+    :param frames: 只处理这些帧，None 表示 input_folder 下该格式的全部帧
+    :param manifest: 传入时把完成的帧定期写入任务清单，中断后可以从断点继续
+    :param cache_options: RenderCache 的参数，传入时重复的帧直接使用缓存的结果，None 表示不使用缓存
+    :param text_size: 每个字符格的边长（像素）
+    :param block_size: 马赛克块大小
+    :param columns: 字符网格列数，0 表示默认 100 列，行数按原画面比例计算
+    :param frame_format: 输入帧和输出帧的中间格式，见 frame_format.FRAME_FORMATS
+    :param frame_size: 输入帧的尺寸，raw 格式必须给出
+    :param palette: 调色板颜色 [(r, g, b), ...]，只在 text_color 为 auto 时生效，None 表示每格保留原色
+    """
+    if frames is None:
+        frames = sorted([file for file in os.listdir(input_folder) if file.endswith(frame_extension(frame_format))])
+    if not frames:
+        print("No frames to process.")
+        return []
+
+    if process_num > 0:
+        num_worker_processes = process_num
+    else:
+        # 只读第一帧的文件头取尺寸
+        input_size = frame_size
+        if input_size is None:
+            with Image.open(f"{input_folder}/{frames[0]}") as im:
+                input_size = im.size
+        num_worker_processes = default_process_num(frame_memory_bytes(input_size, text_size=text_size,
+                                                                      block_size=block_size, columns=columns,
+                                                                      mosaic=mosaic))
+    # 增量模式下块越长复用越多，先按每个进程一整段切分，负载不均时再靠偷取平衡
+    chunk_size = chunk_size or default_chunk_size(len(frames), num_worker_processes, chunks_per_process=1 if delta else 4)
+    scheduler = ChunkScheduler(len(frames), chunk_size)
+    result_queue = multiprocessing.Queue()
 
     # 创建并启动进程
-    num_worker_processes = process_num
     transfer_processes = []
     for i in range(num_worker_processes):
-        _process = WorkerProcess(image_queue, input_folder, output_folder, text_color=text_color, bg_color=bg_color, mosaic=mosaic)
+        _process = WorkerProcess(scheduler, frames, result_queue, input_folder, output_folder,
+                                 text_color=text_color, bg_color=bg_color, mosaic=mosaic,
+                                 delta=delta, color_tolerance=color_tolerance,
+                                 verbose=report is None or not report.live,
+                                 cache_options=cache_options,
+                                 text_size=text_size,
+                                 block_size=block_size,
+                                 columns=columns,
+                                 frame_format=frame_format,
+                                 frame_size=frame_size,
+                                 palette=palette)
         _process.start()
         transfer_processes.append(_process)
 
-    for i in range(num_worker_processes):
-        image_queue.put(None)
+    progress = OrderedProgress()
+    exited, reused_cells, total_cells, cache_hits, cache_misses = 0, 0, 0, 0, 0
+    while exited < num_worker_processes:
+        if report is not None:
+            report.sample(progress.done_num, len(frames), scheduler.remaining(), transfer_processes)
+        try:
+            kind, payload = result_queue.get(timeout=1)
+        except queue.Empty:
+            # worker 异常退出时不再等待
+            if not any(_process.is_alive() for _process in transfer_processes):
+                break
+            continue
+        if kind == "done":
+            if manifest is not None:
+                manifest.mark_done(frames[payload[0]:payload[1]])
+            watermark = progress.watermark
+            if progress.add(payload) > watermark and on_progress is not None:
+                on_progress(progress.watermark)
+        else:
+            exited += 1
+            reused_cells, total_cells = reused_cells + payload["reused_cells"], total_cells + payload["total_cells"]
+            if payload["cache"] is not None:
+                cache_hits, cache_misses = cache_hits + payload["cache"]["hits"], cache_misses + payload["cache"]["misses"]
+            if report is not None:
+                report.add_worker(payload)
 
     for _process in transfer_processes:
         _process.join()
+    if manifest is not None:
+        manifest.save()
 
-    print("All images have been processed.")
+    if report is not None:
+        report.sample(progress.done_num, len(frames), 0, force=True)
+        if report.live:
+            print()
+    if delta:
+        print(f"Cell reuse ratio: {reused_cells / total_cells if total_cells else 0:.2%} ({reused_cells}/{total_cells})")
+    if cache_options is not None:
+        print(f"Render cache: {cache_hits} hits, {cache_misses} misses")
+    print(f"All images have been processed. ({progress.done_num}/{len(frames)})")
     return transfer_processes
 
 
+def probe_video(ffprobe_path: str, video: str) -> dict:
+    """
+    :return: {"width": "720", "height": "1280", "r_frame_rate": "60/1"}
+    """
+    command_probe = [ffprobe_path, "-v", "error", "-select_streams", "v:0",
+                     "-show_entries", "stream=width,height,r_frame_rate",
+                     "-of", "default=noprint_wrappers=1", video]
+    output = subprocess.run(command_probe, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+    return dict(line.split("=", 1) for line in output.decode("utf-8").split() if "=" in line)
+
+
+def ffmpeg_binaries(installed_at: Union[str, Path]) -> Tuple[str, str]:
+    """
+    :return: (ffmpeg_path, ffprobe_path)，默认放在本项目根目录下
+    """
+    ffmpeg_path = f"{installed_at}/ffmpeg.exe" if psutil.WINDOWS else f"{installed_at}/ffmpeg"
+    ffprobe_path = f"{installed_at}/ffprobe.exe" if psutil.WINDOWS else f"{installed_at}/ffprobe"
+    return ffmpeg_path, ffprobe_path
+
+
+def out_video_path(video_path: Path, mosaic: bool = False) -> str:
+    return f"{video_path.parent}/out_{'mosaic' if mosaic else ''}_{video_path.name}"
+
+
+def get_video_rate(ffprobe_path: str, video: str) -> int:
+    # 获取视频帧率
+    command_get_rate = f"{ffprobe_path} -v error -select_streams v:0 -show_entries stream=r_frame_rate -of default=noprint_wrappers=1:nokey=1 {video}"
+
+    process = subprocess.Popen(command_get_rate, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = process.communicate()
+
+    rate, sec = output.decode('utf-8').split("/")
+    return int(int(rate) / int(sec))
+
+
+def extract_frames(ffmpeg_path: str, video: str, frames_folder: str, frame_format: str = "jpg") -> int:
+    command = [ffmpeg_path, "-i", video, *extract_options(frame_format), "-vsync", "0",
+               f"{frames_folder}/frame%08d.{frame_extension(frame_format)}"]
+    return subprocess.run(command).returncode
+
+
+def grab_frame(ffmpeg_path: str, video: str, seconds: float = 0.0, max_width: int = 0) -> FRAME:
+    """
+    取出 seconds 秒处的一帧（-ss 放在 -i 前按关键帧快速定位），不落盘；max_width 大于 0 时缩小到不超过该宽度
+    """
+    command = [ffmpeg_path, "-v", "error", "-ss", f"{max(seconds, 0.0)}", "-i", video, "-frames:v", "1"]
+    if max_width > 0:
+        command += ["-vf", f"scale='min(iw,{max_width})':-2"]
+    command += ["-f", "image2pipe", "-c:v", "bmp", "-"]
+    output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+    if not output:
+        raise ValueError(f"No frame at {seconds}s in {video}")
+    im = Image.open(io.BytesIO(output))
+    return im.convert("RGB")
+
+
+def rebuild_video(ffmpeg_path: str, rate: int, frames_folder: str, video: str, out_video: str,
+                  frame_format: str = "jpg", frame_size: Tuple[int, int] = None) -> Tuple[bytes, bytes]:
+    """
+    :param frame_size: 输出帧的尺寸，raw 格式必须给出
+    """
+    command_rebuild_video = f"{ffmpeg_path} -y -r {rate} {' '.join(input_options(frame_format, frame_size))} -i {frames_folder}/out_frame%08d.{frame_extension(frame_format)} -i {video} -map 0:v:0 -map \"1:a:0?\" -c:a copy -vf \"pad=ceil(iw/2)*2:ceil(ih/2)*2\" -c:v libx264 -pix_fmt yuv420p {out_video}"
+    # os.system()
+    rebuild_process = subprocess.Popen(command_rebuild_video, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return rebuild_process.communicate()
+
+
+def encode_segment(ffmpeg_path: str, rate: Union[int, str], frame_pattern: str, start_number: int, frame_count: int,
+                   out_segment: str, frame_input_options: List[str] = ()) -> int:
+    """
+    把 frame_pattern 中从 start_number 开始的 frame_count 帧编码成独立的一段：每段以关键帧开头、编码参数相同，
+    可以用 concat demuxer 无损拼接
+
+    :param frame_input_options: 读取帧序列的额外参数，见 frame_format.input_options
+    """
+    command = [ffmpeg_path, "-y", "-v", "error", "-r", f"{rate}", *frame_input_options,
+               "-start_number", f"{start_number}", "-i", frame_pattern,
+               "-frames:v", f"{frame_count}", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+               "-c:v", "libx264", "-pix_fmt", "yuv420p", out_segment]
+    return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).returncode
+
+
+def concat_segments(ffmpeg_path: str, segments: List[str], video: str, out_video: str) -> int:
+    # 按顺序直接拼接各段的视频流（不重新编码），再带上原视频的音轨
+    list_file = f"{os.path.dirname(segments[0])}/segments.txt"
+    with open(list_file, "w", encoding="utf-8") as f:
+        f.writelines(f"file '{Path(segment).resolve().as_posix()}'\n" for segment in segments)
+    command = [ffmpeg_path, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_file, "-i", video,
+               "-map", "0:v:0", "-map", "1:a:0?", "-c", "copy", out_video]
+    return subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE).returncode
+
+
+def clear_folder(folder: str) -> None:
+    for file in [f"{folder}/{file}" for file in os.listdir(folder)]:
+        os.remove(file)
+
+
 if __name__ in "__main__":
     parser = argparse.ArgumentParser(description="Transfer a normal video into ASCII one")
 
@@ -186,9 +965,59 @@ if __name__ in "__main__":
     parser.add_argument("--BG_COLOR", type=str, default="white",
                         help="Background color")
     parser.add_argument("--MOSAIC", type=str, help="Whether to apply mosaic effect", default="no")
-    parser.add_argument("--PROCESS_NUM", type=int, default=10, help="Number of processes to use")
+    parser.add_argument("--PROCESS_NUM", type=int, default=0,
+                        help="Number of processes to use. If 0, it is decided by CPU count and available memory")
     parser.add_argument("--DELETE_FRAMES_AFTER_PROCESSED", type=str, default="no",
                         help="Whether to delete frames after processing")
+    parser.add_argument("--STREAM", type=str, default="no",
+                        help="Whether to pipe raw frames through ffmpeg instead of dumping JPEG frames to disk. "
+                             "Does not support FRAME_FORMAT, PALETTE or DELTA")
+    parser.add_argument("--DELTA", type=str, default="no",
+                        help="Whether to only redraw the character cells that changed since the previous frame")
+    parser.add_argument("--COLOR_TOLERANCE", type=int, default=8,
+                        help="Max per-channel color change of a cell that is still treated as unchanged in DELTA mode")
+    parser.add_argument("--REPORT", type=str, default="",
+                        help="Path of a JSON report with per-stage timings, per-worker fps, queue depth and peak RSS")
+    parser.add_argument("--PROGRESS", type=str, default="no",
+                        help="Whether to show a live progress line instead of one line per frame")
+    parser.add_argument("--SERVICE", type=str, default="no",
+                        help="Submit the job to a running render_service.py instead of spawning workers. "
+                             "'yes' for the default address, or a socket path / host:port")
+    parser.add_argument("--CACHE", type=str, default="yes",
+                        help="Whether to reuse the rendered result of frames that are identical after downscaling")
+    parser.add_argument("--JOBS_DIR", type=str, default="",
+                        help="Folder of the resumable job state (extracted and rendered frames). If empty, 'jobs' next to this script")
+    parser.add_argument("--CACHE_DIR", type=str, default="",
+                        help="Folder of a persistent render cache shared between jobs. If empty, the cache lives in memory only")
+    parser.add_argument("--CACHE_SIZE_MB", type=int, default=1024,
+                        help="Size limit of the persistent render cache, the least recently used results are evicted first")
+    parser.add_argument("--SEGMENT_ENCODE", type=str, default="yes",
+                        help="Whether to encode fixed-length segments in parallel while frames are still rendering, "
+                             "then join them without re-encoding. If 'no', one encode runs after all frames are rendered")
+    parser.add_argument("--SEGMENT_FRAMES", type=int, default=240,
+                        help="Number of frames in each independently encoded segment")
+    parser.add_argument("--COLUMNS", type=str, default="100",
+                        help="Number of character columns, rows follow the aspect ratio. "
+                             "'auto' picks the largest grid that meets --TARGET_FPS or --DEADLINE")
+    parser.add_argument("--TEXT_SIZE", type=int, default=10,
+                        help="Width and height of one character cell in the output, in pixels")
+    parser.add_argument("--BLOCK_SIZE", type=int, default=20,
+                        help="Size of a mosaic block in source pixels")
+    parser.add_argument("--TARGET_FPS", type=float, default=0,
+                        help="Rendering throughput to reach in auto COLUMNS mode, in frames per second")
+    parser.add_argument("--DEADLINE", type=float, default=0,
+                        help="Seconds the whole conversion may take in auto COLUMNS mode, used when TARGET_FPS is 0")
+    parser.add_argument("--FRAME_FORMAT", type=str, default="jpg", choices=FRAME_FORMATS,
+                        help="Intermediate format of the extracted and rendered frames: max-quality 'jpg', fast-compressed 'png', "
+                             "uncompressed 'bmp' / 'ppm', or headerless 'raw' RGB that workers memory-map")
+    parser.add_argument("--PALETTE", type=str, default="none", choices=PALETTE_MODES,
+                        help="Limit the text colors to a palette: 'fixed' uniform RGB levels, or 'median' / 'kmeans' "
+                             "colors picked from sampled frames of the video. Only used when TEXT_COLOR is 'auto'")
+    parser.add_argument("--PALETTE_SIZE", type=int, default=16,
+                        help="Number of palette colors. 'fixed' uses the largest uniform cube that fits (8, 27, 64, 125, 216), "
+                             "so it needs at least 8")
+    parser.add_argument("--PLAY", type=str, default="no",
+                        help="Whether to play the video in the terminal with ANSI truecolor characters instead of converting it")
 
     # parse args
     args = parser.parse_args()
@@ -199,53 +1028,271 @@ if __name__ in "__main__":
     MOSAIC = True if args.MOSAIC == "yes" else False
     PROCESS_NUM = args.PROCESS_NUM
     DELETE_FRAMES_AFTER_PROCESSED = True if args.DELETE_FRAMES_AFTER_PROCESSED == "yes" else False
-
+    STREAM = True if args.STREAM == "yes" else False
+    DELTA = True if args.DELTA == "yes" else False
+    COLOR_TOLERANCE = args.COLOR_TOLERANCE
+    SERVICE = args.SERVICE
+    REPORT = args.REPORT
+    PROGRESS = True if args.PROGRESS == "yes" else False
+    PLAY = True if args.PLAY == "yes" else False
+    SEGMENT_ENCODE = True if args.SEGMENT_ENCODE == "yes" else False
+    SEGMENT_FRAMES = args.SEGMENT_FRAMES
+    AUTO_COLUMNS = args.COLUMNS == "auto"
+    COLUMNS = 0 if AUTO_COLUMNS else int(args.COLUMNS)
+    TEXT_SIZE = args.TEXT_SIZE
+    BLOCK_SIZE = args.BLOCK_SIZE
+    TARGET_FPS = args.TARGET_FPS
+    DEADLINE = args.DEADLINE
+    FRAME_FORMAT = args.FRAME_FORMAT
+    PALETTE = args.PALETTE if TEXT_COLOR == "auto" else "none"
+    PALETTE_SIZE = args.PALETTE_SIZE
+    if PALETTE == "fixed" and PALETTE_SIZE < 8:
+        print(f"PALETTE fixed needs PALETTE_SIZE of at least 8, got {PALETTE_SIZE}")
+        sys.exit(1)
+    start_time = time.perf_counter()
+    CACHE_OPTIONS = dict(disk_folder=args.CACHE_DIR, disk_limit=args.CACHE_SIZE_MB * 1024 * 1024) \
+        if args.CACHE == "yes" else None
 
 
     installed_at = Path(__file__).resolve().parent
     print(f"install {installed_at}-------------------{VIDEO}-----------------{psutil.WINDOWS}")
 
-    # 预设原视频帧文件夹/处理帧文件夹
-    tmp_frames_folder = f"{installed_at}/tmp_frames"
-    out_frames_folder = f"{installed_at}/out_frames"
-    if not os.path.exists(tmp_frames_folder):
-        os.mkdir(tmp_frames_folder)
-    if not os.path.exists(out_frames_folder):
-        os.mkdir(out_frames_folder)
+    ffmpeg_path, ffprobe_path = ffmpeg_binaries(installed_at)
+    out_video = out_video_path(video_path, MOSAIC)
+    if PROCESS_NUM <= 0:
+        # 按视频尺寸估算每个 worker 的内存，自动列数时先按默认 100 列估算
+        video_info = probe_video(ffprobe_path, VIDEO)
+        PROCESS_NUM = default_process_num(
+            frame_memory_bytes((int(video_info["width"]), int(video_info["height"])), text_size=TEXT_SIZE,
+                               block_size=BLOCK_SIZE, columns=COLUMNS, mosaic=MOSAIC) if "width" in video_info else 0)
 
+    if PLAY:
+        from terminal_player import play
 
-    # 获取视频帧率
-    ffprobe_path = f"{installed_at}/ffprobe.exe" if psutil.WINDOWS else f"{installed_at}/ffprobe"
-    command_get_rate = f"{ffprobe_path} -v error -select_streams v:0 -show_entries stream=r_frame_rate -of default=noprint_wrappers=1:nokey=1 {VIDEO}"
+        # 帧尺寸取自解码出的帧，旋转过的视频 ffmpeg 会自动转正
+        play(video=VIDEO,
+             ffmpeg_path=ffmpeg_path,
+             frame_size=grab_frame(ffmpeg_path, VIDEO).size,
+             rate=probe_video(ffprobe_path, VIDEO)["r_frame_rate"],
+             bg_color=BG_COLOR,
+             text_color=TEXT_COLOR,
+             mosaic=MOSAIC,
+             block_size=BLOCK_SIZE,
+             color_tolerance=COLOR_TOLERANCE)
+        sys.exit(0)
 
-    process = subprocess.Popen(command_get_rate, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, error = process.communicate()
+    if SERVICE != "no":
+        from render_service import connect_service, wait_job, parse_address, DEFAULT_ADDRESS
 
-    rate, sec = output.decode('utf-8').split("/")
-    VIDEO_RATE = int(int(rate) / int(sec))
+        # 渲染服务的 worker 只渲染默认网格的 jpg 帧，其它取值提交过去会被静默忽略
+        unsupported = [name for name, value, default in (("COLUMNS", args.COLUMNS, "100"), ("TEXT_SIZE", TEXT_SIZE, 10),
+                                                         ("BLOCK_SIZE", BLOCK_SIZE, 20), ("FRAME_FORMAT", FRAME_FORMAT, "jpg"),
+                                                         ("PALETTE", PALETTE, "none"))
+                       if value != default]
+        if unsupported:
+            print(f"The render service only renders the default grid, remove {', '.join(unsupported)} or drop SERVICE")
+            sys.exit(1)
+        service = connect_service(DEFAULT_ADDRESS if SERVICE == "yes" else parse_address(SERVICE))
+        if service is None:
+            print(f"Render service is not running at {SERVICE}")
+            sys.exit(1)
+        job_id = service.submit(VIDEO, text_color=TEXT_COLOR, bg_color=BG_COLOR, mosaic=MOSAIC, delta=DELTA,
+                                color_tolerance=COLOR_TOLERANCE,
+                                delete_frames_after_processed=DELETE_FRAMES_AFTER_PROCESSED)
+        job = wait_job(service, job_id)
+        print(f"Process Finished... result:{job['output']}, err: {job['error']}")
+        sys.exit(0 if job["state"] == "finished" else 1)
+
+    if STREAM:
+        from frame_stream import stream_transfer
+
+        # 流式模式不落盘、各帧独立渲染，没有中间帧格式，也不支持调色板和增量渲染
+        unsupported = [name for name, value, default in (("FRAME_FORMAT", FRAME_FORMAT, "jpg"), ("PALETTE", PALETTE, "none"),
+                                                         ("DELTA", DELTA, False))
+                       if value != default]
+        if unsupported:
+            print(f"STREAM does not support {', '.join(unsupported)}, remove them or drop STREAM")
+            sys.exit(1)
+        video_info = probe_video(ffprobe_path, VIDEO)
+        try:
+            # 尺寸取自解码出的帧：ffmpeg 会按旋转信息自动转正，ffprobe 报的是转正前的宽高
+            stream_transfer(video=VIDEO,
+                            output=out_video,
+                            ffmpeg_path=ffmpeg_path,
+                            frame_size=grab_frame(ffmpeg_path, VIDEO).size,
+                            rate=video_info["r_frame_rate"],
+                            process_num=PROCESS_NUM,
+                            text_size=TEXT_SIZE,
+                            block_size=BLOCK_SIZE,
+                            width=COLUMNS,
+                            text_color=TEXT_COLOR,
+                            bg_color=BG_COLOR,
+                            mosaic=MOSAIC)
+        except RuntimeError as e:
+            print(f"Stream conversion failed: {e}")
+            sys.exit(1)
+        sys.exit(0)
+
+    # 任务目录按视频内容区分：抽出的帧只和视频有关，输出帧再按渲染参数分目录，
+    # 只改 BG_COLOR 等参数重跑时可以直接复用抽好的帧
+    job_folder = f"{args.JOBS_DIR or f'{installed_at}/jobs'}/{video_hash(VIDEO)}"
+    tmp_frames_folder = f"{job_folder}/tmp_frames"
+    # 同一视频的其它转换结束后再开始，否则会清掉对方正在用的帧、同时写同一个清单
+    job_lock = JobLock(job_folder)
+    job_lock.acquire(on_wait=lambda: print(f"Waiting for another conversion of this video -----> {job_folder}"))
+    atexit.register(job_lock.release)
+    frames_manifest = JobManifest(job_folder, video=VIDEO, extracted=False)
+
+    def job_render_options(columns: int) -> dict:
+        # 影响渲染结果的参数，决定输出帧目录；调色板由模式、色数和（只取决于视频和这些参数的）采样帧决定
+        options = dict(text_color=TEXT_COLOR, bg_color=BG_COLOR, mosaic=MOSAIC, delta=DELTA,
+                       color_tolerance=COLOR_TOLERANCE if DELTA else 0, text_size=TEXT_SIZE, block_size=BLOCK_SIZE,
+                       columns=columns or 100, frame_format=FRAME_FORMAT)
+        if PALETTE != "none":
+            options.update(palette=PALETTE, palette_size=PALETTE_SIZE)
+        return options
+
+    # 自动列数的标定结果随计时波动，而列数决定输出帧目录，每次重新标定会让断点续跑和已转换判断都失效；
+    # 同样的渲染参数和目标下标定过一次就沿用，记在抽帧目录的清单里
+    CALIBRATE = AUTO_COLUMNS and (TARGET_FPS > 0 or DEADLINE > 0)
+    calibration_key = options_key(dict(job_render_options(0), columns="auto", target_fps=TARGET_FPS, deadline=DEADLINE,
+                                       process_num=args.PROCESS_NUM))
+    if CALIBRATE and calibration_key in frames_manifest.get("auto_columns", dict()):
+        COLUMNS = frames_manifest.get("auto_columns")[calibration_key]
+        CALIBRATE = False
+        print(f"Auto grid: {COLUMNS} columns from the previous calibration")
+
+    # 列数已确定时渲染参数在抽帧前就已确定，已经转换过就直接退出，不必重新抽帧
+    if not CALIBRATE \
+            and already_encoded(f"{job_folder}/{options_key(job_render_options(COLUMNS))}", out_video):
+        print(f"Already converted with the same options -----> {out_video}")
+        sys.exit(0)
+
+    report = PipelineReport(video=VIDEO,
+                            options=dict(text_color=TEXT_COLOR, bg_color=BG_COLOR, mosaic=MOSAIC, delta=DELTA,
+                                         color_tolerance=COLOR_TOLERANCE, process_num=PROCESS_NUM,
+                                         text_size=TEXT_SIZE, block_size=BLOCK_SIZE, columns=args.COLUMNS),
+                            live=PROGRESS)
+    VIDEO_RATE = get_video_rate(ffprobe_path, VIDEO)
     print(VIDEO_RATE, psutil.WINDOWS)
 
 
     #视频处理
-    ffmpeg_path = f"{installed_at}/ffmpeg.exe" if psutil.WINDOWS else f"{installed_at}/ffmpeg"
+    if not frames_manifest.get("extracted") or frames_manifest.get("frame_format", "jpg") != FRAME_FORMAT:
+        # 上次抽帧没有完成（残留的帧可能不完整）或格式不同，重新抽
+        os.makedirs(tmp_frames_folder, exist_ok=True)
+        clear_folder(tmp_frames_folder)
+        with report.timer.stage("extract"):
+            if extract_frames(ffmpeg_path, VIDEO, tmp_frames_folder, FRAME_FORMAT) != 0:
+                print(f"Failed to extract frames from {VIDEO}")
+                sys.exit(1)
+            # raw 帧没有文件头，按解码后的第一帧记下尺寸（已处理旋转）
+            frame_size = grab_frame(ffmpeg_path, VIDEO).size if FRAME_FORMAT == "raw" else None
+        frames_manifest.update(extracted=True, frame_format=FRAME_FORMAT, frame_size=frame_size)
+    else:
+        print(f"Reusing extracted frames -----> {tmp_frames_folder}")
+    FRAME_SIZE = tuple(frames_manifest.get("frame_size")) if FRAME_FORMAT == "raw" else None
+    all_frames = sorted([file for file in os.listdir(tmp_frames_folder) if file.endswith(frame_extension(FRAME_FORMAT))])
+
+    if CALIBRATE and all_frames:
+        from grid_calibration import sample_frames, calibrate_columns
+
+        # 截止时间扣掉已用去的时间，再给编码留两成
+        target_fps = TARGET_FPS or len(all_frames) / max((DEADLINE - (time.perf_counter() - start_time)) * 0.8, 1e-3)
+        parallelism = min(PROCESS_NUM, len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else psutil.cpu_count())
+        COLUMNS = calibrate_columns(sample_frames(tmp_frames_folder, all_frames, frame_format=FRAME_FORMAT, frame_size=FRAME_SIZE),
+                                    target_fps, parallelism, text_size=TEXT_SIZE, block_size=BLOCK_SIZE, mosaic=MOSAIC,
+                                    frame_format=FRAME_FORMAT)
+        print(f"Auto grid: {COLUMNS} columns for {target_fps:.1f} fps with {parallelism} processes")
+        frames_manifest.update(auto_columns=dict(frames_manifest.get("auto_columns", dict()), **{calibration_key: COLUMNS}))
+
+    PALETTE_COLORS = None
+    if PALETTE != "none" and all_frames:
+        PALETTE_COLORS = video_palette(tmp_frames_folder, all_frames, PALETTE, PALETTE_SIZE, block_size=BLOCK_SIZE,
+                                       columns=COLUMNS or 100, mosaic=MOSAIC, frame_format=FRAME_FORMAT,
+                                       frame_size=FRAME_SIZE)
+        print(f"Palette: {len(PALETTE_COLORS)} colors ({PALETTE})")
+
+    render_options = job_render_options(COLUMNS)
+    OUT_FRAME_SIZE = None
+    if FRAME_FORMAT == "raw":
+        grid_columns, grid_rows = char_grid_size(FRAME_SIZE, block_size=BLOCK_SIZE, width=COLUMNS, mosaic=MOSAIC)
+        OUT_FRAME_SIZE = (grid_columns * TEXT_SIZE, grid_rows * TEXT_SIZE)
+    out_frames_folder = f"{job_folder}/{options_key(render_options)}/out_frames"
+    os.makedirs(out_frames_folder, exist_ok=True)
+    render_manifest = JobManifest(os.path.dirname(out_frames_folder), options=render_options, encoded=None)
+
+    if already_encoded(os.path.dirname(out_frames_folder), out_video):
+        print(f"Already converted with the same options -----> {out_video}")
+        sys.exit(0)
+
+    pending_frames = render_manifest.pending_frames(all_frames, out_frames_folder,
+                                                    frame_validator(FRAME_FORMAT, OUT_FRAME_SIZE))
+    print(f"{len(all_frames) - len(pending_frames)}/{len(all_frames)} frames already rendered, {len(pending_frames)} to go")
+
+    segment_encoder, on_progress = None, None
+    if SEGMENT_ENCODE:
+        from segment_encoder import SegmentEncoder
+
+        segments_folder = f"{os.path.dirname(out_frames_folder)}/segments"
+        os.makedirs(segments_folder, exist_ok=True)
+        clear_folder(segments_folder)
+        segment_encoder = SegmentEncoder(ffmpeg_path, VIDEO_RATE, all_frames, out_frames_folder, segments_folder,
+                                         segment_frames=SEGMENT_FRAMES, frame_format=FRAME_FORMAT,
+                                         frame_size=OUT_FRAME_SIZE)
+
+        def on_progress(watermark: int) -> None:
+            # 水位线是待渲染帧里按序完成的数量，换算成全部帧里已就绪的前缀长度
+            ready = all_frames.index(pending_frames[watermark]) if watermark < len(pending_frames) else len(all_frames)
+            segment_encoder.on_ready(ready)
+
+        on_progress(0)
 
-    os.system(f"{ffmpeg_path} -i {VIDEO} -qscale:v 1 -qmin 1 -qmax 1 -vsync 0 {installed_at}/tmp_frames/frame%08d.jpg")
     processors = frame_transfer_multiprocessor(input_folder=tmp_frames_folder,
                                                output_folder=out_frames_folder,
                                                process_num=PROCESS_NUM,
                                                text_color=TEXT_COLOR,
                                                bg_color=BG_COLOR,
-                                               mosaic=MOSAIC)
+                                               mosaic=MOSAIC,
+                                               delta=DELTA,
+                                               color_tolerance=COLOR_TOLERANCE,
+                                               report=report,
+                                               frames=pending_frames,
+                                               manifest=render_manifest,
+                                               cache_options=CACHE_OPTIONS,
+                                               on_progress=on_progress,
+                                               text_size=TEXT_SIZE,
+                                               block_size=BLOCK_SIZE,
+                                               columns=COLUMNS,
+                                               frame_format=FRAME_FORMAT,
+                                               frame_size=FRAME_SIZE,
+                                               palette=PALETTE_COLORS.tolist() if PALETTE_COLORS is not None else None)
+    if len(render_manifest.done) < len(all_frames):
+        print(f"{len(all_frames) - len(render_manifest.done)} frames failed, run again to resume")
+        sys.exit(1)
 
 
-    command_rebuild_video = f"{ffmpeg_path} -r {VIDEO_RATE} -i {installed_at}/out_frames/out_frame%08d.jpg -i {VIDEO} -map 0:v:0 -map 1:a:0 -c:a copy -c:v libx264 -pix_fmt yuv420p {video_path.parent}/out_{'mosaic' if MOSAIC else ''}_{video_path.name}"
-    # os.system()
-    rebuild_process = subprocess.Popen(command_rebuild_video, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, error = rebuild_process.communicate()
+    # 先删掉旧的输出，编码后文件存在即说明编码成功
+    if os.path.exists(out_video):
+        os.remove(out_video)
+    with report.timer.stage("encode"):
+        if segment_encoder is not None:
+            # 大部分分段已在渲染期间编码完成，这里只剩最后一段和拼接
+            output, error = segment_encoder.join(VIDEO, out_video), b""
+        else:
+            output, error = rebuild_video(ffmpeg_path, VIDEO_RATE, out_frames_folder, VIDEO, out_video,
+                                          FRAME_FORMAT, OUT_FRAME_SIZE)
     print(f"Process Finished... result:{output}, err: {error}")
+    if os.path.exists(out_video):
+        render_manifest.update(encoded=dict(output=out_video, size=os.path.getsize(out_video)))
+    if REPORT:
+        report.write(REPORT)
+        print(f"Report -----> {REPORT}")
     if DELETE_FRAMES_AFTER_PROCESSED:
-        for tmp_frame in [f"{tmp_frames_folder}/{file}" for file in os.listdir(tmp_frames_folder)]:
-            os.remove(tmp_frame)
-
-        for out_frame in [f"{out_frames_folder}/{file}" for file in os.listdir(out_frames_folder)]:
-            os.remove(out_frame)
+        clear_folder(tmp_frames_folder)
+        clear_folder(out_frames_folder)
+        if segment_encoder is not None:
+            clear_folder(segments_folder)
+        frames_manifest.update(extracted=False)
+        render_manifest.done.clear()
+        render_manifest.save()